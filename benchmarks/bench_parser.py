@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Benchmarks framing, decoding and end-to-end parsing of synthetic VMU931 streams, without hardware.
+
+For each stream (see streams.py) and decode mode, reports packets and bytes processed per second (best of several
+runs), the parser's per-packet latency from read to delivery, and memory use in a separate run (as tracing slows
+everything down):
+
+- the peak memory traced by tracemalloc while processing, which is the mode's working set (read buffers, the batch of
+  decoded packets and the like). Packets are discarded once counted, so it barely grows with the length of the stream.
+- the number of memory blocks left allocated by processing, per packet (from sys.getallocatedblocks(), after garbage
+  collection). This counts what each packet leaves behind (e.g. history storage, or leaks) rather than short-lived
+  allocations, which Python doesn't count.
+
+Usage: python benchmarks/bench_parser.py [--samples N] [--repeat N] [--batch N] [--stream NAME] [--mode NAME] [--json]
+"""
+import argparse
+import gc
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+import pyvmu.decoders as decoders
+from pyvmu.framing import FrameBuffer
+from pyvmu.history import PacketHistory
+from pyvmu.transport import Transport
+from pyvmu.vmu931 import VMU931Parser
+
+import streams
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+READ_SIZE = 4096
+
+
+class ReplayTransport(Transport):
+    """
+    Serves a prepared byte stream from memory. Status requests are answered with the given status frame, so the
+    parser's handshake completes. Blocking reads raise EOFError once the stream is exhausted.
+    """
+    def __init__(self, status_frame):
+        self._status_frame = status_frame
+        self._replies = b''
+        self._written = b''
+        self._data = b''
+        self._position = 0
+
+    def load(self, data):
+        self._data = data
+        self._position = 0
+
+    @property
+    def in_waiting(self):
+        return len(self._replies) + len(self._data) - self._position
+
+    def read(self, size=1):
+        if self._replies:
+            data, self._replies = self._replies[:size], self._replies[size:]
+            return data
+
+        data = self._data[self._position:self._position + size]
+        if not data and self.timeout is None:
+            raise EOFError("End of benchmark stream")
+        self._position += len(data)
+        return data
+
+    def write(self, data):
+        # Commands are written a byte at a time.
+        self._written = (self._written + data)[-4:]
+        if self._written == b'vars':
+            self._replies += self._status_frame
+        return len(data)
+
+
+def _parser(data, status_frame):
+    """
+    Returns a parser connected to a ReplayTransport serving `data`, with the streams in the status frame enabled.
+    """
+    status = decoders.decode(status_frame)
+    transport = ReplayTransport(status_frame)
+    parser = VMU931Parser(transport=transport,
+                          accelerometer=status.accelerometer_streaming,
+                          magnetometer=status.magnetometer_streaming,
+                          gyroscope=status.gyroscope_streaming,
+                          euler=status.euler_streaming,
+                          quaternion=status.quaternions_streaming,
+                          heading=status.heading_streaming)
+    transport.load(data)
+    parser.metrics.reset()
+    return parser
+
+
+def _split_frames(data, status_frame):
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(data)
+    return frame_buffer.frames()
+
+
+def run_framing(data, batch_size):
+    frame_buffer = FrameBuffer()
+    packets = 0
+    for start in range(0, len(data), READ_SIZE):
+        frame_buffer.feed(data[start:start + READ_SIZE])
+        packets += len(frame_buffer.frames())
+    return packets
+
+
+def run_decode(frames, batch_size):
+    return sum(1 for packet in map(decoders.decode, frames) if packet is not None)
+
+
+def run_parse(parser, batch_size):
+    packets = 0
+    try:
+        while True:
+            if parser.parse() is not None:
+                packets += 1
+    except EOFError:
+        pass
+    return packets
+
+
+def run_parse_many(parser, batch_size):
+    packets = 0
+    while True:
+        batch = parser.parse_many(max_packets=batch_size, timeout=0)
+        if not batch:
+            return packets
+        packets += len(batch)
+
+
+def run_parse_arrays(parser, batch_size):
+    packets = 0
+    while parser.ser.in_waiting or parser.pending:
+        packets += sum(len(array) for array in parser.parse_arrays(max_packets=batch_size, timeout=0).values())
+    return packets
+
+
+def _parser_and_history(data, status_frame):
+    # The history's storage is allocated up front, so isn't counted against parse_into().
+    history = PacketHistory(100000)
+    for decoder in decoders.DECODERS.values():
+        history[decoder.message_type]
+    return _parser(data, status_frame), history
+
+
+def run_parse_into(state, batch_size):
+    parser, history = state
+    packets = 0
+    while parser.ser.in_waiting or parser.pending:
+        packets += parser.parse_into(history, max_packets=batch_size, timeout=0)
+    return packets
+
+
+# Decode modes: name -> (setup, run). setup(data, status_frame) isn't timed; run(state, batch_size) returns the number
+# of packets decoded.
+MODES = {
+    'framing': (lambda data, status_frame: data, run_framing),
+    'decode': (_split_frames, run_decode),
+    'parse': (_parser, run_parse),
+    'parse_many': (_parser, run_parse_many),
+    'parse_arrays': (_parser, run_parse_arrays),
+    'parse_into': (_parser_and_history, run_parse_into),
+}
+
+
+def benchmark(mode, data, status_frame, repeat, batch_size):
+    """
+    Runs a decode mode over a stream.
+
+    :return: dict of results
+    """
+    setup, run = MODES[mode]
+
+    best = None
+    for _ in range(repeat):
+        state = setup(data, status_frame)
+        start = time.perf_counter()
+        packets = run(state, batch_size)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, packets, state)
+
+    elapsed, packets, state = best
+    result = {
+        'packets': packets,
+        'seconds': elapsed,
+        'packets_per_second': packets / elapsed,
+        'bytes_per_second': len(data) / elapsed,
+    }
+
+    parser = state[0] if isinstance(state, tuple) else state
+    if isinstance(parser, VMU931Parser):
+        latency = parser.metrics.latency
+        result['latency_p50_us'] = latency.percentile(0.5) * 1e6 if latency.count else None
+        result['latency_p99_us'] = latency.percentile(0.99) * 1e6 if latency.count else None
+        result['resync_bytes'] = parser.metrics.frame_buffer.skipped_bytes
+        result['resyncs'] = parser.metrics.frame_buffer.resyncs
+        result['resync_packets_lost'] = parser.metrics.frame_buffer.resync_packets_lost
+        result['bad_footers'] = parser.metrics.frame_buffer.bad_footers
+
+    # Measurement starts after setup, so only memory allocated while processing is counted.
+    state = setup(data, status_frame)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    packets = run(state, batch_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    result['peak_traced_bytes'] = peak
+    result['retained_blocks_per_packet'] = (sys.getallocatedblocks() - blocks) / packets if packets else None
+
+    return result
+
+
+def _format(value, scale=1.0, digits=0):
+    return '-' if value is None else '{:,.{}f}'.format(value * scale, digits)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    argument_parser.add_argument('--samples', type=int, default=20000, help="samples of each stream per run")
+    argument_parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark (the best is reported)")
+    argument_parser.add_argument('--batch', type=int, default=256,
+                                 help="maximum packets per call in batch modes (parse_many, parse_arrays, parse_into)")
+    argument_parser.add_argument('--stream', action='append', choices=sorted(streams.STREAMS),
+                                 help="stream(s) to benchmark (default: all)")
+    argument_parser.add_argument('--mode', action='append', choices=sorted(MODES),
+                                 help="decode mode(s) to benchmark (default: all)")
+    argument_parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = argument_parser.parse_args()
+
+    # Resynchronising on the corrupted streams logs warnings, which would swamp the results.
+    logging.disable(logging.WARNING)
+
+    modes = args.mode or [mode for mode in MODES if mode != 'parse_arrays' or numpy is not None]
+    results = {}
+    for stream in args.stream or sorted(streams.STREAMS):
+        data, status_frame = streams.STREAMS[stream](args.samples)
+        results[stream] = {mode: benchmark(mode, data, status_frame, args.repeat, args.batch) for mode in modes}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    header = "{:<10} {:<13} {:>10} {:>12} {:>10} {:>9} {:>9} {:>12} {:>11}"
+    print(header.format("stream", "mode", "packets", "packets/s", "MB/s", "p50 us", "p99 us", "peak KiB",
+                        "blocks/pkt"))
+    for stream, stream_results in results.items():
+        for mode, result in stream_results.items():
+            print(header.format(stream, mode, result['packets'],
+                                _format(result['packets_per_second']),
+                                _format(result['bytes_per_second'], 1e-6, 1),
+                                _format(result.get('latency_p50_us')),
+                                _format(result.get('latency_p99_us')),
+                                _format(result['peak_traced_bytes'], 1 / 1024.0, 1),
+                                _format(result['retained_blocks_per_packet'], 1.0, 2)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Synthetic VMU931 byte streams for benchmarking, built with the device simulator.
+
+Every builder returns ``(data, status_frame)``: the stream of bytes the host would read, and the status frame the
+device reports (with the streams used enabled), for completing the parser's handshake.
+"""
+import random
+from pyvmu.simulator import SimulatedVMU931, STREAM_BITS
+from pyvmu.framing import FRAME_END
+
+DEFAULT_STREAMS = 'agceqh'
+
+
+def _frames(samples, streams=DEFAULT_STREAMS, rate=1000):
+    """
+    Returns the individual frames of `samples` samples of each stream, in the order the device sends them, along with
+    the device's status frame.
+    """
+    simulator = SimulatedVMU931(rate=rate, streams=streams)
+    bits = [STREAM_BITS[stream] for stream in DEFAULT_STREAMS if stream in streams]
+    frames = []
+    for sample in range(samples):
+        t = sample / float(rate)
+        for bit in bits:
+            frames.append(simulator.sample_frames(t, bit))
+    return frames, simulator.status_frame()
+
+
+def mixed(samples, streams=DEFAULT_STREAMS):
+    """
+    Clean stream with every message type interleaved.
+    """
+    frames, status = _frames(samples, streams)
+    return b''.join(frames), status
+
+
+def corrupt_footers(samples, streams=DEFAULT_STREAMS, fraction=0.01, seed=0):
+    """
+    Mixed stream where a fraction of frames have an invalid footer.
+    """
+    rng = random.Random(seed)
+    frames, status = _frames(samples, streams)
+    for index in range(len(frames)):
+        if rng.random() < fraction:
+            frame = bytearray(frames[index])
+            frame[-1] = FRAME_END ^ 0xFF
+            frames[index] = bytes(frame)
+    return b''.join(frames), status
+
+
+def midstream(samples, streams=DEFAULT_STREAMS, bursts=0.005, seed=0):
+    """
+    Mixed stream joined part way through a frame, with bursts of random bytes (which may contain start bytes) between
+    a fraction of frames, so the parser has to resynchronise repeatedly.
+    """
+    rng = random.Random(seed)
+    frames, status = _frames(samples, streams)
+    chunks = [frames[0][rng.randrange(1, len(frames[0])):]]
+    for frame in frames[1:]:
+        if rng.random() < bursts:
+            chunks.append(bytes(rng.randrange(256) for _ in range(rng.randrange(1, 64))))
+        chunks.append(frame)
+    return b''.join(chunks), status
+
+
+def with_status(samples, streams=DEFAULT_STREAMS, every=100):
+    """
+    Mixed stream with a status frame after every `every` samples, as when the host polls the device's status.
+    """
+    frames, status = _frames(samples, streams)
+    per_sample = len([stream for stream in DEFAULT_STREAMS if stream in streams])
+    chunks = []
+    for index in range(0, len(frames), per_sample * every):
+        chunks.extend(frames[index:index + per_sample * every])
+        chunks.append(status)
+    return b''.join(chunks), status
+
+
+STREAMS = {
+    'mixed': mixed,
+    'corrupt': corrupt_footers,
+    'midstream': midstream,
+    'status': with_status,
+}
@@ -27,30 +27,26 @@ y_points = []
 z_points = []
 
 with VMU931Parser(euler=True) as vp:
+    print(vp.device_status)
 
-    while True:
-        pkt = vp.parse()
-
-        if isinstance(pkt, messages.Status):
-            print(pkt)
+    # Read from the device on a background thread, so that slow redraws don't cause packets to be lost.
+    vp.start()
 
-        if isinstance(pkt, messages.Euler):
-            ts, x, y, z = pkt
+    while True:
+        for ts, x, y, z in vp.drain(messages.Euler):
             ts_points.append(ts)
             x_points.append(x)
             y_points.append(y)
             z_points.append(z)
 
-        # Only plot every 10 points (still quite smooth), otherwise we risk being bottle-necked by matplotlib.
-        if len(ts_points) % 10 == 0:
-            # set_data is faster than drawing a whole new line
-            x_line.set_data(ts_points[-1000:], x_points[-1000:])
-            y_line.set_data(ts_points[-1000:], y_points[-1000:])
-            z_line.set_data(ts_points[-1000:], z_points[-1000:])
+        # set_data is faster than drawing a whole new line
+        x_line.set_data(ts_points[-1000:], x_points[-1000:])
+        y_line.set_data(ts_points[-1000:], y_points[-1000:])
+        z_line.set_data(ts_points[-1000:], z_points[-1000:])
 
-            euler_axes.relim()
-            euler_axes.autoscale_view()
-            figure.canvas.draw()
+        euler_axes.relim()
+        euler_axes.autoscale_view()
+        figure.canvas.draw()
 
-            # Pause to force redraw. Actually blocks until re-draw is complete, 0.00001 is an arbitrary small number.
-            plt.pause(0.00001)
+        # Pause to force redraw. Actually blocks until re-draw is complete, 0.00001 is an arbitrary small number.
+        plt.pause(0.00001)
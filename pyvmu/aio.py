@@ -0,0 +1,394 @@
+import asyncio
+import io
+import logging
+import pyvmu.decoders as decoders
+from pyvmu.framing import FrameBuffer
+from pyvmu.transport import SerialTransport
+from pyvmu.vmu931 import VMU931Parser, STATUS_TYPE
+
+# Queued once the parser is closed, to wake consumers waiting in parse().
+_CLOSED = object()
+
+
+class AsyncVMU931Parser(object):
+    """
+    asyncio variant of VMU931Parser. The serial port is read without blocking from an event loop reader callback, and
+    command pacing uses asyncio.sleep, so the event loop is never blocked. Transports without a file descriptor (e.g.
+    a SimulatedTransport) are polled from a task instead.
+
+    Typical usage::
+
+        async with AsyncVMU931Parser(device="/dev/ttyACM0", euler=True) as vmu:
+            async for packet in vmu:
+                print(packet)
+    """
+    command_interval = VMU931Parser.command_interval
+
+    def __init__(self,
+                 device="/dev/tty.usbmodem1411",
+                 accelerometer=False,
+                 magnetometer=False,
+                 gyroscope=False,
+                 euler=False,
+                 quaternion=False,
+                 heading=False,
+                 block_size=4096,
+                 queue_size=0,
+                 command_timeout=1.0,
+                 timeout=None,
+                 transport=None,
+                 poll_interval=0.002
+                 ):
+        """
+        Prepares a connection to the VMU931 device. The device is opened by open(), or on entering an `async with`
+        block.
+
+        :param device: Serial device name (on Windows) or path (nix, including OS X).
+        :param accelerometer: Enable/disable accelerometer data streaming.
+        :param magnetometer: Enable/disable magnetometer data streaming.
+        :param gyroscope: Enable/disable gyroscope data streaming.
+        :param euler: Enable/disable euler angle data streaming.
+        :param quaternion: Enable/disable quaternion data streaming.
+        :param heading: Enable/disable compass heading data streaming.
+        :param block_size: Maximum number of bytes to pull from the serial port in a single read.
+        :param queue_size: Maximum number of decoded packets waiting to be consumed (0 for unlimited). Packets arriving
+                           while the queue is full are dropped and counted in `dropped`.
+        :param command_timeout: Maximum time (in seconds) to wait for the device to confirm a command.
+        :param timeout: Maximum time (in seconds) for open() to wait for the device to report its status before raising
+                        TimeoutError. None waits indefinitely.
+        :param transport: Transport to talk to the device over (see pyvmu.transport), e.g. a SimulatedTransport. If not
+                          given, the serial port named by `device` is opened.
+        :param poll_interval: Interval (in seconds) at which the transport is polled if it has no file descriptor
+        """
+        self.device = device
+        self.transport = transport
+        self.poll_interval = poll_interval
+        self.streams = dict(accelerometer=accelerometer, magnetometer=magnetometer, gyroscope=gyroscope, euler=euler,
+                            quaternion=quaternion, heading=heading)
+        self.block_size = block_size
+        self.queue_size = queue_size
+        self.command_timeout = command_timeout
+        self.timeout = timeout
+        self.ser = None
+        self.device_status = None
+        self.dropped = 0
+        self._loop = None
+        self._error = None
+        self._fd = None
+        self._poller = None
+        self._frame_buffer = FrameBuffer()
+        self._queue = None
+        self._status_count = 0
+        self._status_received = None
+
+    async def open(self):
+        """
+        Opens the serial port (or the transport given to the constructor), waits for the device status and configures
+        the data streams requested in the constructor.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._error = None
+        self._queue = asyncio.Queue(self.queue_size)
+        self._status_received = asyncio.Event()
+
+        self.ser = self.transport if self.transport is not None else SerialTransport(self.device)
+        # timeout=0 makes reads return whatever is available rather than blocking.
+        self.ser.timeout = 0
+        try:
+            self._fd = self.ser.fileno()
+        except io.UnsupportedOperation:
+            self._poller = self._loop.create_task(self._poll())
+        else:
+            self._loop.add_reader(self._fd, self._on_readable)
+
+        await self.request_status()
+        try:
+            await asyncio.wait_for(self._status_received.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            raise TimeoutError("No status received from VMU931 within {} seconds".format(self.timeout))
+        self._check_open()
+
+        await self.configure(**self.streams)
+
+    def close(self):
+        """
+        Stops reading from and closes the serial port (or transport). Packets already queued can still be retrieved,
+        after which parse() raises.
+        """
+        if self.ser is None:
+            return
+
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        self.ser.close()
+        self.ser = None
+        # Wake anything waiting for a status, so it sees the closure.
+        self._status_received.set()
+
+        try:
+            self._queue.put_nowait(_CLOSED)
+        except asyncio.QueueFull:
+            # parse() checks for closure before waiting, so a full queue needs no wake-up.
+            pass
+
+    def _check_open(self):
+        """
+        Raises the exception that closed the connection, or EOFError if it was closed by close().
+        """
+        if self.ser is None:
+            if self._error is not None:
+                raise self._error
+            raise EOFError("Connection to VMU931 is closed")
+
+    def _fail(self, error):
+        """
+        Closes the connection after a read error, keeping the exception for parse() to raise.
+        """
+        logging.exception("Error reading from VMU931, closing")
+        self._error = error
+        self.close()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, t, value, traceback):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.parse()
+        except EOFError:
+            # Closed by close() or at the end of a FileTransport, rather than by a read error.
+            raise StopAsyncIteration
+
+    async def parse(self):
+        """
+        Waits for and returns the next packet from the VMU931 device.
+
+        Once the connection is closed and every queued packet has been returned, raises the exception that closed it
+        (e.g. serial.SerialException if the device was unplugged), or EOFError if it was closed by close() or the
+        transport ran out of data. Iterating with ``async for`` stops on EOFError rather than raising it.
+
+        :return: processed packet
+        """
+        if self._queue is None or (self.ser is None and self._queue.empty()):
+            self._check_open()
+
+        packet = await self._queue.get()
+        if packet is _CLOSED:
+            # Put it back for any other consumer waiting.
+            self._queue.put_nowait(_CLOSED)
+            self._check_open()
+        return packet
+
+    async def set_quaternion(self, state):
+        """
+        Enable/disable streaming of quaternion data.
+
+        :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
+        """
+        return await self.configure(quaternion=state)
+
+    async def set_euler(self, state):
+        """
+        Enable/disable streaming of euler angle data.
+
+        :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
+        """
+        return await self.configure(euler=state)
+
+    async def set_accelerometer(self, state):
+        """
+        Enable/disable streaming of accelerometer data.
+
+        :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
+        """
+        return await self.configure(accelerometer=state)
+
+    async def set_magnetometer(self, state):
+        """
+        Enable/disable streaming of magnetometer data.
+
+        :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
+        """
+        return await self.configure(magnetometer=state)
+
+    async def set_gyroscope(self, state):
+        """
+        Enable/disable streaming of gyroscope data.
+
+        :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
+        """
+        return await self.configure(gyroscope=state)
+
+    async def set_heading(self, state):
+        """
+        Enable/disable streaming of compass heading data.
+
+        :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
+        """
+        return await self.configure(heading=state)
+
+    async def configure(self,
+                        accelerometer=None,
+                        magnetometer=None,
+                        gyroscope=None,
+                        euler=None,
+                        quaternion=None,
+                        heading=None):
+        """
+        Enable/disable several data streams at once, with a single status request to confirm the new configuration.
+        Streams given as None are left unchanged.
+
+        :param accelerometer: Enable/disable accelerometer data streaming.
+        :param magnetometer: Enable/disable magnetometer data streaming.
+        :param gyroscope: Enable/disable gyroscope data streaming.
+        :param euler: Enable/disable euler angle data streaming.
+        :param quaternion: Enable/disable quaternion data streaming.
+        :param heading: Enable/disable compass heading data streaming.
+        :return: True if the device confirmed the configuration, False if it didn't within command_timeout
+        """
+        assert self.device_status is not None, "Device status is not set"
+
+        changes = [(field, state, command) for field, state, command in (
+            ('accelerometer_streaming', accelerometer, 'vara'),
+            ('magnetometer_streaming', magnetometer, 'varc'),
+            ('gyroscope_streaming', gyroscope, 'varg'),
+            ('euler_streaming', euler, 'vare'),
+            ('quaternions_streaming', quaternion, 'varq'),
+            ('heading_streaming', heading, 'varh'),
+        ) if state is not None and getattr(self.device_status, field) != state]
+
+        if not changes:
+            return True
+
+        seen = self._status_count
+        for _, _, command in changes:
+            await self._send_message(command, update_status=False)
+        await self.request_status()
+
+        return await self._wait_for_status(seen, lambda status: all(getattr(status, field) == state
+                                                                    for field, state, _ in changes))
+
+    async def request_status(self):
+        """
+        Request a new status packet from the VMU931
+        """
+        logging.info("Requesting status update")
+        await self._send_message("vars", update_status=False)
+
+    async def calibrate(self):
+        """
+        Calibrate the VMU931 (be sure to lay the device on a flat surface, with Z axis pointing upward)
+        """
+        logging.info("Requesting calibration...")
+        await self._send_message("varl", update_status=False)
+
+    async def _send_message(self, message, update_status=True):
+        """
+        Sends a message to the VMU931 device, pausing between each character without blocking the event loop.
+
+        :param message: Message to send to device
+        :param update_status: Update sensor status after message send, waiting until it is received (defaults to True)
+        :return: True if the status update was received (or not requested), False if it timed out
+        """
+        self._check_open()
+        seen = self._status_count
+
+        for c in message.encode('ascii'):
+            self._check_open()
+            self.ser.write(bytes([c]))
+            await asyncio.sleep(self.command_interval)
+
+        if update_status:
+            await self.request_status()
+            return await self._wait_for_status(seen)
+
+        return True
+
+    async def _wait_for_status(self, seen, confirm=None):
+        """
+        Waits for a status packet to arrive.
+
+        :param seen: Value of self._status_count before the status was requested
+        :param confirm: Function called with each status received, returning True once it's the one we want
+        :return: True if the status was received, False if we timed out
+        """
+        deadline = self._loop.time() + self.command_timeout
+
+        while True:
+            self._check_open()
+            if self._status_count > seen:
+                if confirm is None or confirm(self.device_status):
+                    return True
+                seen = self._status_count
+
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                logging.warning("Timed out waiting for status from VMU931")
+                return False
+
+            self._status_received.clear()
+            try:
+                await asyncio.wait_for(self._status_received.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self):
+        """
+        Reads from a transport without a file descriptor every `poll_interval` seconds, in place of a reader callback.
+        """
+        while self.ser is not None:
+            try:
+                waiting = self.ser.in_waiting
+            except OSError as e:
+                self._fail(e)
+                return
+            if waiting:
+                self._on_readable()
+            await asyncio.sleep(self.poll_interval)
+
+    def _on_readable(self):
+        """
+        Event loop reader callback: reads whatever is available and queues the decoded packets.
+        """
+        try:
+            data = self.ser.read(self.block_size)
+        except (OSError, EOFError) as e:
+            # serial.SerialException is an OSError; EOFError is raised at the end of a FileTransport.
+            self._fail(e)
+            return
+
+        self._frame_buffer.feed(data)
+        for frame in self._frame_buffer.frames():
+            packet = decoders.decode(frame)
+            if packet is None:
+                continue
+
+            if frame[2] == STATUS_TYPE:
+                self.device_status = packet
+                self._status_count += 1
+                self._status_received.set()
+            elif self.device_status is None:
+                # Discard data until we know what state the device is in.
+                continue
+
+            try:
+                self._queue.put_nowait(packet)
+            except asyncio.QueueFull:
+                self.dropped += 1
@@ -0,0 +1,189 @@
+"""
+Alignment of the separate VMU931 data streams into one record per tick.
+
+The device sends each enabled stream as its own packet, each with its own timestamp. Aligner groups packets whose
+timestamps are within a tolerance of each other into messages.AlignedFrame records. Streams are delivered in order, so
+once a stream has sent a later packet, a group still missing that stream is emitted without it. A watermark and a bound
+on the number of pending groups make sure groups are emitted even if a stream stops altogether, keeping memory use and
+added latency bounded.
+
+Timestamps are unwrapped (see pyvmu.clock.TimestampUnwrapper) before being compared, so alignment carries on across
+the wrap-around of the device's 32 bit millisecond counter.
+"""
+import collections
+import pyvmu.messages as messages
+from pyvmu.clock import TimestampUnwrapper, WRAP
+
+# AlignedFrame field holding each message type.
+FIELDS = {
+    messages.Accelerometer: 'accelerometer',
+    messages.Gyroscope: 'gyroscope',
+    messages.Magnetometer: 'magnetometer',
+    messages.Euler: 'euler',
+    messages.Quaternion: 'quaternion',
+    messages.Heading: 'heading',
+}
+
+
+def streams_from_status(status):
+    """
+    Returns the message types a device is streaming, according to its status.
+
+    :param status: messages.Status, e.g. VMU931Parser.device_status
+    :return: set of message types
+    """
+    flags = {
+        messages.Accelerometer: status.accelerometer_streaming,
+        messages.Gyroscope: status.gyroscope_streaming,
+        messages.Magnetometer: status.magnetometer_streaming,
+        messages.Euler: status.euler_streaming,
+        messages.Quaternion: status.quaternions_streaming,
+        messages.Heading: status.heading_streaming,
+    }
+    return {message_type for message_type, streaming in flags.items() if streaming}
+
+
+class Aligner(object):
+    """
+    Groups packets from several streams into messages.AlignedFrame records, emitted in timestamp order. Fields for
+    streams that aren't expected, or whose packet was lost, are None.
+
+    Status packets pushed to the aligner update the set of expected streams, so the output of VMU931Parser.parse() can
+    be pushed as is.
+    """
+    def __init__(self, streams, tolerance=0, max_delay=100, max_pending=64):
+        """
+        :param streams: Message types expected, or a messages.Status (e.g. VMU931Parser.device_status) to take them
+                        from
+        :param tolerance: Maximum difference (in device milliseconds) between timestamps of packets in the same frame
+        :param max_delay: Groups older than the newest timestamp seen by more than this many milliseconds are emitted
+                          even if incomplete (the watermark). None disables the watermark.
+        :param max_pending: Maximum number of groups held; the oldest is emitted when exceeded
+        """
+        assert max_pending > 0, "max_pending must be positive"
+
+        self.tolerance = tolerance
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.partial_frames = 0
+
+        self._pending = collections.deque()
+        self._last_timestamps = {}
+        self._newest = None
+        self._unwrapper = TimestampUnwrapper()
+        self.set_streams(streams)
+
+    def set_streams(self, streams):
+        """
+        Changes the set of expected streams.
+
+        :param streams: Message types expected, or a messages.Status to take them from
+        """
+        if isinstance(streams, messages.Status):
+            streams = streams_from_status(streams)
+        self.streams = frozenset(streams)
+        assert all(message_type in FIELDS for message_type in self.streams), "Only data streams can be aligned"
+
+    def push(self, packet):
+        """
+        Adds a packet.
+
+        :param packet: Packet returned by VMU931Parser.parse()
+        :return: list of messages.AlignedFrame completed by this packet (often empty)
+        """
+        message_type = type(packet)
+        if message_type is messages.Status:
+            self.set_streams(packet)
+            return self._flush()
+
+        if message_type not in self.streams:
+            return []
+
+        timestamp = self._unwrapper.unwrap(packet.timestamp)
+        self._last_timestamps[message_type] = timestamp
+        if self._newest is None or timestamp > self._newest:
+            self._newest = timestamp
+
+        # Packets usually belong to one of the newest groups, so search from the end.
+        for group_timestamp, group in reversed(self._pending):
+            if message_type not in group and abs(timestamp - group_timestamp) <= self.tolerance:
+                group[message_type] = packet
+                break
+            if group_timestamp < timestamp - self.tolerance:
+                self._insert(timestamp, packet)
+                break
+        else:
+            self._insert(timestamp, packet)
+
+        return self._flush()
+
+    def _insert(self, timestamp, packet):
+        """
+        Starts a new group, keeping the pending groups ordered by timestamp.
+        """
+        group = (timestamp, {type(packet): packet})
+        pending = self._pending
+        if not pending or pending[-1][0] <= timestamp:
+            pending.append(group)
+            return
+
+        index = len(pending)
+        while index and pending[index - 1][0] > timestamp:
+            index -= 1
+        pending.insert(index, group)
+
+    def _is_final(self, group_timestamp, group):
+        """
+        Whether a group can't receive any more packets.
+        """
+        for message_type in self.streams:
+            if message_type in group:
+                continue
+            last = self._last_timestamps.get(message_type)
+            if last is None or last <= group_timestamp + self.tolerance:
+                return False
+        return True
+
+    def _flush(self):
+        """
+        Emits groups from the head of the queue while they are complete, final, beyond the watermark or over the bound.
+        """
+        frames = []
+        pending = self._pending
+        watermark = None if self.max_delay is None or self._newest is None else self._newest - self.max_delay
+        while pending:
+            group_timestamp, group = pending[0]
+            if not (len(pending) > self.max_pending
+                    or (watermark is not None and group_timestamp < watermark)
+                    or self._is_final(group_timestamp, group)):
+                break
+
+            pending.popleft()
+            frames.append(self._frame(group_timestamp, group))
+
+        return frames
+
+    def _frame(self, timestamp, group):
+        """
+        Builds an AlignedFrame from a group of packets, stamped with the device timestamp of its first packet.
+        """
+        if not self.streams.issubset(group):
+            self.partial_frames += 1
+
+        fields = dict.fromkeys(FIELDS.values())
+        for message_type, packet in group.items():
+            fields[FIELDS[message_type]] = packet
+        return messages.AlignedFrame(timestamp=timestamp % WRAP, **fields)
+
+    def flush(self):
+        """
+        Emits every pending group, complete or not (e.g. at the end of a capture).
+
+        :return: list of messages.AlignedFrame
+        """
+        frames = [self._frame(timestamp, group) for timestamp, group in self._pending]
+        self._pending.clear()
+        return frames
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,254 @@
+"""
+Correction of accelerometer, gyroscope and magnetometer samples on the host.
+
+A SensorCalibration corrects a sensor's samples as ``matrix * (raw - bias)``. For the accelerometer and gyroscope, the
+bias is the zero offset and the matrix corrects scale, cross-axis sensitivity and misalignment; for the magnetometer,
+they are the hard-iron offset and the soft-iron correction. The matrix can also convert units (e.g. g to m/s^2).
+
+A Calibration holds one SensorCalibration per sensor, or one per resolution setting for the accelerometer and
+gyroscope, since their errors differ between ranges. Passed to VMU931Parser as `calibration`, it is applied as packets
+are decoded, using the resolutions the device had reported when each packet was received.
+
+fit_ellipsoid() estimates magnetometer parameters from samples recorded while turning the device through as many
+orientations as possible (e.g. a capture replayed with CaptureReader), and fit_bias() estimates a gyroscope bias from
+samples recorded at rest.
+
+Correcting individual packets has no dependencies; correcting arrays and fitting require NumPy (install with
+``pip install PyVMU[numpy]``).
+"""
+import pyvmu.messages as messages
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STANDARD_GRAVITY = 9.80665
+
+# Field of messages.Status holding the resolution each sensor is set to.
+RESOLUTION_FIELDS = {
+    messages.Accelerometer: 'accelerometer_resolution',
+    messages.Gyroscope: 'gyroscope_resolution',
+}
+
+IDENTITY = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch calibration (pip install PyVMU[numpy])")
+
+
+def _xyz(samples):
+    """
+    Returns samples as an (N, 3) float64 array.
+
+    :param samples: Structured array with x, y and z fields (e.g. from VMU931Parser.parse_arrays()), (N, 3) array or
+                    list of packets
+    """
+    if isinstance(samples, list) and samples and hasattr(samples[0], 'x'):
+        return np.array([(sample.x, sample.y, sample.z) for sample in samples], dtype=np.float64)
+
+    samples = np.asarray(samples)
+    if samples.dtype.names:
+        return np.stack([samples[axis] for axis in ('x', 'y', 'z')], axis=-1).astype(np.float64)
+    return samples.astype(np.float64).reshape(-1, 3)
+
+
+class SensorCalibration(object):
+    """
+    Correction of a three-axis sensor's samples, computed as ``scale * matrix * (raw - bias)``.
+    """
+    def __init__(self, bias=None, matrix=None, scale=1.0):
+        """
+        :param bias: Offset subtracted from raw samples, as (x, y, z). Defaults to zero.
+        :param matrix: 3x3 correction matrix (scale factors, cross-axis sensitivity, soft-iron...), as a sequence of
+                       rows. Defaults to the identity.
+        :param scale: Factor the matrix is multiplied by, e.g. STANDARD_GRAVITY to output m/s^2 rather than g
+        """
+        bias = (0.0, 0.0, 0.0) if bias is None else tuple(float(b) for b in bias)
+        matrix = IDENTITY if matrix is None else matrix
+        matrix = tuple(tuple(float(m * scale) for m in row) for row in matrix)
+        assert len(bias) == 3 and len(matrix) == 3 and all(len(row) == 3 for row in matrix), \
+            "bias must have 3 components and matrix must be 3x3"
+
+        self.bias = bias
+        self.matrix = matrix
+
+    def __repr__(self):
+        return "SensorCalibration(bias={}, matrix={})".format(self.bias, self.matrix)
+
+    def apply(self, packet):
+        """
+        Corrects a single sample.
+
+        :param packet: Packet with timestamp, x, y and z fields (e.g. messages.Magnetometer)
+        :return: Packet of the same type, with corrected x, y and z
+        """
+        timestamp, x, y, z = packet
+        bx, by, bz = self.bias
+        x -= bx
+        y -= by
+        z -= bz
+        (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = self.matrix
+        return packet.__class__(timestamp,
+                                m00 * x + m01 * y + m02 * z,
+                                m10 * x + m11 * y + m12 * z,
+                                m20 * x + m21 * y + m22 * z)
+
+    def apply_array(self, samples):
+        """
+        Corrects an array of samples with a single matrix product. Requires NumPy.
+
+        :param samples: Structured array with x, y and z fields (e.g. from VMU931Parser.parse_arrays()), or (N, 3)
+                        array
+        :return: Array of the same kind (a copy) holding corrected samples
+        """
+        _require_numpy()
+        samples = np.asarray(samples)
+        matrix = np.array(self.matrix)
+        # matrix * (raw - bias) == matrix * raw - matrix * bias, so the bias is folded into a single offset.
+        corrected = _xyz(samples).dot(matrix.T)
+        corrected -= matrix.dot(self.bias)
+
+        if not samples.dtype.names:
+            return corrected.reshape(np.shape(samples))
+
+        result = samples.copy()
+        for index, axis in enumerate(('x', 'y', 'z')):
+            result[axis] = corrected[:, index]
+        return result
+
+
+class Calibration(object):
+    """
+    Corrections for the accelerometer, gyroscope and magnetometer. Packets of other types are left unchanged.
+    """
+    def __init__(self, accelerometer=None, gyroscope=None, magnetometer=None):
+        """
+        :param accelerometer: SensorCalibration, or dict mapping accelerometer resolution (2, 4, 8 or 16 g) to
+                              SensorCalibration. Samples taken at resolutions missing from the dict aren't corrected.
+        :param gyroscope: SensorCalibration, or dict mapping gyroscope resolution (250, 500, 1000 or 2000 dps) to
+                          SensorCalibration
+        :param magnetometer: SensorCalibration, e.g. as returned by fit_ellipsoid()
+        """
+        self.sensors = {}
+        for message_type, calibration in ((messages.Accelerometer, accelerometer),
+                                          (messages.Gyroscope, gyroscope),
+                                          (messages.Magnetometer, magnetometer)):
+            if calibration is not None:
+                assert message_type in RESOLUTION_FIELDS or not isinstance(calibration, dict), \
+                    "{} calibration can't depend on resolution".format(message_type.__name__)
+                self.sensors[message_type] = calibration
+
+    def select(self, status=None):
+        """
+        Returns the calibration in use for each sensor.
+
+        :param status: messages.Status reported by the device, giving the accelerometer and gyroscope resolutions. If
+                       None, per-resolution calibrations aren't applied.
+        :return: dict mapping message type to SensorCalibration
+        """
+        selected = {}
+        for message_type, calibration in self.sensors.items():
+            if isinstance(calibration, dict):
+                resolution = None if status is None else getattr(status, RESOLUTION_FIELDS[message_type])
+                calibration = calibration.get(resolution)
+            if calibration is not None:
+                selected[message_type] = calibration
+        return selected
+
+    def apply(self, packet, status=None):
+        """
+        Corrects a single packet.
+
+        :param packet: Packet, e.g. as returned by VMU931Parser.parse()
+        :param status: messages.Status reported by the device
+        :return: Corrected packet, or `packet` itself if it isn't corrected
+        """
+        calibration = self.sensors.get(type(packet))
+        if isinstance(calibration, dict):
+            calibration = calibration.get(None if status is None else getattr(status, RESOLUTION_FIELDS[type(packet)]))
+        return packet if calibration is None else calibration.apply(packet)
+
+    def apply_many(self, packets, status=None):
+        """
+        Corrects a list of packets, e.g. as returned by VMU931Parser.parse_many().
+
+        :param packets: Packets to correct
+        :param status: messages.Status reported by the device
+        :return: list of packets
+        """
+        selected = self.select(status)
+        corrected = []
+        for packet in packets:
+            calibration = selected.get(type(packet))
+            corrected.append(packet if calibration is None else calibration.apply(packet))
+        return corrected
+
+    def apply_arrays(self, arrays, status=None):
+        """
+        Corrects structured arrays, as returned by VMU931Parser.parse_arrays(). Requires NumPy.
+
+        :param arrays: dict mapping message type to structured array
+        :param status: messages.Status reported by the device
+        :return: dict mapping message type to structured array, corrected where applicable
+        """
+        selected = self.select(status)
+        return {message_type: selected[message_type].apply_array(array) if message_type in selected else array
+                for message_type, array in arrays.items()}
+
+
+def fit_bias(samples):
+    """
+    Estimates a sensor's bias as the mean of samples recorded with the device at rest. Suits the gyroscope, whose
+    output should then be zero. Requires NumPy.
+
+    :param samples: Structured array with x, y and z fields, (N, 3) array or list of packets
+    :return: SensorCalibration
+    """
+    _require_numpy()
+    return SensorCalibration(bias=_xyz(samples).mean(axis=0))
+
+
+def fit_ellipsoid(samples, field_strength=None):
+    """
+    Estimates hard-iron and soft-iron corrections from magnetometer samples, by least-squares fitting an ellipsoid to
+    them: in a constant field, corrected samples should lie on a sphere centred on the origin. The samples must cover
+    as many orientations as possible. Requires NumPy.
+
+    Also suits the accelerometer, with samples taken at rest in many orientations and a field_strength of 1 (g).
+
+    :param samples: Structured array with x, y and z fields (e.g. from CaptureReader.array(messages.Magnetometer)),
+                    (N, 3) array or list of packets
+    :param field_strength: Magnitude of corrected samples. Defaults to the mean radius of the fitted ellipsoid, so the
+                           corrected samples stay in the sensor's units.
+    :return: SensorCalibration
+    """
+    _require_numpy()
+    xyz = _xyz(samples)
+    assert len(xyz) >= 9, "At least 9 samples are needed to fit an ellipsoid"
+
+    # Fit x'Ax + 2g'x = 1 over the general quadric's 9 coefficients.
+    x, y, z = xyz.T
+    design = np.column_stack([x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z])
+    v, _, rank, _ = np.linalg.lstsq(design, np.ones(len(xyz)), rcond=None)
+    if rank < design.shape[1]:
+        raise ValueError("Samples don't fit an ellipsoid; they must cover more orientations")
+
+    a = np.array([[v[0], v[3], v[4]],
+                  [v[3], v[1], v[5]],
+                  [v[4], v[5], v[2]]])
+    centre = -np.linalg.solve(a, v[6:])
+
+    # Shifted to its centre, the ellipsoid is x'Ax = 1 + c'Ac.
+    eigenvalues, eigenvectors = np.linalg.eigh(a / (1.0 + centre.dot(a).dot(centre)))
+    if np.any(eigenvalues <= 0):
+        raise ValueError("Samples don't fit an ellipsoid; they must cover more orientations")
+
+    # The symmetric square root of the shape matrix maps the ellipsoid onto the unit sphere.
+    radii = 1.0 / np.sqrt(eigenvalues)
+    if field_strength is None:
+        field_strength = np.prod(radii) ** (1.0 / 3)
+    matrix = eigenvectors.dot(np.diag(np.sqrt(eigenvalues))).dot(eigenvectors.T)
+    return SensorCalibration(bias=centre, matrix=matrix, scale=field_strength)
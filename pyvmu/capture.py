@@ -0,0 +1,185 @@
+"""
+Recording and replay of raw VMU931 frames.
+
+A capture file starts with a 16 byte header: the magic string ``PYVMUCAP``, a little-endian uint16 format version, a
+little-endian uint16 record size and 4 reserved bytes. It is followed by fixed-size records, each holding the host
+receive time (little-endian float64, seconds since the epoch) and the raw frame exactly as received from the device,
+zero-padded to fill the record. Since every record is the same size, record ``i`` lives at
+``16 + i * record_size`` and no separate index is needed. Frames too long for a record (e.g. text frames) are skipped
+and counted rather than recorded.
+"""
+import logging
+import mmap
+import struct
+import pyvmu.columnar as columnar
+import pyvmu.decoders as decoders
+
+MAGIC = b'PYVMUCAP'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4x')
+HOST_TIME = struct.Struct('<d')
+
+# Room for the largest VMU931 frame (a 24 byte quaternion) with some to spare.
+DEFAULT_RECORD_SIZE = 40
+
+
+class CaptureWriter(object):
+    """
+    Appends raw frames to a capture file. Can be passed to VMU931Parser as `recorder` to record a live session.
+    """
+    def __init__(self, path, record_size=DEFAULT_RECORD_SIZE):
+        """
+        Creates (or truncates) a capture file.
+
+        :param path: Path of the capture file
+        :param record_size: Size of each record. Frames longer than this, less the host time, are skipped.
+        """
+        self.record_size = record_size
+        self.count = 0
+        self.skipped = 0
+        self._padding = bytes(record_size)
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, record_size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def write(self, frame, host_time):
+        """
+        Appends a frame to the capture.
+
+        :param frame: Frame bytes, header and footer included
+        :param host_time: Time the frame was received by the host (seconds since the epoch)
+        :return: True if the frame was recorded, False if it was skipped because it doesn't fit in a record
+        """
+        length = HOST_TIME.size + len(frame)
+        if length > self.record_size:
+            if not self.skipped:
+                logging.warning("Skipping frames that don't fit in a {} byte capture record (first of {} bytes)"
+                                .format(self.record_size, len(frame)))
+            self.skipped += 1
+            return False
+
+        self._file.write(HOST_TIME.pack(host_time))
+        self._file.write(frame)
+        self._file.write(self._padding[length:])
+        self.count += 1
+        return True
+
+    def flush(self):
+        """
+        Flushes buffered records to disk.
+        """
+        self._file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the capture file.
+        """
+        self._file.close()
+
+
+class CaptureReader(object):
+    """
+    Reads a capture file written by CaptureWriter. The file is memory-mapped rather than loaded, so captures larger
+    than RAM can be replayed.
+    """
+    def __init__(self, path):
+        """
+        Opens and memory-maps a capture file.
+
+        :param path: Path of the capture file
+        """
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.record_size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError("{} is not a PyVMU capture file".format(path))
+        if version != VERSION:
+            raise ValueError("Unsupported capture file version {}".format(version))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return (len(self._mmap) - HEADER.size) // self.record_size
+
+    def __iter__(self):
+        """
+        Iterates over the packets in the capture, decoded by the same code as live data.
+        """
+        for _, frame in self.frames():
+            packet = decoders.decode(frame)
+            if packet is not None:
+                yield packet
+
+    def frame(self, index):
+        """
+        Returns a single record from the capture.
+
+        :param index: Record number
+        :return: (host receive time, frame bytes) tuple
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("Record index out of range")
+
+        offset = HEADER.size + index * self.record_size
+        host_time, = HOST_TIME.unpack_from(self._mmap, offset)
+        start = offset + HOST_TIME.size
+        return host_time, self._mmap[start:start + self._mmap[start + 1]]
+
+    def frames(self):
+        """
+        Generator yielding every record in the capture.
+
+        :return: (host receive time, frame bytes) tuples
+        """
+        for index in range(len(self)):
+            yield self.frame(index)
+
+    def records(self, message_type):
+        """
+        Returns a structured NumPy array viewing every record in the capture as `message_type`, without copying.
+        Alongside the message's own fields, `host_time` holds the receive time and `type` the frame's type byte, which
+        must be checked since records of every type are included. Requires NumPy.
+
+        :param message_type: Message type, e.g. messages.Euler
+        :return: numpy structured array backed by the memory-mapped file
+        """
+        packed = columnar.dtype(message_type)
+        offset = HOST_TIME.size + columnar.PAYLOAD_OFFSET
+        record = columnar.np.dtype({
+            'names': ('host_time', 'type') + packed.names,
+            'formats': ['<f8', 'u1'] + [packed.fields[name][0] for name in packed.names],
+            'offsets': [0, HOST_TIME.size + 2] + [packed.fields[name][1] + offset for name in packed.names],
+            'itemsize': self.record_size,
+        })
+        return columnar.np.frombuffer(self._mmap, dtype=record, count=len(self), offset=HEADER.size)
+
+    def array(self, message_type):
+        """
+        Returns the samples of one message type as a packed structured array (as produced by
+        VMU931Parser.parse_arrays(), with an extra `host_time` field). Only the matching samples are copied out of the
+        file. Requires NumPy.
+
+        :param message_type: Message type, e.g. messages.Euler
+        :return: numpy structured array
+        """
+        type_byte = {cls: byte for byte, cls in columnar.MESSAGE_TYPES.items()}[message_type]
+        records = self.records(message_type)
+        packed = columnar.np.dtype([('host_time', '<f8')] + columnar.FIELDS[message_type])
+        return records[records['type'] == type_byte][list(packed.names)].astype(packed)
+
+    def close(self):
+        """
+        Closes the capture file. Any arrays returned by records() must have been released first.
+        """
+        self._mmap.close()
+        self._file.close()
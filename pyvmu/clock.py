@@ -0,0 +1,187 @@
+"""
+Relating VMU931 timestamps to host time.
+
+Device timestamps are 32 bit millisecond counters, which wrap around after about 49.7 days and drift relative to the
+host clock. TimestampUnwrapper extends them to monotonic 64 bit values, and ClockSync estimates the device-to-host
+offset and drift with a running least-squares fit of host arrival times against device time, so each packet can be
+given a host epoch time. synchronise() does the same over recorded arrays (e.g. from CaptureReader.records()).
+
+Arrival times include the transport latency, so the estimated offset includes the average latency too.
+"""
+import pyvmu.messages as messages
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WRAP = 1 << 32
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch clock synchronisation (pip install PyVMU[numpy])")
+
+
+class TimestampUnwrapper(object):
+    """
+    Extends 32 bit device timestamps to monotonic 64 bit values.
+
+    Consecutive timestamps are compared modulo 2**32, so wrap-around is detected regardless of where it occurs. Small
+    backward steps (e.g. between interleaved streams) are treated as such rather than as a wrap.
+    """
+    def __init__(self):
+        self._last = None
+        self._unwrapped = 0
+
+    def unwrap(self, timestamp):
+        """
+        :param timestamp: Device timestamp in milliseconds (0 to 2**32 - 1)
+        :return: Unwrapped timestamp in milliseconds
+        """
+        if self._last is None:
+            self._last = timestamp
+            self._unwrapped = timestamp
+            return timestamp
+
+        delta = (timestamp - self._last) % WRAP
+        if delta >= WRAP // 2:
+            # Behind the latest timestamp seen.
+            return self._unwrapped - (WRAP - delta)
+
+        self._last = timestamp
+        self._unwrapped += delta
+        return self._unwrapped
+
+
+def unwrap_array(timestamps, start=None):
+    """
+    Vectorised equivalent of TimestampUnwrapper. Requires NumPy.
+
+    :param timestamps: Array of device timestamps in milliseconds, in arrival order
+    :param start: Unwrapped value of the first timestamp. Defaults to the timestamp itself.
+    :return: int64 array of unwrapped timestamps
+    """
+    _require_numpy()
+    timestamps = np.asarray(timestamps).astype(np.int64)
+    if not len(timestamps):
+        return timestamps
+
+    # Signed difference modulo 2**32 between consecutive timestamps.
+    deltas = (np.diff(timestamps) + WRAP // 2) % WRAP - WRAP // 2
+    unwrapped = np.empty_like(timestamps)
+    unwrapped[0] = timestamps[0] if start is None else start
+    np.cumsum(deltas, out=unwrapped[1:])
+    unwrapped[1:] += unwrapped[0]
+    return unwrapped
+
+
+class ClockSync(object):
+    """
+    Online estimate of host time from device time, fitted as ``host = offset + (1 + drift) * device`` by exponentially
+    weighted least squares over (device time, host arrival time) observations. Each observation costs a handful of
+    arithmetic operations.
+    """
+    def __init__(self, window=10000):
+        """
+        :param window: Approximate number of recent observations the fit is based on, so the estimate can follow
+                       changes in drift (e.g. as the device warms up)
+        """
+        assert window > 1, "window must be greater than 1"
+
+        self.unwrapper = TimestampUnwrapper()
+        self._decay = 1.0 - 1.0 / window
+        self._origin = None
+        self._weight = self._sum_x = self._sum_y = self._sum_xx = self._sum_xy = 0.0
+        self._intercept = 0.0
+        self.drift = 0.0
+
+    def observe(self, timestamp, host_time):
+        """
+        Adds an observation. For the best estimate, host_time should be taken as soon as possible after the packet is
+        received.
+
+        :param timestamp: Device timestamp in milliseconds, as sent by the device
+        :param host_time: Host epoch time (e.g. time.time()) at which the packet was received
+        :return: Unwrapped device timestamp in milliseconds
+        """
+        unwrapped = self.unwrapper.unwrap(timestamp)
+        if self._origin is None:
+            self._origin = (unwrapped, host_time)
+
+        # Work relative to the first observation, in seconds, to keep the sums well conditioned.
+        x = (unwrapped - self._origin[0]) / 1000.0
+        y = host_time - self._origin[1] - x
+
+        decay = self._decay
+        self._weight = self._weight * decay + 1.0
+        self._sum_x = self._sum_x * decay + x
+        self._sum_y = self._sum_y * decay + y
+        self._sum_xx = self._sum_xx * decay + x * x
+        self._sum_xy = self._sum_xy * decay + x * y
+
+        denominator = self._weight * self._sum_xx - self._sum_x * self._sum_x
+        if denominator > 1e-12 * self._weight * self._weight:
+            self.drift = (self._weight * self._sum_xy - self._sum_x * self._sum_y) / denominator
+        self._intercept = (self._sum_y - self.drift * self._sum_x) / self._weight
+        return unwrapped
+
+    @property
+    def synchronised(self):
+        """
+        Whether any observations have been made.
+        """
+        return self._origin is not None
+
+    def host_time(self, unwrapped):
+        """
+        Estimates the host epoch time at which the device produced a timestamp.
+
+        :param unwrapped: Unwrapped device timestamp in milliseconds, as returned by observe()
+        :return: Host epoch time in seconds
+        """
+        assert self.synchronised, "No observations have been made"
+        x = (unwrapped - self._origin[0]) / 1000.0
+        return self._origin[1] + x + self._intercept + self.drift * x
+
+    def stamp(self, packet, host_time=None):
+        """
+        Attaches unwrapped device time and estimated host time to a packet.
+
+        :param packet: Packet returned by VMU931Parser.parse()
+        :param host_time: If given, the packet's arrival time, which is added as an observation first
+        :return: messages.TimedPacket. Packets without a timestamp (status packets) get host_time as their host time.
+        """
+        timestamp = getattr(packet, 'timestamp', None)
+        if timestamp is None:
+            return messages.TimedPacket(host_time, None, packet)
+
+        if host_time is not None:
+            unwrapped = self.observe(timestamp, host_time)
+        else:
+            unwrapped = self.unwrapper.unwrap(timestamp)
+        return messages.TimedPacket(self.host_time(unwrapped), unwrapped, packet)
+
+
+def synchronise(timestamps, host_times):
+    """
+    Batch equivalent of ClockSync, fitting a single offset and drift over a whole recording. Requires NumPy.
+
+    :param timestamps: Array of device timestamps in milliseconds, in arrival order
+    :param host_times: Array of host epoch times at which each packet was received (e.g. the host_time field of
+                       CaptureReader.records())
+    :return: (unwrapped device timestamps, estimated host epoch times) arrays
+    """
+    _require_numpy()
+    unwrapped = unwrap_array(timestamps)
+    host_times = np.asarray(host_times, dtype=np.float64)
+    if len(unwrapped) < 2:
+        return unwrapped, host_times.copy()
+
+    x = (unwrapped - unwrapped[0]) / 1000.0
+    y = host_times - host_times[0] - x
+    if np.ptp(x) > 0:
+        drift, intercept = np.polyfit(x, y, 1)
+    else:
+        drift, intercept = 0.0, y.mean()
+    return unwrapped, host_times[0] + x + intercept + drift * x
@@ -0,0 +1,103 @@
+"""
+Vectorised decoding of VMU931 frames into NumPy structured arrays.
+
+NumPy is an optional dependency (install with ``pip install PyVMU[numpy]``); this module can be imported without it,
+but decoding will raise an ImportError.
+"""
+import logging
+import pyvmu.messages as messages
+import pyvmu.decoders as decoders
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Big-endian field layout of each data message's payload, following the VMU931 User Guide.
+FIELDS = {
+    messages.Accelerometer: [('timestamp', '>u4'), ('x', '>f4'), ('y', '>f4'), ('z', '>f4')],
+    messages.Magnetometer: [('timestamp', '>u4'), ('x', '>f4'), ('y', '>f4'), ('z', '>f4')],
+    messages.Gyroscope: [('timestamp', '>u4'), ('x', '>f4'), ('y', '>f4'), ('z', '>f4')],
+    messages.Euler: [('timestamp', '>u4'), ('x', '>f4'), ('y', '>f4'), ('z', '>f4')],
+    messages.Quaternion: [('timestamp', '>u4'), ('w', '>f4'), ('x', '>f4'), ('y', '>f4'), ('z', '>f4')],
+    messages.Heading: [('timestamp', '>u4'), ('h', '>f4')],
+}
+
+# Type bytes of the message types above, as registered with pyvmu.decoders.
+MESSAGE_TYPES = {type_byte: decoder.message_type for type_byte, decoder in decoders.DECODERS.items()
+                 if decoder.message_type in FIELDS}
+
+PAYLOAD_OFFSET = decoders.PAYLOAD_OFFSET
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for columnar decoding (pip install PyVMU[numpy])")
+
+
+def dtype(message_type):
+    """
+    Returns the packed big-endian structured dtype for a message type.
+
+    :param message_type: Message namedtuple class, e.g. messages.Euler
+    :return: numpy.dtype
+    """
+    _require_numpy()
+    return np.dtype(FIELDS[message_type])
+
+
+def framed_dtype(message_type, offset=PAYLOAD_OFFSET, itemsize=None):
+    """
+    Returns a structured dtype that reads a message type's fields in place from a larger fixed-size record, such as a
+    whole frame. Viewing a buffer of records through it requires no copying.
+
+    :param message_type: Message namedtuple class, e.g. messages.Euler
+    :param offset: Offset of the payload within each record
+    :param itemsize: Size of each record. Defaults to a whole frame (payload plus header and footer).
+    :return: numpy.dtype
+    """
+    packed = dtype(message_type)
+    if itemsize is None:
+        itemsize = packed.itemsize + offset + 1
+
+    return np.dtype({
+        'names': packed.names,
+        'formats': [packed.fields[name][0] for name in packed.names],
+        'offsets': [packed.fields[name][1] + offset for name in packed.names],
+        'itemsize': itemsize,
+    })
+
+
+def decode_frames(frames):
+    """
+    Decodes a batch of frames into one structured array per message type.
+
+    Frames of each type are concatenated and reinterpreted with a single np.frombuffer call, so no per-sample objects
+    are created. Status frames, unknown message types and frames too short for their type are skipped.
+
+    :param frames: Iterable of complete frames (bytes, header and footer included)
+    :return: dict mapping message type (e.g. messages.Euler) to a packed, big-endian structured array
+    """
+    _require_numpy()
+
+    # Frames are grouped by length as well as type, so every group can be viewed with a single fixed-size dtype.
+    grouped = {}
+    for frame in frames:
+        grouped.setdefault((frame[2], len(frame)), []).append(frame)
+
+    chunks = {}
+    for (type_byte, length), typed_frames in grouped.items():
+        message_type = MESSAGE_TYPES.get(type_byte)
+        if message_type is None:
+            continue
+
+        packed = dtype(message_type)
+        if length < packed.itemsize + PAYLOAD_OFFSET + 1:
+            logging.warning("Skipping %d %s frames that are too short", len(typed_frames), message_type.__name__)
+            continue
+
+        record = framed_dtype(message_type, itemsize=length)
+        chunks.setdefault(message_type, []).append(np.frombuffer(b''.join(typed_frames), dtype=record).astype(packed))
+
+    return {message_type: parts[0] if len(parts) == 1 else np.concatenate(parts)
+            for message_type, parts in chunks.items()}
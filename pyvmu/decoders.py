@@ -0,0 +1,203 @@
+"""
+Table of decoders for VMU931 message types, keyed by the type byte of the frame.
+
+Each decoder pairs a precompiled struct.Struct describing the message payload with a factory building the message from
+the unpacked values. Additional (e.g. firmware-specific) message types can be supported by calling register().
+
+encode_frame() and encode_status() go the other way, for the simulator and for passing a status on as it was received.
+"""
+import logging
+import struct
+from collections import namedtuple
+import pyvmu.messages as messages
+
+Decoder = namedtuple('Decoder', ['message_type', 'struct', 'factory'])
+
+DECODERS = {}
+
+# Size of a whole frame of each registered message type, header and footer included, keyed by type byte.
+FRAME_SIZES = {}
+
+# Unknown type bytes we've already warned about, so we don't log for every packet.
+_unknown_types = set()
+
+FRAME_START = 0x01
+FRAME_END = 0x04
+
+# Start byte, size byte and type byte precede the payload; a single footer byte follows it.
+FRAME_OVERHEAD = 4
+
+# Offset of the payload within a frame (start, size and type bytes precede it).
+PAYLOAD_OFFSET = 3
+
+# Bit set in the status message's streaming field for each stream, keyed by the command character that toggles it.
+STREAM_BITS = {
+    'a': 0b00000001,
+    'g': 0b00000010,
+    'q': 0b00000100,
+    'c': 0b00001000,
+    'e': 0b00010000,
+    'h': 0b01000000,
+}
+
+# messages.Status field reporting each stream, keyed by the command character that toggles it.
+STREAM_FIELDS = {
+    'a': 'accelerometer_streaming',
+    'g': 'gyroscope_streaming',
+    'q': 'quaternions_streaming',
+    'c': 'magnetometer_streaming',
+    'e': 'euler_streaming',
+    'h': 'heading_streaming',
+}
+
+GYROSCOPE_RESOLUTION_BITS = {250: 0b00010000, 500: 0b00100000, 1000: 0b01000000, 2000: 0b10000000}
+ACCELEROMETER_RESOLUTION_BITS = {2: 0b00000001, 4: 0b00000010, 8: 0b00000100, 16: 0b00001000}
+
+
+def register(type_char, message_type, fmt, factory=None):
+    """
+    Registers (or replaces) the decoder for a message type.
+
+    :param type_char: Message type character sent by the device, e.g. 'e'
+    :param message_type: Class of the decoded messages
+    :param fmt: struct format string of the payload
+    :param factory: Callable building a message from the tuple of unpacked values. Defaults to message_type._make,
+                    which suits namedtuples whose fields match the payload.
+    """
+    decoder = Decoder(message_type, struct.Struct(fmt), factory or message_type._make)
+    DECODERS[ord(type_char)] = decoder
+    FRAME_SIZES[ord(type_char)] = PAYLOAD_OFFSET + decoder.struct.size + 1
+
+
+def decode(frame, offset=PAYLOAD_OFFSET):
+    """
+    Decodes a single complete frame. The payload is unpacked in place, without being sliced out of the frame.
+
+    :param frame: Frame bytes (or any buffer), header and footer included
+    :param offset: Offset of the payload within `frame`
+    :return: decoded message, or None if the message type is unknown or the frame too short
+    """
+    decoder = DECODERS.get(frame[2])
+    if decoder is None:
+        if frame[2] not in _unknown_types:
+            _unknown_types.add(frame[2])
+            logging.warning("No parser for {}".format(chr(frame[2])))
+        return None
+
+    if len(frame) < offset + decoder.struct.size:
+        logging.warning("Frame too short for {} message, skipping".format(chr(frame[2])))
+        return None
+
+    return decoder.factory(decoder.struct.unpack_from(frame, offset))
+
+
+def decode_payload(type_char, data):
+    """
+    Decodes a message payload on its own (without frame header and footer).
+
+    :param type_char: Message type character, e.g. 'e'
+    :param data: Payload bytes
+    :return: decoded message
+    """
+    decoder = DECODERS[ord(type_char)]
+    return decoder.factory(decoder.struct.unpack_from(data))
+
+
+def _status(fields):
+    """
+    Builds a status message from the unpacked fields of a status payload, according to the VMU931 User Guide
+    (http://variense.com/Docs/VMU931/VMU931_UserGuide.pdf)
+
+    :param fields: (status, resolution, low output rate, streaming) tuple
+    :return: Device Status
+    """
+    status, res, low_output, data = fields
+
+    mag_status = status & 0b00000100 != 0
+    gyro_status = status & 0b00000010 != 0
+    acc_status = status & 0b00000001 != 0
+
+    gyro_res = None
+
+    if res & 0b10000000 != 0:
+        gyro_res = 2000
+    elif res & 0b01000000 != 0:
+        gyro_res = 1000
+    elif res & 0b00100000 != 0:
+        gyro_res = 500
+    elif res & 0b00010000 != 0:
+        gyro_res = 250
+
+    acc_res = None
+
+    if res & 0b00001000 != 0:
+        acc_res = 16
+    elif res & 0b000000100 != 0:
+        acc_res = 8
+    elif res & 0b00000010 != 0:
+        acc_res = 4
+    elif res & 0b00000001 != 0:
+        acc_res = 2
+
+    low_output_rate = low_output & 0b00000001 != 0
+
+    heading_streaming = data & 0b01000000 != 0
+    euler_streaming = data & 0b00010000 != 0
+    mag_streaming = data & 0b00001000 != 0
+    quat_streaming = data & 0b00000100 != 0
+    gyro_streaming = data & 0b00000010 != 0
+    acc_streaming = data & 0b00000001 != 0
+
+    return messages.Status(
+        magnetometer_enabled=mag_status,
+        gyroscope_enabled=gyro_status,
+        accelerometer_enabled=acc_status,
+        gyroscope_resolution=gyro_res,
+        accelerometer_resolution=acc_res,
+        low_output_rate=low_output_rate,
+        heading_streaming=heading_streaming,
+        euler_streaming=euler_streaming,
+        magnetometer_streaming=mag_streaming,
+        quaternions_streaming=quat_streaming,
+        gyroscope_streaming=gyro_streaming,
+        accelerometer_streaming=acc_streaming
+    )
+
+
+def encode_frame(message_type, payload):
+    """
+    Wraps a payload in a VMU931 frame.
+
+    :param message_type: Message type character, e.g. 'e'
+    :param payload: Payload bytes
+    :return: Frame bytes
+    """
+    return bytes((FRAME_START, len(payload) + FRAME_OVERHEAD, ord(message_type))) + payload + bytes((FRAME_END,))
+
+
+def encode_status(status):
+    """
+    Encodes a decoded status back into a status frame, e.g. to pass VMU931Parser.device_status on as it was received.
+
+    :param status: messages.Status
+    :return: Frame bytes
+    """
+    enabled = (int(status.accelerometer_enabled) | int(status.gyroscope_enabled) << 1 |
+               int(status.magnetometer_enabled) << 2)
+    resolution = (GYROSCOPE_RESOLUTION_BITS.get(status.gyroscope_resolution, 0) |
+                  ACCELEROMETER_RESOLUTION_BITS.get(status.accelerometer_resolution, 0))
+    streaming = 0
+    for stream, field in STREAM_FIELDS.items():
+        if getattr(status, field):
+            streaming |= STREAM_BITS[stream]
+    payload = struct.pack(">BBBI", enabled, resolution, int(status.low_output_rate), streaming)
+    return encode_frame('s', payload)
+
+
+register('a', messages.Accelerometer, ">Ifff")
+register('c', messages.Magnetometer, ">Ifff")
+register('g', messages.Gyroscope, ">Ifff")
+register('e', messages.Euler, ">Ifff")
+register('q', messages.Quaternion, ">Iffff")
+register('h', messages.Heading, ">If")
+register('s', messages.Status, ">BBBI", _status)
@@ -0,0 +1,218 @@
+"""
+Delivery of packets to several consumers, each subscribed to the message types it is interested in.
+
+A Dispatcher is passed as the callback of VMU931Parser.parse() or parse_many() (``vp.parse_many(callback=d.dispatch)``)
+and routes each packet to the matching subscriptions, optionally filtered by a predicate and decimated. Subscriptions
+are called inline on the read path by default; slow consumers (plotting, disk writes...) can instead be run on a thread
+pool, each with its own bounded queue, so they can't stall acquisition or each other. When a threaded subscriber falls
+behind and its queue fills up, packets are dropped according to its drop policy and counted.
+"""
+import collections
+import concurrent.futures
+import logging
+import threading
+
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
+
+
+class Subscription(object):
+    """
+    A consumer registered with a Dispatcher. Counts the packets delivered to and dropped for it.
+    """
+    def __init__(self, callback, message_types, predicate, every, threaded, queue_size, drop):
+        assert every >= 1, "every must be at least 1"
+        assert drop in (DROP_NEWEST, DROP_OLDEST), "drop must be '{}' or '{}'".format(DROP_NEWEST, DROP_OLDEST)
+
+        self.callback = callback
+        self.message_types = None if message_types is None else frozenset(message_types)
+        self.predicate = predicate
+        self.every = every
+        self.threaded = threaded
+        self.queue_size = queue_size
+        self.drop = drop
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._matched = 0
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._executor = None
+
+    def _offer(self, packet, executor):
+        """
+        Applies the predicate and decimation, then delivers the packet inline or queues it for the executor.
+        """
+        if self.predicate is not None and not self.predicate(packet):
+            return
+
+        self._matched += 1
+        if (self._matched - 1) % self.every:
+            return
+
+        if not self.threaded:
+            self.delivered += 1
+            self.callback(packet)
+            return
+
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                self.dropped += 1
+                if self.drop == DROP_NEWEST:
+                    return
+                self._queue.popleft()
+
+            self._queue.append(packet)
+            if self._scheduled:
+                return
+            self._scheduled = True
+            self._executor = executor
+
+        executor.submit(self._drain)
+
+    def _drain(self):
+        """
+        Delivers the packets queued when it starts on an executor thread, then resubmits itself if more have arrived,
+        so subscriptions take turns on the executor's threads rather than one keeping a thread while its queue is busy.
+        Only one drain runs per subscription at a time, so packets are delivered in order.
+        """
+        while True:
+            with self._lock:
+                packets = list(self._queue)
+                self._queue.clear()
+
+            self._deliver(packets)
+
+            with self._lock:
+                if not self._queue:
+                    self._scheduled = False
+                    return
+
+            try:
+                self._executor.submit(self._drain)
+                return
+            except RuntimeError:
+                # The executor is shutting down, so finish delivering on this thread.
+                pass
+
+    def _deliver(self, packets):
+        """
+        Calls the callback with each packet, counting (and logging) the exceptions it raises.
+        """
+        for packet in packets:
+            try:
+                self.callback(packet)
+            except Exception:
+                self.errors += 1
+                logging.exception("Subscriber {} raised an exception".format(self.callback))
+            self.delivered += 1
+
+    @property
+    def pending(self):
+        """
+        Number of packets queued and not yet delivered.
+        """
+        return len(self._queue)
+
+
+class Dispatcher(object):
+    """
+    Routes packets to subscriptions by message type.
+    """
+    def __init__(self, executor=None, max_workers=4):
+        """
+        :param executor: concurrent.futures.Executor to run threaded subscriptions on. If not given, a
+                         ThreadPoolExecutor is created when the first threaded subscription is added, and shut down by
+                         close().
+        :param max_workers: Number of threads of the executor created if `executor` isn't given
+        """
+        self._executor = executor
+        self._owns_executor = executor is None
+        self.max_workers = max_workers
+        self._subscriptions = []
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def subscribe(self, callback, message_types=None, predicate=None, every=1, threaded=False, queue_size=1024,
+                  drop=DROP_OLDEST):
+        """
+        Registers a consumer.
+
+        :param callback: Function called with each packet delivered
+        :param message_types: Message types to deliver (e.g. [messages.Euler]). None delivers every type.
+        :param predicate: Function called with each packet of those types, returning True if it should be delivered
+        :param every: Only deliver every `every`-th packet passing the predicate
+        :param threaded: Call `callback` on the executor rather than inline on the read path
+        :param queue_size: Maximum number of packets queued for a threaded subscription
+        :param drop: When a threaded subscription's queue is full, drop the 'oldest' queued packet or the 'newest' one
+        :return: Subscription, which can be passed to unsubscribe()
+        """
+        subscription = Subscription(callback, message_types, predicate, every, threaded, queue_size, drop)
+
+        with self._lock:
+            if threaded and self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                       thread_name_prefix="VMU931Dispatch")
+            self._subscriptions.append(subscription)
+            self._routes = {}
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes a subscription. Packets already queued for it are still delivered.
+
+        :param subscription: Subscription returned by subscribe()
+        """
+        with self._lock:
+            self._subscriptions.remove(subscription)
+            self._routes = {}
+
+    def _route(self, message_type):
+        """
+        Returns the subscriptions for a message type, caching the result until subscriptions change.
+        """
+        routes = self._routes
+        subscriptions = routes.get(message_type)
+        if subscriptions is None:
+            subscriptions = routes[message_type] = tuple(
+                subscription for subscription in self._subscriptions
+                if subscription.message_types is None or message_type in subscription.message_types)
+        return subscriptions
+
+    def dispatch(self, packet):
+        """
+        Delivers a packet to every matching subscription. Suitable as the callback of VMU931Parser.parse().
+
+        :param packet: Packet to deliver
+        """
+        for subscription in self._route(type(packet)):
+            subscription._offer(packet, self._executor)
+
+    def dispatch_many(self, packets):
+        """
+        Delivers a list of packets, e.g. as returned by VMU931Parser.parse_many().
+
+        :param packets: Packets to deliver
+        """
+        for packet in packets:
+            self.dispatch(packet)
+
+    def close(self, wait=True):
+        """
+        Shuts down the executor, if it was created by this dispatcher.
+
+        :param wait: Wait for queued packets to be delivered first
+        """
+        if self._owns_executor and self._executor is not None:
+            # Drains that can't resubmit themselves during shutdown finish on their thread, so waiting delivers
+            # everything queued.
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,353 @@
+"""
+Streaming export of parsed VMU931 data to columnar files, for analysis with NumPy, pandas and the like.
+
+Exporters buffer packets (or arrays from VMU931Parser.parse_arrays()) per message type, and hand them over in chunks of
+`row_group_size` rows to a background writer thread, so the parsing thread never waits for the disk. Every message type
+is written to its own table, with one column per field of its namedtuple in pyvmu.messages:
+
+* CSVExporter writes ``<Type>.csv`` files into a directory, and has no dependencies.
+* ParquetExporter writes ``<Type>.parquet`` files into a directory, one row group per chunk. Requires pyarrow
+  (``pip install PyVMU[parquet]``).
+* HDF5Exporter writes one dataset per message type (``/Euler``...) into a single file. Requires h5py
+  (``pip install PyVMU[hdf5]``).
+
+Only data messages are exported; status packets are ignored.
+"""
+import csv
+import logging
+import os
+import queue
+import threading
+import pyvmu.columnar as columnar
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class _Exporter(object):
+    """
+    Buffers rows per message type and writes them in chunks on a background thread. Subclasses implement the actual
+    writing in _write_chunk(), _flush_files() and _close_files(), which are only ever called from the writer thread
+    (or, for _close_files(), by close() once the writer has stopped).
+
+    Writing methods are meant to be called from a single thread (usually the one parsing).
+    """
+    def __init__(self, row_group_size=10000, message_types=None, queue_size=16):
+        """
+        :param row_group_size: Number of rows of a message type buffered before they are handed over to the writer
+        :param message_types: Message types to export. Defaults to every data message type.
+        :param queue_size: Maximum number of chunks waiting to be written. Should the disk fall this far behind,
+                           writing methods block until it catches up rather than using ever more memory.
+        """
+        assert row_group_size > 0, "row_group_size must be positive"
+
+        message_types = list(columnar.FIELDS) if message_types is None else list(message_types)
+        self.row_group_size = row_group_size
+        self.rows_written = {message_type: 0 for message_type in message_types}
+
+        self._rows = {message_type: [] for message_type in message_types}
+        self._arrays = {message_type: [] for message_type in message_types}
+        self._array_rows = {message_type: 0 for message_type in message_types}
+        self._error = None
+        self._closed = False
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="VMU931Export")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def write_packet(self, packet):
+        """
+        Buffers a packet. Suitable as the callback of VMU931Parser.parse(), or a Dispatcher subscription.
+
+        :param packet: Packet, e.g. as returned by VMU931Parser.parse()
+        :return: False if packets of this type aren't exported, True otherwise
+        """
+        message_type = type(packet)
+        rows = self._rows.get(message_type)
+        if rows is None:
+            return False
+
+        if self._array_rows[message_type]:
+            self._submit_arrays(message_type)
+
+        rows.append(packet)
+        if len(rows) >= self.row_group_size:
+            self._submit_rows(message_type)
+        return True
+
+    def write_packets(self, packets):
+        """
+        Buffers a list of packets, e.g. as returned by VMU931Parser.parse_many().
+
+        :param packets: Packets to export
+        """
+        for packet in packets:
+            self.write_packet(packet)
+
+    def write_arrays(self, arrays):
+        """
+        Buffers structured arrays, as returned by VMU931Parser.parse_arrays(). Requires NumPy.
+
+        :param arrays: dict mapping message type (e.g. messages.Euler) to a structured array
+        """
+        for message_type, array in arrays.items():
+            if message_type not in self._arrays or not len(array):
+                continue
+
+            if self._rows[message_type]:
+                self._submit_rows(message_type)
+
+            self._arrays[message_type].append(array)
+            self._array_rows[message_type] += len(array)
+            if self._array_rows[message_type] >= self.row_group_size:
+                self._submit_arrays(message_type)
+
+    def flush(self):
+        """
+        Writes every buffered row, and waits until they've reached the files.
+        """
+        self._submit_all()
+        self._put(self._flush_files)
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """
+        Writes every buffered row, stops the writer thread and closes the files. Raises the exception that stopped the
+        writer, if any.
+        """
+        if self._closed:
+            return
+
+        try:
+            self._submit_all()
+        finally:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+            try:
+                self._close_files()
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+        self._check()
+
+    def _submit_rows(self, message_type):
+        self._put(self._write, message_type, self._rows[message_type])
+        self._rows[message_type] = []
+
+    def _submit_arrays(self, message_type):
+        self._put(self._write, message_type, _concatenate(self._arrays[message_type]))
+        self._arrays[message_type] = []
+        self._array_rows[message_type] = 0
+
+    def _submit_all(self):
+        for message_type in self._rows:
+            if self._rows[message_type]:
+                self._submit_rows(message_type)
+            elif self._array_rows[message_type]:
+                self._submit_arrays(message_type)
+
+    def _put(self, method, *args):
+        """
+        Queues a call for the writer thread.
+        """
+        assert not self._closed, "Exporter is closed"
+        self._check()
+        self._queue.put((method, args))
+
+    def _check(self):
+        """
+        Raises the exception that stopped the writer thread, if any.
+        """
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        """
+        Writer thread: runs queued calls until the None sentinel. Once a call fails, the rest are discarded.
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    method, args = item
+                    method(*args)
+            except Exception as e:
+                logging.exception("Failed to export VMU931 data")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, message_type, chunk):
+        self._write_chunk(message_type, chunk)
+        self.rows_written[message_type] += len(chunk)
+
+    def _write_chunk(self, message_type, chunk):
+        """
+        Writes a chunk of rows of a message type.
+
+        :param message_type: Message type, e.g. messages.Euler
+        :param chunk: List of packets of that type, or a structured array as returned by VMU931Parser.parse_arrays()
+        """
+        raise NotImplementedError
+
+    def _flush_files(self):
+        pass
+
+    def _close_files(self):
+        pass
+
+
+def _concatenate(arrays):
+    return arrays[0] if len(arrays) == 1 else columnar.np.concatenate(arrays)
+
+
+def _to_array(message_type, chunk):
+    """
+    Converts a chunk to a native-endian structured array.
+    """
+    native = columnar.dtype(message_type).newbyteorder('=')
+    if isinstance(chunk, list):
+        return columnar.np.array(chunk, dtype=native)
+    return chunk.astype(native)
+
+
+class CSVExporter(_Exporter):
+    """
+    Writes each message type to a CSV file, ``<directory>/<Type>.csv``, with a header row of field names.
+    """
+    def __init__(self, directory, row_group_size=10000, message_types=None, queue_size=16):
+        """
+        :param directory: Directory to write the files into. Created if it doesn't exist; existing files are replaced.
+        :param row_group_size: Number of rows of a message type buffered before they are handed over to the writer
+        :param message_types: Message types to export. Defaults to every data message type.
+        :param queue_size: Maximum number of chunks waiting to be written
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self._files = {}
+        self._writers = {}
+        super(CSVExporter, self).__init__(row_group_size, message_types, queue_size)
+
+    def _write_chunk(self, message_type, chunk):
+        writer = self._writers.get(message_type)
+        if writer is None:
+            path = os.path.join(self.directory, message_type.__name__ + '.csv')
+            self._files[message_type] = open(path, 'w', newline='')
+            writer = self._writers[message_type] = csv.writer(self._files[message_type])
+            writer.writerow(message_type._fields)
+
+        writer.writerows(chunk if isinstance(chunk, list) else chunk.tolist())
+
+    def _flush_files(self):
+        for csv_file in self._files.values():
+            csv_file.flush()
+
+    def _close_files(self):
+        for csv_file in self._files.values():
+            csv_file.close()
+        self._files = {}
+        self._writers = {}
+
+
+class ParquetExporter(_Exporter):
+    """
+    Writes each message type to a Parquet file, ``<directory>/<Type>.parquet``, with one row group per chunk. Requires
+    pyarrow and NumPy.
+    """
+    def __init__(self, directory, row_group_size=65536, message_types=None, queue_size=16, compression='snappy'):
+        """
+        :param directory: Directory to write the files into. Created if it doesn't exist; existing files are replaced.
+        :param row_group_size: Number of rows per row group
+        :param message_types: Message types to export. Defaults to every data message type.
+        :param queue_size: Maximum number of chunks waiting to be written
+        :param compression: Parquet compression codec
+        """
+        columnar._require_numpy()
+        if pyarrow is None:
+            raise ImportError("pyarrow is required for Parquet export (pip install PyVMU[parquet])")
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.compression = compression
+        self._writers = {}
+        super(ParquetExporter, self).__init__(row_group_size, message_types, queue_size)
+
+    def _write_chunk(self, message_type, chunk):
+        array = _to_array(message_type, chunk)
+        table = pyarrow.Table.from_arrays([pyarrow.array(array[name]) for name in array.dtype.names],
+                                          names=list(array.dtype.names))
+
+        writer = self._writers.get(message_type)
+        if writer is None:
+            path = os.path.join(self.directory, message_type.__name__ + '.parquet')
+            writer = self._writers[message_type] = pyarrow.parquet.ParquetWriter(path, table.schema,
+                                                                                 compression=self.compression)
+        writer.write_table(table, row_group_size=len(table))
+
+    def _close_files(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+class HDF5Exporter(_Exporter):
+    """
+    Writes each message type to a resizable, chunked dataset of a single HDF5 file, named after the type (``/Euler``).
+    Requires h5py.
+    """
+    def __init__(self, path, row_group_size=65536, message_types=None, queue_size=16, compression=None):
+        """
+        :param path: Path of the HDF5 file. Replaced if it exists.
+        :param row_group_size: Number of rows per chunk, both buffered and as stored in the file
+        :param message_types: Message types to export. Defaults to every data message type.
+        :param queue_size: Maximum number of chunks waiting to be written
+        :param compression: h5py compression filter, e.g. 'gzip'
+        """
+        columnar._require_numpy()
+        if h5py is None:
+            raise ImportError("h5py is required for HDF5 export (pip install PyVMU[hdf5])")
+
+        self.path = path
+        self.compression = compression
+        self._file = h5py.File(path, 'w')
+        super(HDF5Exporter, self).__init__(row_group_size, message_types, queue_size)
+
+    def _write_chunk(self, message_type, chunk):
+        array = _to_array(message_type, chunk)
+
+        name = message_type.__name__
+        if name not in self._file:
+            self._file.create_dataset(name, shape=(0,), maxshape=(None,), dtype=array.dtype,
+                                      chunks=(self.row_group_size,), compression=self.compression)
+
+        dataset = self._file[name]
+        length = len(dataset)
+        dataset.resize((length + len(array),))
+        dataset[length:] = array
+
+    def _flush_files(self):
+        self._file.flush()
+
+    def _close_files(self):
+        self._file.close()
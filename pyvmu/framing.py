@@ -0,0 +1,209 @@
+import collections
+import logging
+import pyvmu.decoders as decoders
+from pyvmu.decoders import FRAME_START, FRAME_END, FRAME_OVERHEAD
+
+
+class FrameBuffer(object):
+    """
+    Accumulates raw bytes read from the VMU931 and splits them into complete frames.
+
+    Each VMU931 frame is laid out as ``0x01, size, type, payload..., 0x04`` where ``size`` is the length of the whole
+    frame, header and footer included. Bytes are appended in bulk with :meth:`feed` and every complete frame currently
+    buffered is returned by :meth:`frames`; incomplete trailing data is kept until more bytes arrive.
+
+    A start byte can also occur inside a payload, so a candidate frame is only accepted if it is large enough for the
+    payload of its message type (for types registered with pyvmu.decoders) and its footer is valid. Frames longer than
+    their type's payload are accepted, so that firmware appending fields to a message doesn't break parsing; the extra
+    bytes are ignored when decoding. A frame longer than expected is only accepted once the frame following it is
+    complete and valid too, synced or not, and if no valid frame starts where its type's payload would end, so that a
+    corrupted size byte which happens to land on a later footer can't swallow the frames in between. While out of
+    sync, only registered message types are accepted, and the byte following the candidate must also be the start of
+    the next frame. Rejected candidates are skipped one byte at a time, so a false start byte never causes the frames
+    that follow it to be discarded.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._synced = False
+        self._resync_mark = None
+        self.reset_counters()
+
+    def reset_counters(self):
+        """
+        Resets the framing statistics: bytes skipped while looking for a frame start, frames discarded because of an
+        invalid footer or size, the number of frames and bytes received per message type (indexed by type byte), and
+        resynchronisations along with the number of packets each one cost (`resync_costs` maps a number of packets lost
+        to the number of resynchronisations which lost that many).
+        """
+        self.skipped_bytes = 0
+        self.bad_footers = 0
+        self.bad_sizes = 0
+        self.frame_counts = [0] * 256
+        self.frame_bytes = [0] * 256
+        self.resyncs = 0
+        self.resync_packets_lost = 0
+        self.resync_costs = collections.Counter()
+        if self._resync_mark is not None:
+            self._resync_mark = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Append raw bytes read from the device.
+
+        :param data: Bytes to append
+        """
+        self._buffer += data
+
+    def _lose_sync(self):
+        """
+        Starts a resynchronisation, after a frame didn't start where the previous one ended or was invalid.
+        """
+        self._resync_mark = self.skipped_bytes
+
+    def _resynchronised(self):
+        """
+        Ends a resynchronisation, once a valid frame has been found, and estimates the number of packets it cost from
+        the number of bytes skipped and the average frame size.
+        """
+        skipped = self.skipped_bytes - self._resync_mark
+        self._resync_mark = None
+
+        frames = sum(self.frame_counts)
+        lost = int(round(skipped * frames / float(sum(self.frame_bytes)))) if frames else 0
+        self.resyncs += 1
+        self.resync_packets_lost += lost
+        self.resync_costs[lost] += 1
+        logging.debug("Resynchronised after skipping %d bytes (about %d packets)", skipped, lost)
+
+    def frames(self):
+        """
+        Extract every complete frame from the buffer.
+
+        Bytes preceding a start byte are discarded (we might start reading mid-stream, so need to synchronise), as are
+        candidate frames which fail validation, a byte at a time.
+
+        :return: List of complete frames (as bytes, header and footer included)
+        """
+        buf = self._buffer
+        end = len(buf)
+        position = 0
+        frames = []
+        frame_counts = self.frame_counts
+        frame_bytes = self.frame_bytes
+        sizes = decoders.FRAME_SIZES
+        synced = self._synced
+
+        # Frames are copied out through a memoryview, which avoids the intermediate copy a bytearray slice would make.
+        view = memoryview(buf)
+        while True:
+            start = buf.find(FRAME_START, position)
+            if start < 0:
+                start = end
+
+            if start != position:
+                if synced:
+                    synced = False
+                    self._lose_sync()
+                self.skipped_bytes += start - position
+                position = start
+                if start == end:
+                    break
+
+            # Wait for the size and type bytes before going any further.
+            if start + 2 >= end:
+                break
+
+            size = buf[start + 1]
+            type_byte = buf[start + 2]
+            expected = sizes.get(type_byte)
+            if expected is None:
+                # Only accept unknown message types where a frame is expected: their size can't be checked.
+                valid = synced and size >= FRAME_OVERHEAD
+            else:
+                valid = size >= expected
+            if not valid:
+                # Can't be a real frame, so the start byte was noise (or the frame was corrupted).
+                if synced:
+                    logging.debug("Invalid frame size %d for message type %s, skipping", size, hex(type_byte))
+                    self.bad_sizes += 1
+                    synced = False
+                    self._lose_sync()
+                self.skipped_bytes += 1
+                position = start + 1
+                continue
+
+            # While out of sync, look ahead for the next start byte to confirm the frame. At the end of the buffer the
+            # frame is accepted without it, so that a lone status frame isn't held back.
+            frame_end = start + size
+            lookahead = not synced and frame_end < end
+            if frame_end + lookahead > end:
+                break
+
+            if buf[frame_end - 1] != FRAME_END or (lookahead and buf[frame_end] != FRAME_START):
+                if synced:
+                    logging.debug("Invalid Message footer (was %s, expected 0x04), skipping this packet",
+                                  hex(buf[frame_end - 1]))
+                    self.bad_footers += 1
+                    synced = False
+                    self._lose_sync()
+                self.skipped_bytes += 1
+                position = start + 1
+                continue
+
+            if expected is not None and size != expected:
+                # A false start byte or corrupted size byte could swallow real frames, so the frame mustn't also end
+                # where its type says it should with a valid frame following, and the next frame must check out too.
+                nominal = self._confirms(buf, start + expected, end, sizes) \
+                    if buf[start + expected - 1] == FRAME_END else False
+                confirmed = not nominal and self._confirms(buf, frame_end, end, sizes)
+                if nominal is None or confirmed is None:
+                    break
+                if not confirmed:
+                    if synced:
+                        logging.debug("Frame size %d for message type %s not followed by a valid frame, skipping",
+                                      size, hex(type_byte))
+                        self.bad_sizes += 1
+                        synced = False
+                        self._lose_sync()
+                    self.skipped_bytes += 1
+                    position = start + 1
+                    continue
+
+            frames.append(bytes(view[start:frame_end]))
+            frame_counts[type_byte] += 1
+            frame_bytes[type_byte] += size
+            if not synced:
+                synced = True
+                if self._resync_mark is not None:
+                    self._resynchronised()
+            position = frame_end
+
+        self._synced = synced
+
+        # The buffer can't be resized while exported.
+        view.release()
+        if position:
+            del buf[:position]
+
+        return frames
+
+    @staticmethod
+    def _confirms(buf, start, end, sizes):
+        """
+        Checks that a complete, valid frame of a registered message type starts at `start`.
+
+        :return: True or False, or None if more data is needed to tell
+        """
+        if start + 2 >= end:
+            return None
+
+        size = buf[start + 1]
+        expected = sizes.get(buf[start + 2])
+        if buf[start] != FRAME_START or expected is None or size < expected:
+            return False
+        if start + size > end:
+            return None
+        return buf[start + size - 1] == FRAME_END
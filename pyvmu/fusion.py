@@ -0,0 +1,343 @@
+"""
+On-host orientation estimation from the raw accelerometer, gyroscope and (optionally) magnetometer streams, using the
+Madgwick or Mahony AHRS filters. This allows the device's own Euler/Quaternion outputs to be disabled, freeing link
+bandwidth, and recorded captures to be re-processed with different gains.
+
+Filters can be updated one sample at a time (update(), update_frame()) or run over whole arrays of samples (run()).
+Gyroscope readings are expected in degrees per second, as sent by the VMU931; accelerometer and magnetometer readings
+may be in any unit, as they are normalised.
+
+NumPy is only required by run() (install with ``pip install PyVMU[numpy]``).
+"""
+import math
+import pyvmu.messages as messages
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEG_TO_RAD = math.pi / 180.0
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch fusion (pip install PyVMU[numpy])")
+
+
+def _inv_norm(*components):
+    """
+    Returns the reciprocal of the norm of a vector, or 0 for a zero vector. Components may be floats or arrays.
+    """
+    norm = sum(c * c for c in components) ** 0.5
+    if np is None or np.ndim(norm) == 0:
+        return 1.0 / norm if norm else 0.0
+    return np.divide(1.0, norm, out=np.zeros_like(norm), where=norm > 0)
+
+
+def _columns(samples):
+    """
+    Returns the x, y and z columns of an array of samples, as float64 lists.
+
+    :param samples: Structured array with x, y and z fields (e.g. from VMU931Parser.parse_arrays()), or (N, 3) array
+    """
+    if samples.dtype.names:
+        return [samples[axis].astype(np.float64).tolist() for axis in ('x', 'y', 'z')]
+    samples = np.asarray(samples, dtype=np.float64)
+    return [samples[:, axis].tolist() for axis in range(3)]
+
+
+class _AHRSFilter(object):
+    """
+    State and timekeeping shared by the fusion filters. Subclasses implement _step().
+    """
+    def __init__(self, quaternion=None):
+        """
+        :param quaternion: Initial orientation as (w, x, y, z). Defaults to the identity.
+        """
+        self.quaternion = tuple(quaternion) if quaternion is not None else (1.0, 0.0, 0.0, 0.0)
+        self.timestamp = None
+
+    def _dt(self, timestamp):
+        """
+        Returns the time elapsed since the previous sample, in seconds. Device timestamps are 32 bit millisecond
+        counts, so wrap-around is handled.
+        """
+        dt = 0.0 if self.timestamp is None else ((timestamp - self.timestamp) & 0xFFFFFFFF) / 1000.0
+        self.timestamp = timestamp
+        return dt
+
+    def update(self, gyroscope, accelerometer, magnetometer=None, dt=None):
+        """
+        Updates the orientation estimate with one set of samples.
+
+        :param gyroscope: messages.Gyroscope
+        :param accelerometer: messages.Accelerometer
+        :param magnetometer: messages.Magnetometer, or None to estimate orientation from the gyroscope and
+                             accelerometer alone (heading will drift)
+        :param dt: Time since the previous update, in seconds. Defaults to the difference between gyroscope timestamps.
+        :return: messages.Quaternion with the gyroscope's timestamp
+        """
+        elapsed = self._dt(gyroscope.timestamp)
+        if dt is None:
+            dt = elapsed
+
+        gyro = (gyroscope.x * DEG_TO_RAD, gyroscope.y * DEG_TO_RAD, gyroscope.z * DEG_TO_RAD)
+        acc = (accelerometer.x, accelerometer.y, accelerometer.z)
+        mag = None if magnetometer is None else (magnetometer.x, magnetometer.y, magnetometer.z)
+
+        self.quaternion = self._step(self.quaternion, gyro, acc, mag, dt)
+        return messages.Quaternion(gyroscope.timestamp, *self.quaternion)
+
+    def update_frame(self, frame):
+        """
+        Updates the orientation estimate from a frame produced by pyvmu.align.Aligner.
+
+        :param frame: messages.AlignedFrame, which must contain gyroscope and accelerometer packets
+        :return: messages.Quaternion, or None if the frame lacks gyroscope or accelerometer data
+        """
+        if frame.gyroscope is None or frame.accelerometer is None:
+            return None
+        return self.update(frame.gyroscope, frame.accelerometer, frame.magnetometer)
+
+    def run(self, gyroscope, accelerometer, magnetometer=None, timestamps=None):
+        """
+        Runs the filter over arrays of aligned samples (sample i of each array taken at the same time), continuing from
+        the current state. Requires NumPy.
+
+        Gains may be given as NumPy arrays, in which case one filter per gain is run in the same pass, making it cheap
+        to compare gains over a capture.
+
+        :param gyroscope: Gyroscope samples in degrees per second, as a structured array with x, y and z fields (e.g.
+                          from VMU931Parser.parse_arrays() or CaptureReader.array()) or an (N, 3) array
+        :param accelerometer: Accelerometer samples, in the same form
+        :param magnetometer: Magnetometer samples, in the same form, or None
+        :param timestamps: Device timestamps in milliseconds. Defaults to the gyroscope's timestamp field.
+        :return: (N, 4) array of (w, x, y, z) quaternions, or (N, G, 4) when run with G gains
+        """
+        _require_numpy()
+
+        if timestamps is None:
+            timestamps = gyroscope['timestamp']
+        timestamps = np.asarray(timestamps).astype(np.int64)
+        assert len(timestamps) == len(gyroscope) == len(accelerometer), "Sample arrays must be aligned"
+
+        first = 0.0 if self.timestamp is None or not len(timestamps) else \
+            ((int(timestamps[0]) - self.timestamp) & 0xFFFFFFFF) / 1000.0
+        dts = np.concatenate(([first], (np.diff(timestamps) & 0xFFFFFFFF) / 1000.0)).tolist()
+
+        gyro = zip(*[[value * DEG_TO_RAD for value in column] for column in _columns(gyroscope)])
+        acc = zip(*_columns(accelerometer))
+        mag = zip(*_columns(magnetometer)) if magnetometer is not None else [None] * len(timestamps)
+
+        quaternions = np.empty((len(timestamps), 4) + np.broadcast(*self._gains()).shape)
+        q = self.quaternion
+        for index, (g, a, m, dt) in enumerate(zip(gyro, acc, mag, dts)):
+            q = self._step(q, g, a, m, dt)
+            for component in range(4):
+                quaternions[index, component] = q[component]
+
+        self.quaternion = q
+        if len(timestamps):
+            self.timestamp = int(timestamps[-1]) & 0xFFFFFFFF
+
+        # Components last, giving (N, 4) for scalar gains and (N, G, 4) for arrays of gains.
+        return np.moveaxis(quaternions, 1, -1)
+
+    def _gains(self):
+        raise NotImplementedError
+
+    def _step(self, q, gyro, acc, mag, dt):
+        raise NotImplementedError
+
+
+class MadgwickFilter(_AHRSFilter):
+    """
+    Madgwick's gradient descent orientation filter (S. Madgwick, "An efficient orientation filter for inertial and
+    inertial/magnetic sensor arrays", 2010).
+    """
+    def __init__(self, beta=0.1, quaternion=None):
+        """
+        :param beta: Filter gain. Higher values correct gyroscope drift faster but let more accelerometer and
+                     magnetometer noise through. May be a NumPy array for run().
+        :param quaternion: Initial orientation as (w, x, y, z). Defaults to the identity.
+        """
+        super(MadgwickFilter, self).__init__(quaternion)
+        self.beta = beta
+
+    def _gains(self):
+        return self.beta,
+
+    def _step(self, q, gyro, acc, mag, dt):
+        q0, q1, q2, q3 = q
+        gx, gy, gz = gyro
+        ax, ay, az = acc
+
+        # Rate of change of quaternion from the gyroscope.
+        qdot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qdot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qdot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qdot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        recip = _inv_norm(ax, ay, az)
+        if recip:
+            ax, ay, az = ax * recip, ay * recip, az * recip
+
+            if mag is not None and _inv_norm(*mag):
+                s0, s1, s2, s3 = self._marg_gradient(q, (ax, ay, az), mag)
+            else:
+                s0, s1, s2, s3 = self._imu_gradient(q, (ax, ay, az))
+
+            recip = _inv_norm(s0, s1, s2, s3)
+            beta = self.beta
+            qdot0 = qdot0 - beta * s0 * recip
+            qdot1 = qdot1 - beta * s1 * recip
+            qdot2 = qdot2 - beta * s2 * recip
+            qdot3 = qdot3 - beta * s3 * recip
+
+        q0, q1, q2, q3 = q0 + qdot0 * dt, q1 + qdot1 * dt, q2 + qdot2 * dt, q3 + qdot3 * dt
+        recip = _inv_norm(q0, q1, q2, q3)
+        return q0 * recip, q1 * recip, q2 * recip, q3 * recip
+
+    @staticmethod
+    def _imu_gradient(q, acc):
+        """
+        Gradient of the objective function aligning the estimated gravity direction with the accelerometer.
+        """
+        q0, q1, q2, q3 = q
+        ax, ay, az = acc
+
+        _2q0, _2q1, _2q2, _2q3 = 2.0 * q0, 2.0 * q1, 2.0 * q2, 2.0 * q3
+        _4q0, _4q1, _4q2 = 4.0 * q0, 4.0 * q1, 4.0 * q2
+        _8q1, _8q2 = 8.0 * q1, 8.0 * q2
+        q0q0, q1q1, q2q2, q3q3 = q0 * q0, q1 * q1, q2 * q2, q3 * q3
+
+        s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+        s1 = _4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+        s2 = 4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+        s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+        return s0, s1, s2, s3
+
+    @staticmethod
+    def _marg_gradient(q, acc, mag):
+        """
+        Gradient of the objective function aligning the estimated gravity and magnetic field directions with the
+        accelerometer and magnetometer.
+        """
+        q0, q1, q2, q3 = q
+        ax, ay, az = acc
+        recip = _inv_norm(*mag)
+        mx, my, mz = mag[0] * recip, mag[1] * recip, mag[2] * recip
+
+        _2q0mx, _2q0my, _2q0mz, _2q1mx = 2.0 * q0 * mx, 2.0 * q0 * my, 2.0 * q0 * mz, 2.0 * q1 * mx
+        _2q0, _2q1, _2q2, _2q3 = 2.0 * q0, 2.0 * q1, 2.0 * q2, 2.0 * q3
+        _2q0q2, _2q2q3 = 2.0 * q0 * q2, 2.0 * q2 * q3
+        q0q0, q0q1, q0q2, q0q3 = q0 * q0, q0 * q1, q0 * q2, q0 * q3
+        q1q1, q1q2, q1q3 = q1 * q1, q1 * q2, q1 * q3
+        q2q2, q2q3, q3q3 = q2 * q2, q2 * q3, q3 * q3
+
+        # Direction of the earth's magnetic field in the earth frame.
+        hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 \
+            - mx * q3q3
+        hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+        _2bx = (hx * hx + hy * hy) ** 0.5
+        _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 \
+            + mz * q3q3
+        _4bx, _4bz = 2.0 * _2bx, 2.0 * _2bz
+
+        # Errors between estimated and measured directions of gravity (fa) and the magnetic field (fm).
+        fax = 2.0 * q1q3 - _2q0q2 - ax
+        fay = 2.0 * q0q1 + _2q2q3 - ay
+        faz = 1.0 - 2.0 * q1q1 - 2.0 * q2q2 - az
+        fmx = _2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx
+        fmy = _2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my
+        fmz = _2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz
+
+        s0 = -_2q2 * fax + _2q1 * fay - _2bz * q2 * fmx + (-_2bx * q3 + _2bz * q1) * fmy + _2bx * q2 * fmz
+        s1 = _2q3 * fax + _2q0 * fay - 4.0 * q1 * faz + _2bz * q3 * fmx + (_2bx * q2 + _2bz * q0) * fmy \
+            + (_2bx * q3 - _4bz * q1) * fmz
+        s2 = -_2q0 * fax + _2q3 * fay - 4.0 * q2 * faz + (-_4bx * q2 - _2bz * q0) * fmx \
+            + (_2bx * q1 + _2bz * q3) * fmy + (_2bx * q0 - _4bz * q2) * fmz
+        s3 = _2q1 * fax + _2q2 * fay + (-_4bx * q3 + _2bz * q1) * fmx + (-_2bx * q0 + _2bz * q2) * fmy \
+            + _2bx * q1 * fmz
+        return s0, s1, s2, s3
+
+
+class MahonyFilter(_AHRSFilter):
+    """
+    Mahony's nonlinear complementary filter (R. Mahony, T. Hamel and J. Pflimlin, "Nonlinear Complementary Filters on
+    the Special Orthogonal Group", 2008), with proportional and integral feedback.
+    """
+    def __init__(self, kp=1.0, ki=0.0, quaternion=None):
+        """
+        :param kp: Proportional gain. May be a NumPy array for run().
+        :param ki: Integral gain, correcting gyroscope bias. 0 disables integral feedback. May be a NumPy array for
+                   run().
+        :param quaternion: Initial orientation as (w, x, y, z). Defaults to the identity.
+        """
+        super(MahonyFilter, self).__init__(quaternion)
+        self.kp = kp
+        self.ki = ki
+        self.integral = (0.0, 0.0, 0.0)
+
+    def _gains(self):
+        return self.kp, self.ki
+
+    def _step(self, q, gyro, acc, mag, dt):
+        q0, q1, q2, q3 = q
+        gx, gy, gz = gyro
+        ax, ay, az = acc
+
+        recip = _inv_norm(ax, ay, az)
+        if recip:
+            ax, ay, az = ax * recip, ay * recip, az * recip
+
+            # Estimated direction of gravity (halved).
+            halfvx = q1 * q3 - q0 * q2
+            halfvy = q0 * q1 + q2 * q3
+            halfvz = q0 * q0 - 0.5 + q3 * q3
+
+            # Error is the cross product between estimated and measured directions.
+            halfex = ay * halfvz - az * halfvy
+            halfey = az * halfvx - ax * halfvz
+            halfez = ax * halfvy - ay * halfvx
+
+            if mag is not None and _inv_norm(*mag):
+                recip = _inv_norm(*mag)
+                mx, my, mz = mag[0] * recip, mag[1] * recip, mag[2] * recip
+                q0q0, q0q1, q0q2, q0q3 = q0 * q0, q0 * q1, q0 * q2, q0 * q3
+                q1q1, q1q2, q1q3 = q1 * q1, q1 * q2, q1 * q3
+                q2q2, q2q3, q3q3 = q2 * q2, q2 * q3, q3 * q3
+
+                # Reference direction of the earth's magnetic field.
+                hx = 2.0 * (mx * (0.5 - q2q2 - q3q3) + my * (q1q2 - q0q3) + mz * (q1q3 + q0q2))
+                hy = 2.0 * (mx * (q1q2 + q0q3) + my * (0.5 - q1q1 - q3q3) + mz * (q2q3 - q0q1))
+                bx = (hx * hx + hy * hy) ** 0.5
+                bz = 2.0 * (mx * (q1q3 - q0q2) + my * (q2q3 + q0q1) + mz * (0.5 - q1q1 - q2q2))
+
+                # Estimated direction of the magnetic field (halved).
+                halfwx = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2)
+                halfwy = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3)
+                halfwz = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2)
+
+                halfex = halfex + my * halfwz - mz * halfwy
+                halfey = halfey + mz * halfwx - mx * halfwz
+                halfez = halfez + mx * halfwy - my * halfwx
+
+            ki = self.ki
+            if not isinstance(ki, (int, float)) or ki > 0:
+                ix, iy, iz = self.integral
+                twoki = 2.0 * ki
+                self.integral = ix + twoki * halfex * dt, iy + twoki * halfey * dt, iz + twoki * halfez * dt
+                gx, gy, gz = gx + self.integral[0], gy + self.integral[1], gz + self.integral[2]
+
+            twokp = 2.0 * self.kp
+            gx, gy, gz = gx + twokp * halfex, gy + twokp * halfey, gz + twokp * halfez
+
+        gx, gy, gz = gx * 0.5 * dt, gy * 0.5 * dt, gz * 0.5 * dt
+        q0, q1, q2, q3 = (q0 - q1 * gx - q2 * gy - q3 * gz,
+                          q1 + q0 * gx + q2 * gz - q3 * gy,
+                          q2 + q0 * gy - q1 * gz + q3 * gx,
+                          q3 + q0 * gz + q1 * gy - q2 * gx)
+        recip = _inv_norm(q0, q1, q2, q3)
+        return q0 * recip, q1 * recip, q2 * recip, q3 * recip
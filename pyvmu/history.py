@@ -0,0 +1,165 @@
+"""
+Compact storage for long histories of samples.
+
+Keeping every decoded namedtuple costs a tuple plus a Python object per field for each sample. SampleBuffer instead
+stores samples packed in their wire format (16 bytes for an accelerometer sample) in a preallocated bytearray, filled
+directly from received frames. Samples are only turned into namedtuples when accessed, so existing code can still use
+tuple unpacking (``ts, x, y, z = history[messages.Euler][-1]``).
+
+Status packets are decoded into fields that don't match their wire format, so they can only be stored from frames
+(append_frame(), as VMU931Parser.parse_into() does), and aren't available as NumPy arrays.
+"""
+import pyvmu.columnar as columnar
+import pyvmu.decoders as decoders
+
+
+class SampleBuffer(object):
+    """
+    Fixed-capacity ring buffer of samples of a single message type, stored packed in a preallocated bytearray. Once
+    full, the oldest samples are overwritten.
+    """
+    def __init__(self, message_type, capacity):
+        """
+        :param message_type: Message type stored, e.g. messages.Euler. Must be registered in pyvmu.decoders.
+        :param capacity: Maximum number of samples held
+        """
+        assert capacity > 0, "Capacity must be positive"
+
+        decoder = [d for d in decoders.DECODERS.values() if d.message_type is message_type]
+        assert decoder, "{} is not a registered message type".format(message_type.__name__)
+
+        self.message_type = message_type
+        self.capacity = capacity
+        self._struct = decoder[0].struct
+        self._factory = decoder[0].factory
+        # Decoded packets can only be packed back if their fields are the payload's (i.e. not for status packets).
+        self._packable = decoder[0].factory == message_type._make
+        self._size = self._struct.size
+        self._data = bytearray(capacity * self._size)
+        self._written = 0
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    def _offset(self, index):
+        """
+        Byte offset of a sample, counting from the oldest sample held. Negative indexes count from the newest.
+        """
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("Sample index out of range")
+        return ((self._written - length + index) % self.capacity) * self._size
+
+    def __getitem__(self, index):
+        return self._factory(self._struct.unpack_from(self._data, self._offset(index)))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, packet):
+        """
+        Appends a decoded packet. Raises TypeError for message types (such as messages.Status) whose packets can't be
+        packed back into their wire format; store their frames with append_frame() instead.
+
+        :param packet: Packet of this buffer's message type
+        """
+        if not self._packable:
+            raise TypeError("{} packets can't be appended, only their frames".format(self.message_type.__name__))
+
+        offset = (self._written % self.capacity) * self._size
+        self._struct.pack_into(self._data, offset, *packet)
+        self._written += 1
+
+    def append_frame(self, frame):
+        """
+        Appends a sample straight from a received frame, copying its payload without decoding it.
+
+        :param frame: Frame bytes of this buffer's message type, header and footer included
+        """
+        offset = (self._written % self.capacity) * self._size
+        start = decoders.PAYLOAD_OFFSET
+        self._data[offset:offset + self._size] = memoryview(frame)[start:start + self._size]
+        self._written += 1
+
+    def clear(self):
+        """
+        Removes every sample.
+        """
+        self._written = 0
+
+    def array(self):
+        """
+        Returns the samples held, oldest first, as a NumPy structured array (with the same dtype as
+        VMU931Parser.parse_arrays()). If the buffer hasn't wrapped around, this is a view of the buffer rather than a
+        copy. Requires NumPy, and is only available for data message types (not messages.Status).
+
+        :return: numpy structured array
+        """
+        if self.message_type not in columnar.FIELDS:
+            raise TypeError("{} samples aren't available as an array".format(self.message_type.__name__))
+
+        np = columnar.np
+        dtype = columnar.dtype(self.message_type)
+        samples = np.frombuffer(self._data, dtype=dtype)
+
+        length = len(self)
+        start = (self._written - length) % self.capacity
+        if start + length <= self.capacity:
+            return samples[start:start + length]
+        return np.concatenate((samples[start:], samples[:start + length - self.capacity]))
+
+
+class PacketHistory(object):
+    """
+    Collection of SampleBuffers, one per message type, created as packets of each type arrive. Can be filled directly
+    by VMU931Parser.parse_into().
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: Maximum number of samples held per message type
+        """
+        self.capacity = capacity
+        self._buffers = {}
+        self._by_type_byte = {}
+
+    def __getitem__(self, message_type):
+        """
+        :param message_type: Message type, e.g. messages.Euler
+        :return: SampleBuffer holding samples of that type
+        """
+        buffer = self._buffers.get(message_type)
+        if buffer is None:
+            buffer = self._buffers[message_type] = SampleBuffer(message_type, self.capacity)
+        return buffer
+
+    def __contains__(self, message_type):
+        return message_type in self._buffers
+
+    def append(self, packet):
+        """
+        Appends a decoded packet to the buffer for its type. Status packets can't be appended (see
+        SampleBuffer.append()).
+
+        :param packet: Packet to append
+        """
+        self[type(packet)].append(packet)
+
+    def append_frame(self, frame):
+        """
+        Appends a received frame to the buffer for its type, without decoding it.
+
+        :param frame: Frame bytes, header and footer included
+        :return: False if the frame's message type is unknown (so it was skipped), True otherwise
+        """
+        buffer = self._by_type_byte.get(frame[2])
+        if buffer is None:
+            decoder = decoders.DECODERS.get(frame[2])
+            if decoder is None:
+                return False
+            buffer = self._by_type_byte[frame[2]] = self[decoder.message_type]
+
+        buffer.append_frame(frame)
+        return True
@@ -0,0 +1,158 @@
+import heapq
+import logging
+import operator
+import selectors
+import pyvmu.messages as messages
+
+
+class VMU931Manager(object):
+    """
+    Reads from several VMU931 devices on a single thread, waiting on all of their serial ports at once with selectors
+    (epoll on Linux), so CPU cost scales with the amount of data rather than the number of devices.
+
+    Devices are added as VMU931Parser instances, which must use a transport with a file descriptor (a serial port or
+    pseudo-terminal). Parsers created with `lazy` set are only read from once their handshake has completed.
+    """
+    def __init__(self, parsers=None):
+        """
+        :param parsers: dict mapping device id to VMU931Parser
+        """
+        self.parsers = {}
+        self._selector = selectors.DefaultSelector()
+        self._pending = {}
+
+        for device_id, parser in (parsers or {}).items():
+            self.add(device_id, parser)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def add(self, device_id, parser):
+        """
+        Adds a device to the manager.
+
+        :param device_id: Identifier that packets from this device will be tagged with
+        :param parser: VMU931Parser for the device
+        """
+        assert device_id not in self.parsers, "Device {} is already managed".format(device_id)
+
+        self.parsers[device_id] = parser
+        self._pending[device_id] = parser
+
+    def remove(self, device_id):
+        """
+        Stops managing a device. The device is not closed.
+
+        :param device_id: Identifier of the device to remove
+        :return: the device's VMU931Parser
+        """
+        parser = self.parsers.pop(device_id)
+        if self._pending.pop(device_id, None) is None:
+            self._selector.unregister(parser.ser.fileno())
+        return parser
+
+    def _register_ready(self):
+        """
+        Starts selecting on devices whose handshake has completed.
+
+        :return: True if some devices are still waiting for their handshake to complete
+        """
+        for device_id, parser in list(self._pending.items()):
+            if not parser.ready.done():
+                continue
+
+            del self._pending[device_id]
+            if parser.ready.exception() is not None:
+                logging.error("Device {} failed to connect: {}".format(device_id, parser.ready.exception()))
+                continue
+
+            self._selector.register(parser.ser.fileno(), selectors.EVENT_READ, device_id)
+
+        return bool(self._pending)
+
+    def poll(self, timeout=None, max_packets=None):
+        """
+        Waits for data from any device and returns every packet available, grouped by device.
+
+        :param timeout: Maximum time (in seconds) to wait for data. None waits indefinitely.
+        :param max_packets: Maximum number of packets to return per device.
+        :return: dict mapping device id to list of packets, containing only devices that sent data
+        """
+        return self._poll(timeout, max_packets, timed=False)
+
+    def _poll(self, timeout, max_packets, timed):
+        """
+        Implementation of poll(), returning messages.TimedPacket (from VMU931Parser.parse_timed()) if `timed` is set.
+        """
+        # Devices with complete frames already buffered (e.g. left over because of max_packets) don't need to wait.
+        buffered = [device_id for device_id, parser in self.parsers.items()
+                    if device_id not in self._pending and parser.pending]
+        if buffered:
+            timeout = 0
+
+        if self._register_ready() and (timeout is None or timeout > 0.1):
+            # Wake up periodically to pick up devices that finish connecting.
+            timeout = 0.1
+
+        ready = set(buffered)
+        for key, _ in self._selector.select(timeout):
+            ready.add(key.data)
+
+        batches = {}
+        for device_id in ready:
+            parser = self.parsers[device_id]
+            if timed:
+                packets = parser.parse_timed(max_packets=max_packets, timeout=0)
+            else:
+                packets = parser.parse_many(max_packets=max_packets, timeout=0)
+            if packets:
+                batches[device_id] = packets
+
+        return batches
+
+    def poll_merged(self, timeout=None, max_packets=None):
+        """
+        Like poll(), but returns a single list of packets tagged with their device id, ordered by host time.
+
+        Each device's clock starts independently, so packets are ordered by the host time at which they were produced,
+        as estimated by each parser's ClockSync from device timestamps and arrival times (see
+        VMU931Parser.parse_timed()). Packets without a timestamp (status packets) keep their position relative to the
+        preceding packet from the same device.
+
+        :param timeout: Maximum time (in seconds) to wait for data. None waits indefinitely.
+        :param max_packets: Maximum number of packets to return per device.
+        :return: list of messages.DevicePacket
+        """
+        keyed = []
+        for device_id, packets in self._poll(timeout, max_packets, timed=True).items():
+            device_keyed = []
+            host_time = packets[0].host_time
+            for timed in packets:
+                if timed.device_time is not None:
+                    # Clock estimates can step back slightly as they're refined; merge needs each input sorted.
+                    host_time = max(host_time, timed.host_time)
+                device_keyed.append((host_time, messages.DevicePacket(device_id, timed.packet)))
+            keyed.append(device_keyed)
+
+        return [packet for _, packet in heapq.merge(*keyed, key=operator.itemgetter(0))]
+
+    def iter_packets(self, timeout=None):
+        """
+        Generator yielding packets from every device as messages.DevicePacket, in batches using poll_merged().
+
+        :param timeout: Maximum time (in seconds) to wait for each batch. None waits indefinitely.
+        """
+        while self.parsers:
+            for packet in self.poll_merged(timeout):
+                yield packet
+
+    def close(self):
+        """
+        Closes every managed device.
+        """
+        for device_id in list(self.parsers):
+            self.remove(device_id).ser.close()
+        self._selector.close()
@@ -21,3 +21,15 @@ Status = namedtuple('Status', ['magnetometer_enabled',
                                'quaternions_streaming',
                                'gyroscope_streaming',
                                'accelerometer_streaming'])
+
+DevicePacket = namedtuple('DevicePacket', ['device_id', 'packet'])
+
+AlignedFrame = namedtuple('AlignedFrame', ['timestamp',
+                                           'accelerometer',
+                                           'gyroscope',
+                                           'magnetometer',
+                                           'euler',
+                                           'quaternion',
+                                           'heading'])
+
+TimedPacket = namedtuple('TimedPacket', ['host_time', 'device_time', 'packet'])
@@ -0,0 +1,122 @@
+import time
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies with power-of-two microsecond buckets: bucket ``i`` counts latencies in
+    ``[2 ** (i - 1), 2 ** i)`` microseconds. Adding a sample is a handful of arithmetic operations, so it is cheap
+    enough to do for every packet.
+    """
+    def __init__(self, buckets=32):
+        """
+        :param buckets: Number of buckets. The last bucket also counts anything larger.
+        """
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds, count=1):
+        """
+        Records a latency.
+
+        :param seconds: Latency in seconds
+        :param count: Number of samples with this latency
+        """
+        bucket = int(seconds * 1e6).bit_length()
+        self.counts[bucket if bucket < len(self.counts) else -1] += count
+        self.count += count
+        self.total += seconds * count
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        Returns an upper bound for the given percentile, at bucket resolution.
+
+        :param fraction: Percentile as a fraction, e.g. 0.99
+        :return: Latency in seconds, or None if nothing has been recorded
+        """
+        if not self.count:
+            return None
+
+        threshold = fraction * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return (1 << bucket) / 1e6
+        return self.max
+
+    def snapshot(self):
+        """
+        :return: dict summarising the histogram. `buckets` maps each bucket's upper bound (in microseconds) to its
+                 count.
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'buckets': {1 << bucket: count for bucket, count in enumerate(self.counts) if count},
+        }
+
+
+class ParserMetrics(object):
+    """
+    Counters and timings describing the work done by a VMU931Parser.
+
+    Framing statistics (packets and bytes per message type, resynchronisations and the packets they cost, bad sizes and
+    footers) are counted by the parser's FrameBuffer; this class adds read/decode/callback time per stage, unknown
+    message types and the latency from data being read from the serial port to the packet being delivered (after any
+    callback has completed).
+    """
+    def __init__(self, frame_buffer):
+        """
+        :param frame_buffer: FrameBuffer used by the parser
+        """
+        self.frame_buffer = frame_buffer
+        self.reset()
+
+    def reset(self):
+        """
+        Resets every counter to zero.
+        """
+        self.frame_buffer.reset_counters()
+        self.reads = 0
+        self.bytes_read = 0
+        self.unknown_types = 0
+        self.read_time = 0.0
+        self.decode_time = 0.0
+        self.callback_time = 0.0
+        self.latency = LatencyHistogram()
+        self.started = time.time()
+
+    def snapshot(self):
+        """
+        Returns the current value of every metric.
+
+        :return: dict of metrics, suitable for exporting (e.g. as JSON)
+        """
+        frame_buffer = self.frame_buffer
+        return {
+            'elapsed': time.time() - self.started,
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+            'packets': {chr(type_byte): count for type_byte, count in enumerate(frame_buffer.frame_counts) if count},
+            'bytes': {chr(type_byte): count for type_byte, count in enumerate(frame_buffer.frame_bytes) if count},
+            'resync_bytes': frame_buffer.skipped_bytes,
+            'resyncs': frame_buffer.resyncs,
+            'resync_packets_lost': frame_buffer.resync_packets_lost,
+            'resync_costs': dict(frame_buffer.resync_costs),
+            'bad_footers': frame_buffer.bad_footers,
+            'bad_sizes': frame_buffer.bad_sizes,
+            'unknown_types': self.unknown_types,
+            'time': {
+                'read': self.read_time,
+                'decode': self.decode_time,
+                'callback': self.callback_time,
+            },
+            'latency': self.latency.snapshot(),
+        }
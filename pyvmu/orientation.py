@@ -0,0 +1,296 @@
+"""
+Vectorised orientation maths over arrays of VMU931 samples. Requires NumPy (install with ``pip install PyVMU[numpy]``).
+
+Conventions follow the device's outputs:
+
+* Quaternions are (w, x, y, z), unit length, and rotate vectors from the sensor (body) frame to the world frame.
+* Euler angles are (x, y, z) = (roll, pitch, yaw) in degrees, applied in yaw, pitch, roll order (Tait-Bryan ZYX), with
+  roll and yaw in [-180, 180) and pitch in [-90, 90].
+* At rest, the accelerometer reads +1 g along the world z axis.
+
+Functions accept structured arrays (e.g. from VMU931Parser.parse_arrays() or CaptureReader.array()), lists of packets
+(messages.Quaternion, messages.Euler...) or plain arrays whose last dimension holds the components, and return plain
+float64 arrays: (..., 4) for quaternions, (..., 3) for vectors and Euler angles, (..., 3, 3) for rotation matrices.
+Batched SLERP is pyvmu.resample.slerp(), also available here as slerp().
+"""
+from pyvmu.resample import slerp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+QUATERNION_FIELDS = ('w', 'x', 'y', 'z')
+VECTOR_FIELDS = ('x', 'y', 'z')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for orientation maths (pip install PyVMU[numpy])")
+
+
+def _components(samples, fields):
+    """
+    Returns samples as a float64 array whose last dimension holds the given fields. No samples (e.g. an empty list
+    returned by VMU931Parser.parse_many()) give a (0, n) array.
+    """
+    _require_numpy()
+    if isinstance(samples, list) and samples and hasattr(samples[0], fields[0]):
+        return np.array([[getattr(sample, field) for field in fields] for sample in samples], dtype=np.float64)
+
+    samples = np.asarray(samples)
+    if samples.dtype.names:
+        return np.stack([samples[field] for field in fields], axis=-1).astype(np.float64)
+
+    if samples.size == 0:
+        return np.empty((0, len(fields)), dtype=np.float64)
+    if samples.shape[-1:] != (len(fields),):
+        raise ValueError("Last dimension must hold {}, got shape {}".format(", ".join(fields), samples.shape))
+    return samples.astype(np.float64)
+
+
+def quaternions(samples):
+    """
+    :param samples: messages.Quaternion packets, structured array with w, x, y and z fields or (..., 4) array
+    :return: (..., 4) array of (w, x, y, z) quaternions
+    """
+    return _components(samples, QUATERNION_FIELDS)
+
+
+def vectors(samples):
+    """
+    :param samples: Packets or structured array with x, y and z fields (e.g. messages.Euler, messages.Accelerometer),
+                    or (..., 3) array
+    :return: (..., 3) array
+    """
+    return _components(samples, VECTOR_FIELDS)
+
+
+def normalize(q):
+    """
+    Scales quaternions to unit length. Zero quaternions become the identity.
+
+    :param q: Quaternions
+    :return: (..., 4) array of unit quaternions
+    """
+    q = quaternions(q)
+    norm = np.linalg.norm(q, axis=-1, keepdims=True)
+    identity = np.zeros_like(q)
+    identity[..., 0] = 1.0
+    return np.divide(q, norm, out=identity, where=norm > 0)
+
+
+def conjugate(q):
+    """
+    Returns the conjugates of quaternions, which for unit quaternions are the inverse rotations.
+
+    :param q: Quaternions
+    :return: (..., 4) array
+    """
+    q = quaternions(q)
+    return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def multiply(q1, q2):
+    """
+    Hamilton product of quaternions, i.e. the rotation `q2` followed by `q1`. Broadcasts, so a single quaternion can be
+    combined with an array of them.
+
+    :param q1: Quaternions
+    :param q2: Quaternions
+    :return: (..., 4) array
+    """
+    w1, x1, y1, z1 = np.moveaxis(quaternions(q1), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(quaternions(q2), -1, 0)
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=-1)
+
+
+def rotate(q, v):
+    """
+    Rotates vectors by unit quaternions, e.g. from the sensor frame to the world frame.
+
+    :param q: Unit quaternions
+    :param v: Vectors, e.g. messages.Accelerometer samples
+    :return: (..., 3) array of rotated vectors
+    """
+    q = quaternions(q)
+    v = vectors(v)
+    w = q[..., :1]
+    u = q[..., 1:]
+    # v' = v + 2w(u x v) + 2u x (u x v), which avoids building rotation matrices.
+    t = 2.0 * np.cross(u, v)
+    return v + w * t + np.cross(u, t)
+
+
+def angle_between(q1, q2):
+    """
+    Returns the angle of the rotation between two orientations, e.g. to compare the device's estimate with another.
+
+    :param q1: Unit quaternions
+    :param q2: Unit quaternions
+    :return: (...) array of angles in degrees, between 0 and 180
+    """
+    # atan2 of the relative rotation's vector and scalar parts is accurate for small angles, unlike arccos.
+    relative = multiply(conjugate(q1), q2)
+    return np.degrees(2.0 * np.arctan2(np.linalg.norm(relative[..., 1:], axis=-1), np.abs(relative[..., 0])))
+
+
+def to_euler(q):
+    """
+    Converts unit quaternions to Euler angles.
+
+    :param q: Unit quaternions
+    :return: (..., 3) array of (roll, pitch, yaw) in degrees
+    """
+    w, x, y, z = np.moveaxis(quaternions(q), -1, 0)
+    roll = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    pitch = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    yaw = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    return np.degrees(np.stack([roll, pitch, yaw], axis=-1))
+
+
+def from_euler(euler):
+    """
+    Converts Euler angles to unit quaternions.
+
+    :param euler: messages.Euler packets, structured array or (..., 3) array of (roll, pitch, yaw) in degrees
+    :return: (..., 4) array of quaternions
+    """
+    half = np.radians(vectors(euler)) / 2.0
+    cr, cp, cy = np.moveaxis(np.cos(half), -1, 0)
+    sr, sp, sy = np.moveaxis(np.sin(half), -1, 0)
+    return np.stack([cr * cp * cy + sr * sp * sy,
+                     sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy], axis=-1)
+
+
+def to_matrix(q):
+    """
+    Converts unit quaternions to rotation matrices.
+
+    :param q: Unit quaternions
+    :return: (..., 3, 3) array of matrices rotating column vectors from the sensor frame to the world frame
+    """
+    w, x, y, z = np.moveaxis(quaternions(q), -1, 0)
+    xx, yy, zz = x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+    return np.stack([np.stack([1.0 - 2.0 * (yy + zz), 2.0 * (xy - wz), 2.0 * (xz + wy)], axis=-1),
+                     np.stack([2.0 * (xy + wz), 1.0 - 2.0 * (xx + zz), 2.0 * (yz - wx)], axis=-1),
+                     np.stack([2.0 * (xz - wy), 2.0 * (yz + wx), 1.0 - 2.0 * (xx + yy)], axis=-1)], axis=-2)
+
+
+def from_matrix(matrix):
+    """
+    Converts rotation matrices to unit quaternions, with w >= 0.
+
+    :param matrix: (..., 3, 3) array of rotation matrices
+    :return: (..., 4) array of quaternions
+    """
+    _require_numpy()
+    m = np.asarray(matrix, dtype=np.float64)
+    if m.size == 0:
+        return np.empty((0, 4), dtype=np.float64)
+    if m.shape[-2:] != (3, 3):
+        raise ValueError("Last two dimensions must hold 3x3 matrices, got shape {}".format(m.shape))
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+
+    # 4 * (w^2, x^2, y^2, z^2). The largest component is computed from its square and the others from the off-diagonal
+    # elements divided by it, which keeps the result accurate for every rotation.
+    squares = np.stack([1.0 + m00 + m11 + m22,
+                        1.0 + m00 - m11 - m22,
+                        1.0 - m00 + m11 - m22,
+                        1.0 - m00 - m11 + m22], axis=-1)
+    largest = np.argmax(squares, axis=-1)
+    s = 2.0 * np.sqrt(np.take_along_axis(squares, largest[..., None], axis=-1)[..., 0])
+
+    differences = (m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1])
+    sums = (m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1])
+    candidates = np.stack([
+        np.stack([s / 4.0, differences[0] / s, differences[1] / s, differences[2] / s], axis=-1),
+        np.stack([differences[0] / s, s / 4.0, sums[0] / s, sums[1] / s], axis=-1),
+        np.stack([differences[1] / s, sums[0] / s, s / 4.0, sums[2] / s], axis=-1),
+        np.stack([differences[2] / s, sums[1] / s, sums[2] / s, s / 4.0], axis=-1),
+    ], axis=-2)
+    q = np.take_along_axis(candidates, largest[..., None, None], axis=-2)[..., 0, :]
+    return np.where(q[..., :1] < 0, -q, q)
+
+
+def euler_to_matrix(euler):
+    """
+    Converts Euler angles to rotation matrices.
+
+    :param euler: messages.Euler packets, structured array or (..., 3) array of (roll, pitch, yaw) in degrees
+    :return: (..., 3, 3) array of rotation matrices
+    """
+    return to_matrix(from_euler(euler))
+
+
+def matrix_to_euler(matrix):
+    """
+    Converts rotation matrices to Euler angles.
+
+    :param matrix: (..., 3, 3) array of rotation matrices
+    :return: (..., 3) array of (roll, pitch, yaw) in degrees
+    """
+    return to_euler(from_matrix(matrix))
+
+
+def remove_gravity(q, accelerometer, gravity=1.0, world=True):
+    """
+    Returns linear acceleration, by removing gravity from accelerometer samples given the orientation at each sample
+    (e.g. from the device's quaternion stream, or pyvmu.fusion).
+
+    :param q: Unit quaternions, one per accelerometer sample
+    :param accelerometer: messages.Accelerometer packets, structured array or (..., 3) array
+    :param gravity: Magnitude of gravity in the accelerometer's units: 1 for g, or
+                    pyvmu.calibration.STANDARD_GRAVITY for m/s^2
+    :param world: Return linear acceleration in the world frame. If False, it is returned in the sensor frame.
+    :return: (..., 3) array of linear acceleration
+    """
+    q = quaternions(q)
+    if world:
+        linear = rotate(q, accelerometer)
+        linear[..., 2] -= gravity
+        return linear
+
+    return vectors(accelerometer) - rotate(conjugate(q), np.array([0.0, 0.0, gravity]))
+
+
+def wrap(angles, low=-180.0, period=360.0):
+    """
+    Wraps angles into [low, low + period), e.g. after filtering or differencing Euler angles.
+
+    :param angles: Angles in degrees
+    :param low: Lower bound of the range. Use 0 for headings.
+    :param period: Period of the angles
+    :return: array of wrapped angles
+    """
+    _require_numpy()
+    return np.mod(np.asarray(angles, dtype=np.float64) - low, period) + low
+
+
+def unwrap(angles, period=360.0, axis=0):
+    """
+    Removes the jumps of wrapped angles (e.g. yaw going from 179 to -179 degrees), so that they vary continuously.
+
+    :param angles: Angles in degrees, in time order along `axis`
+    :param period: Period of the angles
+    :param axis: Axis along which the angles vary in time
+    :return: array of unwrapped angles, starting from the first angle
+    """
+    _require_numpy()
+    angles = np.asarray(angles, dtype=np.float64)
+    steps = np.diff(angles, axis=axis)
+    # Take every step the shortest way round.
+    corrections = np.cumsum(wrap(steps, -period / 2.0, period) - steps, axis=axis)
+    unwrapped = angles.copy()
+    index = [slice(None)] * angles.ndim
+    index[axis] = slice(1, None)
+    unwrapped[tuple(index)] += corrections
+    return unwrapped
+
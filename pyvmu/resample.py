@@ -0,0 +1,378 @@
+"""
+Resampling of VMU931 streams to a uniform rate.
+
+The device's timestamps jitter and packets can be lost, so consumers wanting fixed-rate data can pass each stream
+through a Resampler, which interpolates onto a regular grid (linearly, taking the shortest way round for angles, and by
+SLERP for quaternions), and/or a Decimator, which reduces the rate by an integer factor after low-pass filtering to
+avoid aliasing. Both hold a constant amount of state and are fed one packet at a time. resample_array() and
+decimate_array() do the same over structured arrays (e.g. from VMU931Parser.parse_arrays() or CaptureReader.array()),
+and require NumPy.
+
+Output timestamps are unwrapped device timestamps (see pyvmu.clock), in milliseconds. Resampled timestamps are
+multiples of the sample period, so streams resampled at the same rate line up with each other.
+"""
+import collections
+import math
+import pyvmu.messages as messages
+from pyvmu.clock import TimestampUnwrapper, unwrap_array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Value range of message types whose fields are angles in degrees.
+ANGLE_RANGES = {
+    messages.Euler: (-180.0, 180.0),
+    messages.Heading: (0.0, 360.0),
+}
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch resampling (pip install PyVMU[numpy])")
+
+
+def _slerp(q0, q1, fraction):
+    """
+    Spherical linear interpolation between two (w, x, y, z) unit quaternions, along the shorter arc.
+    """
+    dot = sum(a * b for a, b in zip(q0, q1))
+    if dot < 0:
+        q1 = [-c for c in q1]
+        dot = -dot
+
+    if dot > 0.9995:
+        # Nearly parallel: linear interpolation is accurate and avoids dividing by ~0.
+        result = [a + (b - a) * fraction for a, b in zip(q0, q1)]
+    else:
+        theta = math.acos(dot)
+        sin_theta = math.sin(theta)
+        w0 = math.sin((1.0 - fraction) * theta) / sin_theta
+        w1 = math.sin(fraction * theta) / sin_theta
+        result = [w0 * a + w1 * b for a, b in zip(q0, q1)]
+
+    norm = math.sqrt(sum(c * c for c in result))
+    return [c / norm for c in result]
+
+
+def lowpass_taps(factor, numtaps=None):
+    """
+    Designs a Hamming-windowed sinc low-pass FIR filter suitable for decimating by `factor`.
+
+    :param factor: Decimation factor; the cutoff is the output Nyquist frequency
+    :param numtaps: Number of taps (made odd, so that the filter delays its input by a whole number of samples).
+                    Defaults to 4 * factor + 1.
+    :return: list of taps, summing to 1
+    """
+    numtaps = numtaps or 4 * factor + 1
+    numtaps |= 1
+    cutoff = 0.5 / factor
+    middle = (numtaps - 1) / 2.0
+
+    taps = []
+    for n in range(numtaps):
+        offset = n - middle
+        sinc = 2 * cutoff if offset == 0 else math.sin(2 * math.pi * cutoff * offset) / (math.pi * offset)
+        window = 0.54 - 0.46 * math.cos(2 * math.pi * n / (numtaps - 1)) if numtaps > 1 else 1.0
+        taps.append(sinc * window)
+
+    total = sum(taps)
+    return [tap / total for tap in taps]
+
+
+class _StreamStage(object):
+    """
+    Handling of message types shared by Resampler and Decimator.
+    """
+    def __init__(self, message_type):
+        assert message_type is not messages.Status, "Status packets can't be resampled"
+
+        self.message_type = message_type
+        self.unwrapper = TimestampUnwrapper()
+        self._angle_range = ANGLE_RANGES.get(message_type)
+
+    def _wrap(self, values):
+        """
+        Brings angles back into the message type's range.
+        """
+        if self._angle_range is None:
+            return values
+        low, high = self._angle_range
+        span = high - low
+        return [(value - low) % span + low for value in values]
+
+    def _relative(self, values, reference):
+        """
+        For angles, returns values shifted by whole turns to be within half a turn of reference.
+        """
+        if self._angle_range is None:
+            return values
+        return [ref + (value - ref + 180.0) % 360.0 - 180.0 for value, ref in zip(values, reference)]
+
+    def _packet(self, timestamp, values):
+        return self.message_type(timestamp, *values)
+
+
+class Resampler(_StreamStage):
+    """
+    Interpolates a stream of packets onto a regular grid of timestamps.
+    """
+    def __init__(self, message_type, rate, max_gap=None):
+        """
+        :param message_type: Type of the packets resampled, e.g. messages.Accelerometer
+        :param rate: Output rate, in Hz
+        :param max_gap: Longest gap between input packets (in milliseconds) to interpolate across. Output resumes at
+                        the next grid point after a longer gap. None interpolates across any gap.
+        """
+        super(Resampler, self).__init__(message_type)
+        self.period = 1000.0 / rate
+        self.max_gap = max_gap
+        self._previous = None
+        self._next = None
+
+    def _grid_time(self, index):
+        timestamp = index * self.period
+        return int(timestamp) if self.period.is_integer() else timestamp
+
+    def push(self, packet):
+        """
+        Adds a packet.
+
+        :param packet: Packet of this resampler's message type
+        :return: list of resampled packets up to this packet's timestamp (possibly empty)
+        """
+        timestamp = self.unwrapper.unwrap(packet.timestamp)
+        values = packet[1:]
+        previous = self._previous
+
+        if previous is not None and timestamp <= previous[0]:
+            # Duplicate or out of order.
+            return []
+
+        if previous is None or (self.max_gap is not None and timestamp - previous[0] > self.max_gap):
+            previous = (timestamp, values)
+            self._next = int(math.ceil(timestamp / self.period))
+
+        self._previous = (timestamp, values)
+        start, start_values = previous
+        end_values = self._relative(values, start_values)
+
+        output = []
+        while self._next * self.period <= timestamp:
+            grid_time = self._next * self.period
+            fraction = (grid_time - start) / (timestamp - start) if timestamp != start else 0.0
+            if self.message_type is messages.Quaternion:
+                interpolated = _slerp(start_values, values, fraction)
+            else:
+                interpolated = self._wrap([a + (b - a) * fraction for a, b in zip(start_values, end_values)])
+            output.append(self._packet(self._grid_time(self._next), interpolated))
+            self._next += 1
+
+        return output
+
+
+class Decimator(_StreamStage):
+    """
+    Reduces the rate of a stream by an integer factor, low-pass filtering it first so that higher frequencies don't
+    alias. The input is assumed to be uniformly sampled (e.g. the output of a Resampler).
+
+    Each output packet is stamped with the timestamp of the input packet at the centre of the filter, so outputs lag
+    inputs by half the filter length.
+    """
+    def __init__(self, message_type, factor, numtaps=None):
+        """
+        :param message_type: Type of the packets decimated, e.g. messages.Accelerometer
+        :param factor: Decimation factor: one packet is output for every `factor` input packets
+        :param numtaps: Length of the anti-aliasing filter (see lowpass_taps())
+        """
+        super(Decimator, self).__init__(message_type)
+        self.factor = factor
+        self.taps = lowpass_taps(factor, numtaps)
+        self._window = collections.deque(maxlen=len(self.taps))
+        self._count = 0
+
+    def push(self, packet):
+        """
+        Adds a packet.
+
+        :param packet: Packet of this decimator's message type
+        :return: Decimated packet, or None if this packet doesn't complete one
+        """
+        self._window.append((self.unwrapper.unwrap(packet.timestamp), packet[1:]))
+        self._count += 1
+
+        numtaps = len(self.taps)
+        if self._count < numtaps or (self._count - numtaps) % self.factor:
+            return None
+
+        window = self._window
+        newest = window[-1][1]
+        filtered = [0.0] * len(newest)
+        quaternion = self.message_type is messages.Quaternion
+        for tap, (_, values) in zip(reversed(self.taps), window):
+            if quaternion:
+                # q and -q are the same rotation, so make every sample agree with the newest.
+                if sum(a * b for a, b in zip(values, newest)) < 0:
+                    values = [-value for value in values]
+            else:
+                values = self._relative(values, newest)
+            for index, value in enumerate(values):
+                filtered[index] += tap * value
+
+        if quaternion:
+            norm = math.sqrt(sum(value * value for value in filtered))
+            filtered = [value / norm for value in filtered]
+        else:
+            filtered = self._wrap(filtered)
+
+        return self._packet(window[(numtaps - 1) // 2][0], filtered)
+
+
+def _value_fields(message_type):
+    return list(message_type._fields[1:])
+
+
+def _output_dtype(fields):
+    return np.dtype([('timestamp', 'f8')] + [(name, 'f8') for name in fields])
+
+
+def resample_array(message_type, samples, rate, max_gap=None):
+    """
+    Vectorised equivalent of Resampler. Requires NumPy.
+
+    :param message_type: Type of the samples, e.g. messages.Quaternion
+    :param samples: Structured array with a timestamp field and the message type's fields, in arrival order
+    :param rate: Output rate, in Hz
+    :param max_gap: Longest gap between samples (in milliseconds) to interpolate across, or None
+    :return: structured array of resampled samples, with float64 fields and unwrapped timestamps
+    """
+    _require_numpy()
+
+    fields = _value_fields(message_type)
+    timestamps = unwrap_array(samples['timestamp']).astype(np.float64)
+    values = np.column_stack([samples[name].astype(np.float64) for name in fields]) if len(samples) else \
+        np.empty((0, len(fields)))
+
+    # Drop duplicate and out of order samples, as Resampler does.
+    if len(timestamps):
+        keep = np.ones(len(timestamps), dtype=bool)
+        keep[1:] = timestamps[1:] > np.maximum.accumulate(timestamps)[:-1]
+        timestamps, values = timestamps[keep], values[keep]
+
+    output = np.zeros(0, dtype=_output_dtype(fields))
+    if not len(timestamps):
+        return output
+
+    period = 1000.0 / rate
+    grid = np.arange(math.ceil(timestamps[0] / period), math.floor(timestamps[-1] / period) + 1) * period
+
+    # Segment each grid point falls in; a grid point on the last sample uses the final segment.
+    segment = np.clip(np.searchsorted(timestamps, grid, side='right') - 1, 0, max(len(timestamps) - 2, 0))
+    if len(timestamps) == 1:
+        start = end = timestamps[segment]
+        start_values = end_values = values[segment]
+    else:
+        start, end = timestamps[segment], timestamps[segment + 1]
+        start_values, end_values = values[segment], values[segment + 1]
+
+    valid = (grid >= start) & (grid <= end)
+    if max_gap is not None:
+        # Grid points within a long gap are dropped, but not those falling exactly on the samples either side of it.
+        valid &= (end - start <= max_gap) | (grid == start) | (grid == end)
+    span = end - start
+    fraction = np.divide(grid - start, span, out=np.zeros_like(grid), where=span > 0)
+
+    if message_type is messages.Quaternion:
+        interpolated = slerp(start_values, end_values, fraction)
+    else:
+        delta = end_values - start_values
+        if message_type in ANGLE_RANGES:
+            delta = (delta + 180.0) % 360.0 - 180.0
+        interpolated = start_values + delta * fraction[:, None]
+        if message_type in ANGLE_RANGES:
+            low, high = ANGLE_RANGES[message_type]
+            interpolated = (interpolated - low) % (high - low) + low
+
+    output = np.zeros(int(valid.sum()), dtype=_output_dtype(fields))
+    output['timestamp'] = grid[valid]
+    for index, name in enumerate(fields):
+        output[name] = interpolated[valid, index]
+    return output
+
+
+def decimate_array(message_type, samples, factor, numtaps=None):
+    """
+    Vectorised equivalent of Decimator. Requires NumPy.
+
+    :param message_type: Type of the samples, e.g. messages.Accelerometer
+    :param samples: Uniformly sampled structured array with a timestamp field and the message type's fields
+    :param factor: Decimation factor
+    :param numtaps: Length of the anti-aliasing filter (see lowpass_taps())
+    :return: structured array of decimated samples, with float64 fields and unwrapped timestamps
+    """
+    _require_numpy()
+
+    fields = _value_fields(message_type)
+    taps = np.array(lowpass_taps(factor, numtaps))
+    numtaps = len(taps)
+
+    count = max((len(samples) - numtaps) // factor + 1, 0)
+    output = np.zeros(count, dtype=_output_dtype(fields))
+    if not count:
+        return output
+
+    timestamps = unwrap_array(samples['timestamp']).astype(np.float64)
+    values = np.column_stack([samples[name].astype(np.float64) for name in fields])
+
+    # Input windows ending at each output, shape (count, numtaps, fields).
+    ends = np.arange(count) * factor + numtaps
+    windows = values[ends[:, None] - numtaps + np.arange(numtaps)]
+    newest = windows[:, -1:, :]
+    if message_type is messages.Quaternion:
+        signs = np.where(np.sum(windows * newest, axis=2, keepdims=True) < 0, -1.0, 1.0)
+        windows = windows * signs
+    elif message_type in ANGLE_RANGES:
+        windows = newest + (windows - newest + 180.0) % 360.0 - 180.0
+
+    # The taps are symmetric, so convolution is a weighted sum over each window.
+    filtered = np.einsum('k,nkf->nf', taps, windows)
+    if message_type is messages.Quaternion:
+        filtered /= np.linalg.norm(filtered, axis=1, keepdims=True)
+    elif message_type in ANGLE_RANGES:
+        low, high = ANGLE_RANGES[message_type]
+        filtered = (filtered - low) % (high - low) + low
+
+    output['timestamp'] = timestamps[ends - numtaps + (numtaps - 1) // 2]
+    for index, name in enumerate(fields):
+        output[name] = filtered[:, index]
+    return output
+
+
+def slerp(q0, q1, fraction):
+    """
+    Batched spherical linear interpolation between unit quaternions, along the shorter arc. Requires NumPy.
+
+    :param q0: (N, 4) array of (w, x, y, z) quaternions
+    :param q1: (N, 4) array of (w, x, y, z) quaternions
+    :param fraction: (N,) array of interpolation fractions, 0 giving q0 and 1 giving q1
+    :return: (N, 4) array of interpolated quaternions
+    """
+    _require_numpy()
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    fraction = np.asarray(fraction, dtype=np.float64)[:, None]
+
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    linear = dot > 0.9995
+    safe = np.where(linear, 1.0, sin_theta)
+    w0 = np.where(linear, 1.0 - fraction, np.sin((1.0 - fraction) * theta) / safe)
+    w1 = np.where(linear, fraction, np.sin(fraction * theta) / safe)
+
+    result = w0 * q0 + w1 * q1
+    return result / np.linalg.norm(result, axis=1, keepdims=True)
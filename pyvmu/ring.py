@@ -0,0 +1,62 @@
+class RingBuffer(object):
+    """
+    Fixed-capacity ring buffer for passing packets from a single producer thread to a single consumer thread.
+
+    Storage is preallocated, and no locks are taken: the producer only ever advances the write counter and the consumer
+    only ever advances the read counter, so each side sees a consistent view of the other. If the consumer falls behind
+    and the buffer fills up, new items are dropped (and counted in `dropped`) rather than overwriting unread ones.
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: Maximum number of unread items held
+        """
+        assert capacity > 0, "Capacity must be positive"
+
+        self.capacity = capacity
+        self.dropped = 0
+        self._slots = [None] * capacity
+        self._written = 0
+        self._read = 0
+
+    def __len__(self):
+        return self._written - self._read
+
+    def push(self, item):
+        """
+        Append an item. Must only be called from the producer thread.
+
+        :param item: Item to append
+        :return: True if the item was stored, False if the buffer was full and it was dropped
+        """
+        written = self._written
+        if written - self._read >= self.capacity:
+            self.dropped += 1
+            return False
+
+        self._slots[written % self.capacity] = item
+        self._written = written + 1
+        return True
+
+    def latest(self):
+        """
+        Returns the most recently written item without consuming anything, or None if nothing has been written yet.
+        """
+        written = self._written
+        if not written:
+            return None
+        return self._slots[(written - 1) % self.capacity]
+
+    def drain(self):
+        """
+        Removes and returns every unread item, oldest first. Must only be called from the consumer thread.
+
+        :return: list of items
+        """
+        start = self._read
+        end = self._written
+        capacity = self.capacity
+        slots = self._slots
+
+        items = [slots[i % capacity] for i in range(start, end)]
+        self._read = end
+        return items
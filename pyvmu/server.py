@@ -0,0 +1,562 @@
+"""
+Streaming of live VMU931 data to other processes and hosts over the network.
+
+StreamServer reads from a VMU931Parser and publishes the frames received, batched, to any number of clients over TCP,
+Unix domain sockets and/or UDP multicast. Frames are forwarded exactly as sent by the device, without being decoded,
+and every batch is encoded once and sent as-is to every client, so the server's cost barely depends on the number of
+clients. Each TCP/Unix client has a bounded send queue; a client that falls so far behind that its queue fills up is
+disconnected, rather than slowing the server or the other clients down.
+
+StreamClient connects to a server and returns the same messages as VMU931Parser.parse_many(), or NumPy arrays as
+VMU931Parser.parse_arrays() does.
+
+Each batch starts with a 24 byte header: the magic string ``VMUB``, a uint8 format version, a reserved byte, then
+little-endian uint16 frame count, uint32 sequence number, uint32 length of the frames and float64 host time at which
+the batch's first frame was received (seconds since the epoch). The frames follow, back to back. Over UDP, each
+datagram holds one batch, and gaps in sequence numbers reveal lost datagrams.
+
+The server can be run on its own with ``python -m pyvmu.server`` (see ``--help``).
+"""
+import argparse
+import collections
+import io
+import logging
+import os
+import selectors
+import signal
+import socket
+import struct
+import threading
+import time
+import pyvmu.columnar as columnar
+import pyvmu.decoders as decoders
+
+MAGIC = b'VMUB'
+VERSION = 1
+HEADER = struct.Struct('<4sBxHIId')
+
+DEFAULT_PORT = 9310
+DEFAULT_GROUP = '239.255.93.10'
+
+# Keeps batches within a single Ethernet frame when sent over UDP.
+MAX_BATCH_BYTES = 1472 - HEADER.size
+
+STATUS_TYPE = ord('s')
+
+
+def _split_frames(payload):
+    """
+    Splits the frames of a batch, using the size byte of each.
+    """
+    frames = []
+    position = 0
+    end = len(payload)
+    while position < end:
+        size = payload[position + 1]
+        frames.append(payload[position:position + size])
+        position += size
+    return frames
+
+
+def _parse_address(address, default_host):
+    """
+    Parses a ``host:port`` (or ``port``) command line argument.
+    """
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
+
+
+class _Client(object):
+    """
+    A TCP or Unix domain socket client of a StreamServer, and the batches waiting to be sent to it.
+    """
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.queue = collections.deque()
+
+
+class StreamServer(object):
+    """
+    Publishes the frames received by a VMU931Parser to network clients. Runs on a single thread, waiting on the device
+    and every socket at once with selectors.
+    """
+    def __init__(self, parser, tcp=None, unix=None, multicast=None, multicast_ttl=1, queue_size=64, send_buffer=65536,
+                 batch_interval=0.01, max_batch_bytes=MAX_BATCH_BYTES, poll_interval=0.002):
+        """
+        Opens the listening sockets.
+
+        :param parser: VMU931Parser to read from. It must not be read from by anything else while the server runs.
+        :param tcp: (host, port) to accept TCP clients on. Port 0 picks a free port (see tcp_address).
+        :param unix: Path of a Unix domain socket to accept clients on. Any existing file at that path is replaced.
+        :param multicast: (group, port) to send UDP multicast datagrams to
+        :param multicast_ttl: Time-to-live of multicast datagrams; 1 keeps them on the local network
+        :param queue_size: Maximum number of batches waiting to be sent to a client before it is disconnected
+        :param send_buffer: Size of each client socket's kernel send buffer, which holds data before the send queue
+                            does. Bounding it means slow clients are detected in a reasonable time. None leaves the OS
+                            default, which can grow to megabytes.
+        :param batch_interval: Maximum time (in seconds) frames are held back to be batched with later ones
+        :param max_batch_bytes: Maximum size of the frames of a batch. The default fits a batch in one UDP datagram
+                                without IP fragmentation.
+        :param poll_interval: Interval (in seconds) at which the parser is polled if its transport has no file
+                              descriptor (e.g. a SimulatedTransport)
+        """
+        assert tcp or unix or multicast, "At least one of tcp, unix or multicast must be given"
+
+        self.parser = parser
+        self.queue_size = queue_size
+        self.send_buffer = send_buffer
+        self.batch_interval = batch_interval
+        self.max_batch_bytes = max_batch_bytes
+        self.poll_interval = poll_interval
+        self.clients = set()
+        self.sequence = 0
+        self.batches_sent = 0
+        self.evicted = 0
+        self.tcp_address = None
+        self.unix_path = None
+
+        self._frames = []
+        self._batch_bytes = 0
+        self._batch_time = None
+        self._status_frame = None
+        self._multicast = None
+        self._listeners = []
+        self._selector = selectors.DefaultSelector()
+        self._stop = threading.Event()
+
+        try:
+            if tcp is not None:
+                listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                listener.bind(tcp)
+                self._listen(listener)
+                self.tcp_address = listener.getsockname()
+
+            if unix is not None:
+                if os.path.exists(unix):
+                    os.unlink(unix)
+                listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                listener.bind(unix)
+                self._listen(listener)
+                self.unix_path = unix
+
+            if multicast is not None:
+                sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+                sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+                sender.setblocking(False)
+                self._multicast = (sender, tuple(multicast))
+        except Exception:
+            self.close()
+            raise
+
+        try:
+            self._device_fd = parser.ser.fileno()
+            self._selector.register(self._device_fd, selectors.EVENT_READ, None)
+        except (io.UnsupportedOperation, AttributeError):
+            self._device_fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def _listen(self, listener):
+        self._listeners.append(listener)
+        listener.listen(16)
+        listener.setblocking(False)
+        self._selector.register(listener, selectors.EVENT_READ, listener)
+
+    def append_frame(self, frame):
+        """
+        Adds a frame to the current batch. Called by VMU931Parser.parse_into().
+
+        :param frame: Frame bytes, header and footer included
+        :return: True
+        """
+        if self._batch_bytes + len(frame) > self.max_batch_bytes and self._frames:
+            self._publish()
+        if not self._frames:
+            self._batch_time = time.time()
+
+        self._frames.append(frame)
+        self._batch_bytes += len(frame)
+        if frame[2] == STATUS_TYPE:
+            self._status_frame = frame
+        return True
+
+    def serve_forever(self):
+        """
+        Publishes data until shutdown() is called (from another thread or a signal handler) or close() is called.
+        """
+        self._stop.clear()
+        while not self._stop.is_set():
+            self.serve_once(0.1)
+
+    def shutdown(self):
+        """
+        Makes serve_forever() return after its current iteration.
+        """
+        self._stop.set()
+
+    def serve_once(self, timeout=None):
+        """
+        Waits for data from the device or activity on the sockets (up to `timeout` seconds), handles it and publishes
+        any batch that's due. Can be called in a loop instead of serve_forever(), e.g. to do other work in between.
+
+        :param timeout: Maximum time to wait, in seconds. None waits indefinitely.
+        """
+        if self._frames:
+            due = self._batch_time + self.batch_interval - time.time()
+            timeout = max(due, 0) if timeout is None else max(min(due, timeout), 0)
+        if self._device_fd is None:
+            timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+
+        for key, events in self._selector.select(timeout):
+            if key.data is None:
+                continue
+            elif key.data in self._listeners:
+                self._accept(key.data)
+            else:
+                if events & selectors.EVENT_READ:
+                    self._receive(key.data)
+                if events & selectors.EVENT_WRITE and key.data in self.clients:
+                    self._flush(key.data)
+
+        self.parser.parse_into(self, timeout=0)
+        if self._frames and time.time() - self._batch_time >= self.batch_interval:
+            self._publish()
+
+    def _publish(self):
+        """
+        Sends the current batch to every client.
+        """
+        data = self._encode(self._frames, self.sequence, self._batch_time)
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        self.batches_sent += 1
+        self._frames = []
+        self._batch_bytes = 0
+
+        if self._multicast is not None:
+            sender, group = self._multicast
+            try:
+                sender.sendto(data, group)
+            except OSError as e:
+                # Datagrams may be dropped anyway, and clients notice from the sequence numbers.
+                logging.debug("Failed to send multicast datagram: %s", e)
+
+        for client in list(self.clients):
+            self._send(client, data)
+
+    @staticmethod
+    def _encode(frames, sequence, host_time):
+        payload = b''.join(frames)
+        return HEADER.pack(MAGIC, VERSION, len(frames), sequence, len(payload), host_time) + payload
+
+    def _accept(self, listener):
+        try:
+            sock, address = listener.accept()
+        except BlockingIOError:
+            return
+
+        sock.setblocking(False)
+        if self.send_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, address or self.unix_path)
+        self.clients.add(client)
+        self._selector.register(sock, selectors.EVENT_READ, client)
+        logging.info("Client %s connected", client.address)
+
+        if self._status_frame is None and self.parser.device_status is not None:
+            # No status frame has gone through the server yet (the handshake's are consumed by the parser), so the
+            # status the parser holds is sent instead.
+            self._status_frame = decoders.encode_status(self.parser.device_status)
+
+        if self._status_frame is not None:
+            # Let the client know how the device is configured straight away. The batch reuses the previous sequence
+            # number, so the client doesn't count a gap when the next one arrives.
+            self._send(client, self._encode([self._status_frame], (self.sequence - 1) & 0xFFFFFFFF, time.time()))
+
+    def _receive(self, client):
+        """
+        Clients aren't expected to send anything; reading only detects disconnection.
+        """
+        try:
+            data = client.socket.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._disconnect(client)
+            logging.info("Client %s disconnected", client.address)
+
+    def _send(self, client, data):
+        """
+        Sends a batch to a client, or queues it if the client's socket buffer is full.
+        """
+        if client.queue:
+            if len(client.queue) >= self.queue_size:
+                self._disconnect(client)
+                self.evicted += 1
+                logging.warning("Disconnected client %s, which fell %d batches behind", client.address,
+                                self.queue_size)
+            else:
+                client.queue.append(data)
+            return
+
+        try:
+            sent = client.socket.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._disconnect(client)
+            return
+
+        if sent < len(data):
+            client.queue.append(memoryview(data)[sent:])
+            self._selector.modify(client.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+    def _flush(self, client):
+        """
+        Sends as much of a client's queue as its socket buffer has room for.
+        """
+        queue = client.queue
+        while queue:
+            data = queue[0]
+            try:
+                sent = client.socket.send(data)
+            except BlockingIOError:
+                return
+            except OSError:
+                self._disconnect(client)
+                return
+
+            if sent < len(data):
+                queue[0] = memoryview(data)[sent:]
+                return
+            queue.popleft()
+
+        self._selector.modify(client.socket, selectors.EVENT_READ, client)
+
+    def _disconnect(self, client):
+        self.clients.discard(client)
+        self._selector.unregister(client.socket)
+        client.socket.close()
+        client.queue.clear()
+
+    def close(self):
+        """
+        Disconnects every client and closes the listening sockets. The parser is not closed.
+        """
+        self._stop.set()
+        for client in list(self.clients):
+            self._disconnect(client)
+        for listener in self._listeners:
+            listener.close()
+        self._listeners = []
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+        if self._multicast is not None:
+            self._multicast[0].close()
+            self._multicast = None
+        self._selector.close()
+
+
+class StreamClient(object):
+    """
+    Receives batches of frames published by a StreamServer, over TCP, a Unix domain socket or UDP multicast.
+    """
+    def __init__(self, tcp=None, unix=None, multicast=None, interface='0.0.0.0'):
+        """
+        Connects to a server (or joins its multicast group). Exactly one of `tcp`, `unix` or `multicast` must be given.
+
+        :param tcp: (host, port) of the server
+        :param unix: Path of the server's Unix domain socket
+        :param multicast: (group, port) the server sends to
+        :param interface: Address of the local interface to receive multicast datagrams on
+        """
+        assert len([address for address in (tcp, unix, multicast) if address is not None]) == 1, \
+            "Exactly one of tcp, unix or multicast must be given"
+
+        self.lost = 0
+        self.host_time = None
+        self._sequence = None
+        self._buffer = bytearray()
+        self._datagrams = multicast is not None
+
+        if tcp is not None:
+            self.socket = socket.create_connection(tcp)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        elif unix is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(unix)
+        else:
+            group, port = multicast
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(('', port))
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                   socket.inet_aton(group) + socket.inet_aton(interface))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def receive_frames(self, timeout=None):
+        """
+        Receives the next batch of frames.
+
+        :param timeout: Maximum time (in seconds) to wait. None waits indefinitely.
+        :return: list of frames (bytes, header and footer included), empty if `timeout` expired. self.host_time is set
+                 to the time the server received the batch's first frame.
+        :raises ConnectionError: if the server closed the connection
+        """
+        self.socket.settimeout(timeout)
+        try:
+            if self._datagrams:
+                data = self.socket.recv(65536)
+                header = HEADER.unpack_from(data)
+                payload = data[HEADER.size:HEADER.size + header[4]]
+            else:
+                header, payload = self._read_batch()
+        except socket.timeout:
+            return []
+
+        magic, version, count, sequence, length, host_time = header
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a PyVMU stream (or an unsupported version)")
+
+        if self._sequence is not None:
+            gap = (sequence - self._sequence - 1) & 0xFFFFFFFF
+            if gap < 0x80000000:
+                self.lost += gap
+        self._sequence = sequence
+        self.host_time = host_time
+        return _split_frames(payload)
+
+    def _read_batch(self):
+        """
+        Reads a whole batch from a stream socket. Data received before a timeout is kept for the next call.
+        """
+        buffer = self._buffer
+        length = None
+        while True:
+            if length is None and len(buffer) >= HEADER.size:
+                length = HEADER.size + HEADER.unpack_from(buffer)[4]
+            if length is not None and len(buffer) >= length:
+                header = HEADER.unpack_from(buffer)
+                payload = bytes(buffer[HEADER.size:length])
+                del buffer[:length]
+                return header, payload
+
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            buffer += data
+
+    def parse_many(self, timeout=None):
+        """
+        Receives the next batch and decodes it, like VMU931Parser.parse_many().
+
+        :param timeout: Maximum time (in seconds) to wait. None waits indefinitely.
+        :return: list of packets (namedtuples from pyvmu.messages), empty if `timeout` expired
+        """
+        return [packet for packet in map(decoders.decode, self.receive_frames(timeout)) if packet is not None]
+
+    def parse_arrays(self, timeout=None):
+        """
+        Receives the next batch and decodes it into NumPy structured arrays, like VMU931Parser.parse_arrays(). Requires
+        NumPy.
+
+        :param timeout: Maximum time (in seconds) to wait. None waits indefinitely.
+        :return: dict mapping message type (e.g. messages.Euler) to a structured array
+        """
+        return columnar.decode_frames(self.receive_frames(timeout))
+
+    def iter_packets(self, timeout=None):
+        """
+        Generator yielding packets from the server, until `timeout` passes without any or the server disconnects.
+
+        :param timeout: Maximum time (in seconds) to wait for each batch. None waits indefinitely.
+        """
+        while True:
+            try:
+                packets = self.parse_many(timeout)
+            except ConnectionError:
+                return
+            if not packets:
+                return
+            for packet in packets:
+                yield packet
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.socket.close()
+
+
+def main(argv=None):
+    """
+    Runs a StreamServer for a device from the command line.
+    """
+    # Imported here so that clients don't need pyserial.
+    from pyvmu.vmu931 import VMU931Parser
+
+    argument_parser = argparse.ArgumentParser(description="Publish VMU931 data to network clients.")
+    argument_parser.add_argument('--device', default="/dev/tty.usbmodem1411", help="serial device of the VMU931")
+    argument_parser.add_argument('--simulate', action='store_true', help="stream from a simulated device instead")
+    argument_parser.add_argument('--streams', default='agceqh',
+                                 help="streams to enable: a(ccelerometer), g(yroscope), c(ompass/magnetometer), "
+                                      "e(uler), q(uaternion), h(eading)")
+    argument_parser.add_argument('--tcp', metavar='[HOST:]PORT', help="accept TCP clients on this address")
+    argument_parser.add_argument('--unix', metavar='PATH', help="accept clients on this Unix domain socket")
+    argument_parser.add_argument('--multicast', metavar='[GROUP:]PORT', help="send UDP multicast datagrams")
+    argument_parser.add_argument('--ttl', type=int, default=1, help="multicast time-to-live")
+    argument_parser.add_argument('--queue-size', type=int, default=64,
+                                 help="batches queued per client before it is disconnected")
+    argument_parser.add_argument('--batch-interval', type=float, default=0.01,
+                                 help="maximum time frames are held back for batching, in seconds")
+    argument_parser.add_argument('--verbose', '-v', action='store_true', help="log client connections")
+    args = argument_parser.parse_args(argv)
+
+    if not (args.tcp or args.unix or args.multicast):
+        args.tcp = str(DEFAULT_PORT)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    transport = None
+    if args.simulate:
+        from pyvmu.simulator import SimulatedVMU931
+        from pyvmu.transport import SimulatedTransport
+        transport = SimulatedTransport(SimulatedVMU931(), realtime=True)
+
+    parser = VMU931Parser(device=args.device, transport=transport,
+                          accelerometer='a' in args.streams, gyroscope='g' in args.streams,
+                          magnetometer='c' in args.streams, euler='e' in args.streams,
+                          quaternion='q' in args.streams, heading='h' in args.streams)
+
+    server = StreamServer(parser,
+                          tcp=_parse_address(args.tcp, '0.0.0.0') if args.tcp else None,
+                          unix=args.unix,
+                          multicast=_parse_address(args.multicast, DEFAULT_GROUP) if args.multicast else None,
+                          multicast_ttl=args.ttl, queue_size=args.queue_size, batch_interval=args.batch_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        parser.ser.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Publication of live VMU931 data to other processes through shared memory.
+
+Only one process can own the serial port, so SharedMemoryPublisher writes every sample received into
+multiprocessing.shared_memory ring buffers, one per message type, which any number of SharedMemorySubscriber instances
+in other processes can attach to and read from without copying or serialisation.
+
+Each ring buffer is a shared memory segment named ``<name>_<type character>`` (e.g. ``imu_e`` for Euler angles). It
+starts with a 64 byte header: the magic string ``PYVMUSHM``, then little-endian uint64s holding the sequence counter
+(the number of samples written so far), the capacity and the record size. Records follow, each holding the host
+receive time (little-endian float64) and the message payload exactly as sent by the device, i.e. the same layout as
+CaptureReader.array() returns. Every record is written twice, at slot ``i`` and slot ``i + capacity``, so the latest
+samples are always contiguous and can be returned as a single view.
+
+There is a single writer, which writes a record before incrementing the sequence counter, so readers never see a
+sample before it is complete. Views returned to readers are live, and will be overwritten once the publisher has
+written another `capacity` samples; copy them if they need to be kept.
+
+Subscribers require NumPy.
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+import pyvmu.columnar as columnar
+import pyvmu.decoders as decoders
+
+MAGIC = b'PYVMUSHM'
+HEADER = struct.Struct('<8sQQQ')
+HEADER_SIZE = 64
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+HOST_TIME = struct.Struct('<d')
+
+# Segments created by publishers in this process.
+_published = set()
+
+
+def _type_byte(message_type):
+    """
+    Returns the type byte of a message type, as registered with pyvmu.decoders.
+    """
+    for type_byte, decoder in decoders.DECODERS.items():
+        if decoder.message_type is message_type:
+            return type_byte
+    raise KeyError("{} is not a registered message type".format(message_type.__name__))
+
+
+def segment_name(name, message_type):
+    """
+    :param name: Name passed to the publisher
+    :param message_type: Message type, e.g. messages.Euler
+    :return: Name of the shared memory segment holding that message type
+    """
+    return "{}_{}".format(name, chr(_type_byte(message_type)))
+
+
+class _Ring(object):
+    """
+    Publisher side of one ring buffer.
+    """
+    def __init__(self, name, payload_struct, capacity):
+        self.struct = payload_struct
+        self.payload_size = payload_struct.size
+        self.record_size = HOST_TIME.size + self.payload_size
+        self.capacity = capacity
+        self.sequence = 0
+        self.memory = shared_memory.SharedMemory(name=name, create=True,
+                                                 size=HEADER_SIZE + 2 * capacity * self.record_size)
+        self.buffer = self.memory.buf
+        _published.add(self.memory.name)
+        HEADER.pack_into(self.buffer, 0, MAGIC, 0, capacity, self.record_size)
+
+    def write(self, host_time, payload):
+        slot = self.sequence % self.capacity
+        for offset in (HEADER_SIZE + slot * self.record_size, HEADER_SIZE + (slot + self.capacity) * self.record_size):
+            HOST_TIME.pack_into(self.buffer, offset, host_time)
+            self.buffer[offset + HOST_TIME.size:offset + self.record_size] = payload
+
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+
+class SharedMemoryPublisher(object):
+    """
+    Writes samples into shared memory ring buffers, one per message type.
+
+    Can be passed to VMU931Parser as `recorder`, to publish every frame received while the owning process carries on
+    parsing as usual, or to VMU931Parser.parse_into(), to publish without decoding anything.
+    """
+    def __init__(self, name, capacity=65536, message_types=None):
+        """
+        Creates the shared memory segments.
+
+        :param name: Name prefix of the segments, which subscribers attach with
+        :param capacity: Number of samples held per message type
+        :param message_types: Message types to publish. Defaults to every data message type (status packets are not
+                              published).
+        """
+        self.name = name
+        self.capacity = capacity
+        message_types = list(columnar.FIELDS) if message_types is None else list(message_types)
+
+        self._rings = {}
+        self._by_type_byte = {}
+        try:
+            for message_type in message_types:
+                type_byte = _type_byte(message_type)
+                ring = _Ring(segment_name(name, message_type), decoders.DECODERS[type_byte].struct, capacity)
+                self._rings[message_type] = ring
+                self._by_type_byte[type_byte] = ring
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    def write(self, frame, host_time):
+        """
+        Publishes a frame. Frames of types that aren't published are ignored.
+
+        :param frame: Frame bytes, header and footer included
+        :param host_time: Time the frame was received by the host (seconds since the epoch)
+        """
+        ring = self._by_type_byte.get(frame[2])
+        if ring is None:
+            return False
+
+        start = decoders.PAYLOAD_OFFSET
+        ring.write(host_time, memoryview(frame)[start:start + ring.payload_size])
+        return True
+
+    def append_frame(self, frame):
+        """
+        Publishes a frame, stamped with the current time. Used by VMU931Parser.parse_into().
+
+        :param frame: Frame bytes, header and footer included
+        :return: False if frames of this type aren't published, True otherwise
+        """
+        return self.write(frame, time.time())
+
+    def publish(self, packet, host_time=None):
+        """
+        Publishes a decoded packet.
+
+        :param packet: Packet, e.g. as returned by VMU931Parser.parse()
+        :param host_time: Time the packet was received (seconds since the epoch). Defaults to now.
+        """
+        ring = self._rings[type(packet)]
+        ring.write(time.time() if host_time is None else host_time, ring.struct.pack(*packet))
+
+    def close(self):
+        """
+        Closes and removes the shared memory segments. Attached subscribers keep their mappings until they close.
+        """
+        for ring in self._rings.values():
+            ring.buffer = None
+            ring.memory.close()
+            ring.memory.unlink()
+            _published.discard(ring.memory.name)
+        self._rings = {}
+        self._by_type_byte = {}
+
+
+class SharedMemorySubscriber(object):
+    """
+    Attaches read-only to the ring buffers of a SharedMemoryPublisher, possibly in another process.
+    """
+    def __init__(self, name, message_types=None):
+        """
+        :param name: Name prefix passed to the publisher
+        :param message_types: Message types to attach to. Defaults to every data message type, skipping those that
+                              aren't being published.
+        """
+        columnar._require_numpy()
+        np = columnar.np
+
+        required = message_types is not None
+        message_types = list(columnar.FIELDS) if message_types is None else list(message_types)
+
+        self._memories = []
+        self._headers = {}
+        self._records = {}
+        for message_type in message_types:
+            try:
+                memory = _attach(segment_name(name, message_type))
+            except FileNotFoundError:
+                if required:
+                    self.close()
+                    raise
+                continue
+            self._memories.append(memory)
+
+            magic, _, capacity, record_size = HEADER.unpack_from(memory.buf)
+            if magic != MAGIC:
+                self.close()
+                raise ValueError("{} is not a PyVMU shared memory segment".format(memory.name))
+
+            dtype = np.dtype([('host_time', '<f8')] + columnar.FIELDS[message_type])
+            assert dtype.itemsize == record_size, "Record layout of {} doesn't match".format(message_type.__name__)
+
+            sequence = np.frombuffer(memory.buf, dtype='<u8', count=1, offset=SEQUENCE_OFFSET)
+            records = np.frombuffer(memory.buf, dtype=dtype, count=2 * capacity, offset=HEADER_SIZE)
+            sequence.flags.writeable = False
+            records.flags.writeable = False
+            self._headers[message_type] = (sequence, capacity)
+            self._records[message_type] = records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    @property
+    def message_types(self):
+        """
+        Message types attached to.
+        """
+        return list(self._records)
+
+    def capacity(self, message_type):
+        """
+        :param message_type: Message type, e.g. messages.Euler
+        :return: Number of samples held in that type's ring buffer
+        """
+        return self._headers[message_type][1]
+
+    def sequence(self, message_type):
+        """
+        :param message_type: Message type, e.g. messages.Euler
+        :return: Number of samples of that type published so far
+        """
+        return int(self._headers[message_type][0][0])
+
+    def latest(self, message_type, count):
+        """
+        Returns the latest samples of a message type, oldest first, as a read-only view of the shared memory.
+
+        :param message_type: Message type, e.g. messages.Euler
+        :param count: Number of samples wanted. Fewer are returned if fewer have been published.
+        :return: numpy structured array with `host_time` and the message's fields
+        """
+        return self.read(message_type, self.sequence(message_type) - count)[0]
+
+    def read(self, message_type, since):
+        """
+        Returns the samples of a message type published since a given sequence number, as a read-only view of the
+        shared memory. Used to consume every sample: pass the sequence number returned by the previous call.
+
+        A reader that has fallen more than `capacity` samples behind resumes half a buffer behind the publisher, so
+        that the samples returned aren't immediately overwritten.
+
+        :param message_type: Message type, e.g. messages.Euler
+        :param since: Sequence number of the first sample wanted, e.g. 0 or the value returned by the previous call
+        :return: (samples, next sequence number, number of samples lost because they'd already been overwritten)
+        """
+        sequence, capacity = self._headers[message_type]
+        end = int(sequence[0])
+        start = max(since, 0)
+        if end - start > capacity:
+            start = end - capacity // 2
+        lost = max(start - since, 0)
+
+        slot = start % capacity
+        return self._records[message_type][slot:slot + end - start], end, lost
+
+    def close(self):
+        """
+        Detaches from the shared memory. Any views returned must have been released first.
+        """
+        self._headers = {}
+        self._records = {}
+        for memory in self._memories:
+            memory.close()
+        self._memories = []
+
+
+def _attach(name):
+    """
+    Attaches to an existing shared memory segment without registering it with the resource tracker, which would
+    otherwise remove the segment when this (non-owning) process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no `track` argument.
+        from multiprocessing import resource_tracker
+        memory = shared_memory.SharedMemory(name=name)
+        if memory.name not in _published:
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
@@ -0,0 +1,163 @@
+"""
+Simulated VMU931 device, for developing and benchmarking without hardware.
+
+The simulator speaks the VMU931 serial protocol: it answers ``vars`` with a status frame, handles the stream toggle
+commands (``vara``, ``varg``, ``varc``, ``vare``, ``varq``, ``varh``) and resolution commands (``var0`` to ``var7``),
+and produces frames for every enabled stream at a configurable rate.
+"""
+import logging
+import math
+import struct
+from pyvmu.decoders import (STREAM_BITS, STREAM_FIELDS, GYROSCOPE_RESOLUTION_BITS, ACCELEROMETER_RESOLUTION_BITS,
+                            encode_frame, encode_status)
+
+GYROSCOPE_RESOLUTIONS = {'0': 250, '1': 500, '2': 1000, '3': 2000}
+ACCELEROMETER_RESOLUTIONS = {'4': 2, '5': 4, '6': 8, '7': 16}
+
+
+class SimulatedVMU931(object):
+    """
+    Protocol-level model of a VMU931. Commands are fed in with handle(), and the data the device would send back is
+    produced by handle() (for command responses) and advance() (for streamed data).
+
+    Samples are smooth synthetic motion (a slow rotation about the Z axis with some wobble), so downstream processing
+    sees plausible values.
+    """
+    def __init__(self, rate=1000, streams='', gyroscope_resolution=2000, accelerometer_resolution=16,
+                 low_output_rate=False):
+        """
+        :param rate: Samples per second produced for each enabled stream. Not limited to what real hardware achieves.
+        :param streams: Command characters of streams enabled at power-on, e.g. 'ae' for accelerometer and euler
+        :param gyroscope_resolution: Initial gyroscope resolution: 250, 500, 1000 or 2000
+        :param accelerometer_resolution: Initial accelerometer resolution: 2, 4, 8 or 16
+        :param low_output_rate: Report low output rate in status messages
+        """
+        self.rate = rate
+        self.streaming_bits = 0
+        for stream in streams:
+            self.streaming_bits |= STREAM_BITS[stream]
+        self.gyroscope_resolution = gyroscope_resolution
+        self.accelerometer_resolution = accelerometer_resolution
+        self.low_output_rate = low_output_rate
+        self.time = 0.0
+        self._samples = 0
+        self._command = bytearray()
+
+    @property
+    def streaming(self):
+        """
+        Whether any stream is enabled.
+        """
+        return self.streaming_bits != 0
+
+    def handle(self, data):
+        """
+        Feeds bytes written by the host to the simulated device.
+
+        :param data: Bytes written to the device
+        :return: Bytes the device sends in response
+        """
+        self._command += data
+        response = bytearray()
+
+        while True:
+            start = self._command.find(b'var')
+            if start < 0:
+                # Keep a partial 'var' prefix in case the rest of the command is still to come.
+                del self._command[:max(len(self._command) - 2, 0)]
+                break
+            if start + 3 >= len(self._command):
+                del self._command[:start]
+                break
+
+            command = chr(self._command[start + 3])
+            del self._command[:start + 4]
+
+            if command == 's':
+                response += self.status_frame()
+            elif command in STREAM_BITS:
+                self.streaming_bits ^= STREAM_BITS[command]
+            elif command in GYROSCOPE_RESOLUTIONS:
+                self.gyroscope_resolution = GYROSCOPE_RESOLUTIONS[command]
+            elif command in ACCELEROMETER_RESOLUTIONS:
+                self.accelerometer_resolution = ACCELEROMETER_RESOLUTIONS[command]
+            elif command == 'l':
+                logging.info("Simulated calibration requested")
+            else:
+                logging.warning("Simulator ignoring unknown command var{}".format(command))
+
+        return bytes(response)
+
+    def status_frame(self):
+        """
+        Encodes the current device state as a status frame.
+
+        :return: Frame bytes
+        """
+        resolution = (GYROSCOPE_RESOLUTION_BITS[self.gyroscope_resolution] |
+                      ACCELEROMETER_RESOLUTION_BITS[self.accelerometer_resolution])
+        payload = struct.pack(">BBBI", 0b00000111, resolution, int(self.low_output_rate), self.streaming_bits)
+        return encode_frame('s', payload)
+
+    def advance(self, seconds):
+        """
+        Advances the simulated clock, producing frames for every sample due in that time.
+
+        :param seconds: Simulated time to advance by
+        :return: Bytes the device sends in that time
+        """
+        self.time += seconds
+        due = int(self.time * self.rate)
+        if not self.streaming_bits:
+            self._samples = due
+            return b''
+
+        frames = []
+        bits = self.streaming_bits
+        for sample in range(self._samples, due):
+            frames.append(self.sample_frames(sample / self.rate, bits))
+        self._samples = due
+        return b''.join(frames)
+
+    def sample_frames(self, t, bits=None):
+        """
+        Encodes one sample of every enabled stream.
+
+        :param t: Simulated time of the sample, in seconds
+        :param bits: Streaming bits to use (defaults to the current state)
+        :return: Frame bytes
+        """
+        if bits is None:
+            bits = self.streaming_bits
+
+        ts = int(round(t * 1000)) & 0xFFFFFFFF
+        yaw = math.radians((t * 36.0) % 360.0 - 180.0)
+        roll = 0.1 * math.sin(2 * math.pi * 0.5 * t)
+        pitch = 0.1 * math.cos(2 * math.pi * 0.3 * t)
+        frames = []
+
+        if bits & STREAM_BITS['a']:
+            frames.append(encode_frame('a', struct.pack(">Ifff", ts, math.sin(pitch), -math.sin(roll), 1.0)))
+        if bits & STREAM_BITS['g']:
+            frames.append(encode_frame('g', struct.pack(">Ifff", ts,
+                                                         math.degrees(0.1 * math.pi * math.cos(math.pi * t)),
+                                                         math.degrees(-0.06 * math.pi * math.sin(0.6 * math.pi * t)),
+                                                         36.0)))
+        if bits & STREAM_BITS['c']:
+            frames.append(encode_frame('c', struct.pack(">Ifff", ts, 0.2 * math.cos(yaw), -0.2 * math.sin(yaw), 0.4)))
+        if bits & STREAM_BITS['e']:
+            frames.append(encode_frame('e', struct.pack(">Ifff", ts, math.degrees(roll), math.degrees(pitch),
+                                                         math.degrees(yaw))))
+        if bits & STREAM_BITS['q']:
+            cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+            cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+            cy, sy = math.cos(yaw / 2), math.sin(yaw / 2)
+            frames.append(encode_frame('q', struct.pack(">Iffff", ts,
+                                                         cr * cp * cy + sr * sp * sy,
+                                                         sr * cp * cy - cr * sp * sy,
+                                                         cr * sp * cy + sr * cp * sy,
+                                                         cr * cp * sy - sr * sp * cy)))
+        if bits & STREAM_BITS['h']:
+            frames.append(encode_frame('h', struct.pack(">If", ts, (math.degrees(yaw) + 360.0) % 360.0)))
+
+        return b''.join(frames)
@@ -0,0 +1,244 @@
+"""
+Byte sources and sinks that VMU931Parser can talk to.
+
+Every transport provides the subset of the pyserial interface used by the parser: read(), write(), the `in_waiting`
+and `timeout` properties and close(). Transports backed by a file descriptor also provide fileno().
+"""
+import io
+import os
+import select
+import struct
+import time
+import serial
+from pyvmu.simulator import SimulatedVMU931
+
+try:
+    import fcntl
+    import termios
+    import tty
+except ImportError:
+    # Not available on Windows, where PtyTransport can't be used.
+    fcntl = termios = tty = None
+
+
+class Transport(object):
+    """
+    Base class for transports.
+
+    `timeout` follows pyserial semantics: None makes read() block until `size` bytes are available, 0 makes it return
+    immediately with whatever is available, and a positive number waits at most that many seconds.
+    """
+    timeout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+
+    @property
+    def in_waiting(self):
+        """
+        Number of bytes that can be read without blocking.
+        """
+        raise NotImplementedError
+
+    def read(self, size=1):
+        """
+        Read up to `size` bytes, waiting according to `timeout`.
+
+        :param size: Number of bytes to read
+        :return: bytes read
+        """
+        raise NotImplementedError
+
+    def write(self, data):
+        """
+        Write bytes to the device.
+
+        :param data: Bytes to write
+        :return: Number of bytes written
+        """
+        raise NotImplementedError
+
+    def fileno(self):
+        """
+        File descriptor that can be used with select/selectors/asyncio, if the transport has one.
+        """
+        raise io.UnsupportedOperation("{} has no file descriptor".format(type(self).__name__))
+
+    def close(self):
+        """
+        Close the transport.
+        """
+        pass
+
+
+class SerialTransport(Transport):
+    """
+    Transport over a real serial port, using pyserial.
+    """
+    def __init__(self, device, **kwargs):
+        """
+        :param device: Serial device name (on Windows) or path (nix, including OS X).
+        :param kwargs: Extra arguments for serial.Serial
+        """
+        self.ser = serial.Serial(device, **kwargs)
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.ser.timeout = value
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    def read(self, size=1):
+        return self.ser.read(size)
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def close(self):
+        self.ser.close()
+
+
+class FileTransport(Transport):
+    """
+    Replays a file of raw bytes previously read from a VMU931 (e.g. dumped from the serial port). Anything written is
+    discarded, so commands have no effect. When the end of the file is reached, reads that would block forever raise
+    EOFError instead.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path of the file to replay
+        """
+        self._file = open(path, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    @property
+    def in_waiting(self):
+        return self._size - self._file.tell()
+
+    def read(self, size=1):
+        data = self._file.read(size)
+        if len(data) < size and self.timeout is None:
+            raise EOFError("End of replay file reached")
+        return data
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        self._file.close()
+
+
+class PtyTransport(Transport):
+    """
+    Transport over the master side of a pseudo-terminal. Anything that opens the slave side (whose path is available as
+    `port`) as a serial port, such as a device emulator or a bridge like socat, can then talk to the parser.
+    """
+    def __init__(self):
+        assert tty is not None, "Pseudo-terminals are not supported on this platform"
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('I', fcntl.ioctl(self._master, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        data = bytearray()
+        deadline = None if self.timeout is None else time.time() + self.timeout
+
+        while len(data) < size:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            ready, _, _ = select.select([self._master], [], [], remaining)
+            if not ready:
+                break
+            data += os.read(self._master, size - len(data))
+
+        return bytes(data)
+
+    def write(self, data):
+        return os.write(self._master, data)
+
+    def fileno(self):
+        return self._master
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+
+class SimulatedTransport(Transport):
+    """
+    In-process transport connected to a pyvmu.simulator.SimulatedVMU931, for running without hardware.
+
+    In realtime mode, data is produced at the simulator's configured rate according to the wall clock. Otherwise the
+    simulated clock advances by `step` seconds whenever more data is needed, so data is produced as fast as it can be
+    consumed and runs are fully deterministic (useful for benchmarking).
+    """
+    def __init__(self, simulator=None, realtime=False, step=0.01):
+        """
+        :param simulator: Simulated device. A SimulatedVMU931 with default settings is created if not given.
+        :param realtime: Produce data in real time rather than as fast as possible
+        :param step: Simulated time (in seconds) to advance by when more data is needed, if not in realtime mode
+        """
+        if simulator is None:
+            simulator = SimulatedVMU931()
+
+        self.simulator = simulator
+        self.realtime = realtime
+        self.step = step
+        self._buffer = bytearray()
+        self._last = time.time()
+
+    def _generate(self):
+        """
+        Pulls newly generated data out of the simulator.
+        """
+        if self.realtime:
+            now = time.time()
+            self._buffer += self.simulator.advance(now - self._last)
+            self._last = now
+        else:
+            self._buffer += self.simulator.advance(self.step)
+
+    @property
+    def in_waiting(self):
+        if not self._buffer or self.realtime:
+            self._generate()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+
+        while len(self._buffer) < size:
+            if self.realtime:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                time.sleep(min(self.step, remaining) if remaining is not None else self.step)
+            elif not self.simulator.streaming and self.timeout is not None:
+                # Nothing will ever arrive, so don't spin until the timeout expires.
+                break
+            self._generate()
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        self._buffer += self.simulator.handle(data)
+        return len(data)
@@ -1,14 +1,27 @@
-import serial
 import time
-import struct
 import logging
+import collections
+import threading
+import concurrent.futures
 import pyvmu.messages as messages
+import pyvmu.columnar as columnar
+import pyvmu.decoders as decoders
+from pyvmu.clock import ClockSync
+from pyvmu.framing import FrameBuffer
+from pyvmu.metrics import ParserMetrics
+from pyvmu.ring import RingBuffer
+from pyvmu.transport import SerialTransport
+
+STATUS_TYPE = ord('s')
 
 
 class VMU931Parser(object):
     """
     This class is responsible for communicating with and parsing data from the VMU931 inertial measurement unit. 
     """
+    # Delay between characters of a command: bytes must be sent with a 1ms+ interval to be recognised by the device.
+    command_interval = 0.002
+
     def __init__(self,
                  device="/dev/tty.usbmodem1411",
                  accelerometer=False,
@@ -16,10 +29,23 @@ class VMU931Parser(object):
                  gyroscope=False,
                  euler=False,
                  quaternion=False,
-                 heading=False
+                 heading=False,
+                 block_size=4096,
+                 recorder=None,
+                 transport=None,
+                 command_timeout=1.0,
+                 timeout=None,
+                 lazy=False,
+                 clock=None,
+                 calibration=None
                  ):
         """
         Opens a connection to the VMU931 device
+
+        Once the port is open, we wait for the device to report its status and then configure the requested data
+        streams. If `lazy` is set, this handshake runs on a background thread instead and the constructor returns
+        immediately; `ready` (a concurrent.futures.Future) resolves with the device status once it completes, and
+        methods that need the device to be ready wait for it.
         
         :param device: Serial device name (on Windows) or path (nix, including OS X).
         :param accelerometer: Enable/disable accelerometer data streaming.
@@ -28,170 +54,472 @@ class VMU931Parser(object):
         :param euler: Enable/disable euler angle data streaming.
         :param quaternion: Enable/disable quaternion data streaming.
         :param heading: Enable/disable compass heading data streaming. 
-        """
-        self.ser = serial.Serial(device)
+        :param block_size: Maximum number of bytes to pull from the serial port in a single read.
+        :param recorder: Object with a write(frame, host_time) method (such as pyvmu.capture.CaptureWriter) that every
+                         frame received is passed to, along with the host time it was read at.
+        :param transport: Transport to talk to the device over (see pyvmu.transport), e.g. a SimulatedTransport. If not
+                          given, the serial port named by `device` is opened.
+        :param command_timeout: Maximum time (in seconds) to wait for the device to confirm a command.
+        :param timeout: Maximum time (in seconds) to wait for the device to report its status before raising
+                        TimeoutError. None waits indefinitely.
+        :param lazy: Perform the device handshake in the background rather than in the constructor.
+        :param clock: pyvmu.clock.ClockSync used by parse_timed() to relate device timestamps to host time. A new one
+                      is created if not given.
+        :param calibration: pyvmu.calibration.Calibration correcting accelerometer, gyroscope and magnetometer packets
+                            as they are decoded (by every parse method but parse_into()), according to the resolutions
+                            the device had reported when each packet was received.
+        """
+        self.ser = transport if transport is not None else SerialTransport(device)
+        self.recorder = recorder
+        self.clock = clock if clock is not None else ClockSync()
+        self.calibration = calibration
         self.device_status = None
-        self.parse()
-
-        self.set_accelerometer(accelerometer)
-        self.set_magnetometer(magnetometer)
-        self.set_gyroscope(gyroscope)
-        self.set_euler(euler)
-        self.set_quaternion(quaternion)
-        self.set_heading(heading)
+        self.block_size = block_size
+        self.command_timeout = command_timeout
+        self._status_count = 0
+        self._status_changed = threading.Condition()
+        self._frame_buffer = FrameBuffer()
+        self._frames = collections.deque()
+        # [number of frames, perf_counter() time read] for each chunk of frames in self._frames
+        self._arrivals = collections.deque()
+        # (position, status) for each status frame in self._frames, positions counting every frame ever queued, so
+        # that packets are calibrated with the status in effect when they were received rather than the latest one.
+        self._status_marks = collections.deque()
+        self._frames_queued = 0
+        self._frames_taken = 0
+        self._frame_status = None
+        self.metrics = ParserMetrics(self._frame_buffer)
+        self._reader = None
+        self._reader_error = None
+        self._stop_reading = threading.Event()
+        self._rings = {}
+        self.ready = concurrent.futures.Future()
+        self._connected = False
+
+        streams = dict(accelerometer=accelerometer, magnetometer=magnetometer, gyroscope=gyroscope, euler=euler,
+                       quaternion=quaternion, heading=heading)
+
+        if lazy:
+            threading.Thread(target=self._connect, args=(streams, timeout), name="VMU931Connect", daemon=True).start()
+        else:
+            self._connect(streams, timeout)
+            self.ready.result()
+
+    def _connect(self, streams, timeout):
+        """
+        Waits for the device status and configures the data streams, resolving self.ready once done.
+
+        :param streams: Keyword arguments for configure()
+        :param timeout: Maximum time (in seconds) to wait for the device status. None waits indefinitely.
+        """
+        if not self.ready.set_running_or_notify_cancel():
+            return
+
+        try:
+            deadline = None if timeout is None else time.time() + timeout
+
+            # The request is repeated in case it was missed (e.g. if the device was still starting up).
+            while True:
+                seen = self._status_count
+                self.request_status()
+
+                wait = self.command_timeout if deadline is None else min(self.command_timeout, deadline - time.time())
+                if self._wait_for_status(seen, timeout=wait):
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    raise TimeoutError("No status received from VMU931 within {} seconds".format(timeout))
+
+            # Anything received before we knew what state the device was in is discarded.
+            self._frames.clear()
+            self._arrivals.clear()
+            self._status_marks.clear()
+            self._frames_taken = self._frames_queued
+            self._frame_status = self.device_status
+            self._configure(**streams)
+        except Exception as e:
+            self.ready.set_exception(e)
+        else:
+            self._connected = True
+            self.ready.set_result(self.device_status)
+
+    def wait_ready(self, timeout=None):
+        """
+        Waits for the device handshake to complete. Only needed if the parser was created with `lazy` set; methods that
+        need the device to be ready call this automatically.
+
+        :param timeout: Maximum time (in seconds) to wait. None waits indefinitely.
+        :return: Device status
+        """
+        return self.ready.result(timeout)
+
+    @property
+    def pending(self):
+        """
+        Number of complete frames already read from the device but not yet parsed (e.g. left over because of
+        `max_packets`), which the next parse can return without waiting.
+        """
+        return len(self._frames)
+
+    def _ensure_ready(self):
+        """
+        Cheap check that the device handshake has completed, waiting for it if not.
+        """
+        if not self._connected:
+            self.wait_ready()
 
     def __enter__(self):
         return self
 
     def __exit__(self, t, value, traceback):
+        self.stop()
         self.ser.close()
 
+    def start(self, capacity=4096):
+        """
+        Starts reading from the VMU931 device on a background thread.
+
+        Packets are decoded as soon as they arrive and stored in a ring buffer per message type, so a slow consumer
+        doesn't stall the serial port. Use latest() and drain() to retrieve them, and dropped() to check whether any
+        had to be discarded because a ring buffer was full. parse() and friends must not be called while the
+        background thread is running.
+
+        If reading fails (e.g. the device is unplugged), the thread stops and the exception is raised by the next call
+        to latest(), drain() or stop().
+
+        :param capacity: Number of packets each ring buffer can hold
+        """
+        assert self._reader is None, "Background reader is already running"
+        self._ensure_ready()
+
+        self._rings = {message_type: RingBuffer(capacity) for message_type in (messages.Accelerometer,
+                                                                              messages.Magnetometer,
+                                                                              messages.Gyroscope,
+                                                                              messages.Euler,
+                                                                              messages.Quaternion,
+                                                                              messages.Heading,
+                                                                              messages.Status)}
+        self._reader_error = None
+        self._stop_reading.clear()
+        self._reader = threading.Thread(target=self._read_forever, name="VMU931Reader", daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        """
+        Stops the background reader thread started with start(), if running. Packets already buffered can still be
+        retrieved with drain().
+
+        Raises the exception that stopped the reader thread, if any; once stop() has been called, drain() no longer
+        raises it.
+        """
+        if self._reader is None:
+            return
+
+        self._stop_reading.set()
+        self._reader.join()
+        self._reader = None
+
+        error, self._reader_error = self._reader_error, None
+        if error is not None:
+            raise error
+
+    def latest(self, message_type):
+        """
+        Returns the most recent packet of the given type received by the background reader, without consuming it.
+
+        :param message_type: Message type, e.g. messages.Euler
+        :return: processed packet, or None if no packet of that type has been received
+        """
+        self._check_reader()
+        ring = self._rings.get(message_type)
+        return None if ring is None else ring.latest()
+
+    def drain(self, message_type=None):
+        """
+        Removes and returns every unread packet received by the background reader.
+
+        :param message_type: Message type to drain, e.g. messages.Euler. If None, all types are drained.
+        :return: list of packets (oldest first), or a dict mapping message type to list of packets if `message_type`
+                 is None
+        """
+        self._check_reader()
+        if message_type is None:
+            return {message_type: ring.drain() for message_type, ring in self._rings.items()}
+
+        ring = self._rings.get(message_type)
+        return [] if ring is None else ring.drain()
+
+    def dropped(self):
+        """
+        Returns the number of packets the background reader has had to discard because the consumer fell behind.
+
+        :return: dict mapping message type to number of dropped packets
+        """
+        return {message_type: ring.dropped for message_type, ring in self._rings.items()}
+
+    def _check_reader(self):
+        """
+        Raises the exception that stopped the background reader thread, if any.
+        """
+        if self._reader_error is not None:
+            raise self._reader_error
+
+    def _read_forever(self):
+        """
+        Background reader thread body: decodes packets into the ring buffers until stop() is called, or an exception is
+        raised, which is kept for _check_reader().
+        """
+        rings = self._rings
+        try:
+            while not self._stop_reading.is_set():
+                for packet in self.parse_many(timeout=0.1):
+                    ring = rings.get(type(packet))
+                    if ring is not None:
+                        ring.push(packet)
+        except Exception as e:
+            logging.exception("VMU931 background reader stopped")
+            self._reader_error = e
+            # Wake anything waiting for a status that will now never arrive.
+            with self._status_changed:
+                self._status_changed.notify_all()
+
     def set_quaternion(self, state):
         """
         Enable/disable streaming of quaternion data.
         
         :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
-        assert self.device_status is not None, "Device status is not set"
-
-        if self.device_status.quaternions_streaming != state:
-            self._toggle_quaternion()
+        return self.configure(quaternion=state)
 
     def set_euler(self, state):
         """
         Enable/disable streaming of euler angle data.
         
         :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
-        assert self.device_status is not None, "Device status is not set"
-
-        if self.device_status.euler_streaming != state:
-            self._toggle_euler()
+        return self.configure(euler=state)
 
     def set_accelerometer(self, state):
         """
         Enable/disable streaming of accelerometer data.
         
         :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
-        assert self.device_status is not None, "Device status is not set"
-
-        if self.device_status.accelerometer_streaming != state:
-            self._toggle_accelerometer()
+        return self.configure(accelerometer=state)
 
     def set_magnetometer(self, state):
         """
         Enable/disable streaming of magnetometer data.
         
         :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
-        assert self.device_status is not None, "Device status is not set"
-
-        if self.device_status.magnetometer_streaming != state:
-            self._toggle_magnetometer()
+        return self.configure(magnetometer=state)
 
     def set_gyroscope(self, state):
         """
         Enabled/disable streaming of gyroscope data.
         
         :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
-        assert self.device_status is not None, "Device status is not set"
-
-        if self.device_status.gyroscope_streaming != state:
-            self._toggle_gyroscope()
+        return self.configure(gyroscope=state)
 
     def set_heading(self, state):
         """
         Enable/disable streaming of compass heading data.
         
         :param state: True/False, desired state
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
-        assert self.device_status is not None, "Device status is not set"
-
-        if self.device_status.heading_streaming != state:
-            self._toggle_heading()
+        return self.configure(heading=state)
 
-    def _toggle_quaternion(self):
+    def _toggle_quaternion(self, update_status=True):
         """
         Toggles quaternion output from the VMU931 device.
+
+        :param update_status: Update sensor status after message send (defaults to True)
         """
-        self._send_message("varq")
+        return self._send_message("varq", update_status)
 
-    def _toggle_euler(self):
+    def _toggle_euler(self, update_status=True):
         """
         Toggles quaternion output from the VMU931 device.
+
+        :param update_status: Update sensor status after message send (defaults to True)
         """
-        self._send_message("vare")
+        return self._send_message("vare", update_status)
 
-    def _toggle_heading(self):
+    def _toggle_heading(self, update_status=True):
         """
         Toggles heading output from the VMU931 device.
+
+        :param update_status: Update sensor status after message send (defaults to True)
         """
-        self._send_message("varh")
+        return self._send_message("varh", update_status)
 
-    def _toggle_accelerometer(self):
+    def _toggle_accelerometer(self, update_status=True):
         """
         Toggles accelerometer output from the VMU931 device.
+
+        :param update_status: Update sensor status after message send (defaults to True)
         """
-        self._send_message("vara")
+        return self._send_message("vara", update_status)
 
-    def _toggle_gyroscope(self):
+    def _toggle_gyroscope(self, update_status=True):
         """
         Toggles gyroscope output from the VMU931 device.
+
+        :param update_status: Update sensor status after message send (defaults to True)
         """
-        self._send_message("varg")
+        return self._send_message("varg", update_status)
 
-    def _toggle_magnetometer(self):
+    def _toggle_magnetometer(self, update_status=True):
         """
         Toggles magnetometer output from the VMU931 device.
+
+        :param update_status: Update sensor status after message send (defaults to True)
+        """
+        return self._send_message("varc", update_status)
+
+    def configure(self,
+                  accelerometer=None,
+                  magnetometer=None,
+                  gyroscope=None,
+                  euler=None,
+                  quaternion=None,
+                  heading=None):
+        """
+        Enable/disable several data streams at once. All the toggle commands needed are sent back to back, followed by
+        a single status request, and we then wait for the status confirming the new configuration.
+
+        Streams given as None are left unchanged.
+
+        :param accelerometer: Enable/disable accelerometer data streaming.
+        :param magnetometer: Enable/disable magnetometer data streaming.
+        :param gyroscope: Enable/disable gyroscope data streaming.
+        :param euler: Enable/disable euler angle data streaming.
+        :param quaternion: Enable/disable quaternion data streaming.
+        :param heading: Enable/disable compass heading data streaming.
+        :return: True if the device confirmed the configuration, False if it didn't within command_timeout
+        """
+        self._ensure_ready()
+        return self._configure(accelerometer, magnetometer, gyroscope, euler, quaternion, heading)
+
+    def _configure(self,
+                   accelerometer=None,
+                   magnetometer=None,
+                   gyroscope=None,
+                   euler=None,
+                   quaternion=None,
+                   heading=None):
         """
-        self._send_message("varc")
+        Implementation of configure(), used directly during the device handshake.
+        """
+        assert self.device_status is not None, "Device status is not set"
+
+        changes = [(field, state, toggle) for field, state, toggle in (
+            ('accelerometer_streaming', accelerometer, self._toggle_accelerometer),
+            ('magnetometer_streaming', magnetometer, self._toggle_magnetometer),
+            ('gyroscope_streaming', gyroscope, self._toggle_gyroscope),
+            ('euler_streaming', euler, self._toggle_euler),
+            ('quaternions_streaming', quaternion, self._toggle_quaternion),
+            ('heading_streaming', heading, self._toggle_heading),
+        ) if state is not None and getattr(self.device_status, field) != state]
+
+        if not changes:
+            return True
+
+        seen = self._status_count
+        for _, _, toggle in changes:
+            toggle(update_status=False)
+        self.request_status()
+
+        return self._wait_for_status(seen, lambda status: all(getattr(status, field) == state
+                                                              for field, state, _ in changes))
 
     def set_gyroscope_resolution(self, resolution):
         """
         Sets the gyroscope output resolution of the VMU931 device.
         
         :param resolution: 250, 500, 1000 or 2000.
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
         assert resolution in (250, 500, 1000, 2000), "Invalid gyroscope resolution, must be 250, 500, 1000 or 2000"
 
         mapping = {250: 0, 500: 1, 1000: 2, 2000: 3}
         command = "var{}".format(mapping[resolution])
-        self._send_message(command)
+        return self._send_message(command, confirm=lambda status: status.gyroscope_resolution == resolution)
 
     def set_accelerometer_resolution(self, resolution):
         """
         Sets the accelerometer output resolution of the VMU931 device.
         
         :param resolution: 2, 4, 8 or 16. 
+        :return: True if the device confirmed the change, False if it didn't within command_timeout
         """
         assert resolution in (2, 4, 8, 16), "Invalid accelerometer resolution, must be 2, 4, 8 or 18"
 
         mapping = {2: 4, 4: 5, 8: 6, 16: 7}
         command = "var{}".format(mapping[resolution])
-        self._send_message(command)
+        return self._send_message(command, confirm=lambda status: status.accelerometer_resolution == resolution)
 
-    def _send_message(self, message, update_status=True):
+    def _send_message(self, message, update_status=True, confirm=None):
         """
-        Sends a message to the VMU931 device, with 5ms delay between each character. 
-        
+        Sends a message to the VMU931 device, with `command_interval` delay between each character.
+
+        If `update_status` is set, a status update is then requested, and we wait (for up to `command_timeout`) until
+        it has been received.
+
         :param message: Message to send to device
         :param update_status: Update sensor status after message send (defaults to True)
+        :param confirm: Function called with each status received, returning True once it reflects the message
+        :return: True if the status update was received (or not requested), False if it timed out
         """
-        byte_message = message.encode('ascii')
+        seen = self._status_count
 
-        # bytes must be sent with 1ms+ interval to be recognised by device.
-        for c in byte_message:
-            bs = bytes([c])
-            self.ser.write(bs)
-            logging.debug("Sent {}".format(bs))
-            time.sleep(0.01)
-        time.sleep(0.05)
+        for c in message.encode('ascii'):
+            self.ser.write(bytes([c]))
+            time.sleep(self.command_interval)
 
         if update_status:
             self.request_status()
-            time.sleep(0.100)
+            return self._wait_for_status(seen, confirm)
+
+        return True
+
+    def _wait_for_status(self, seen, confirm=None, timeout=None):
+        """
+        Waits for a status packet to arrive. If the background reader is running, it will receive the status for us;
+        otherwise we read from the device ourselves, and any other packets received are kept for parse().
+
+        :param seen: Value of self._status_count before the status was requested
+        :param confirm: Function called with each status received, returning True once it's the one we want
+        :param timeout: Maximum time (in seconds) to wait. Defaults to `command_timeout`.
+        :return: True if the status was received, False if we timed out
+        """
+        deadline = time.time() + (self.command_timeout if timeout is None else timeout)
+
+        while True:
+            with self._status_changed:
+                if self._status_count > seen:
+                    if confirm is None or confirm(self.device_status):
+                        return True
+                    seen = self._status_count
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logging.warning("Timed out waiting for status from VMU931")
+                    return False
+
+                if self._reader is not None:
+                    self._check_reader()
+                    self._status_changed.wait(remaining)
+                    continue
+
+            self._read_frames(timeout=remaining)
 
     def request_status(self):
         """
@@ -214,9 +542,8 @@ class VMU931Parser(object):
         Parses a single packet from the VMU931 device, returning a namedtuple. Typically called multiple times from
         within a loop.
 
-        If device status is currently known, we wait for an incoming status packet and parse it. This method will block
-        until status is received (so that we're in a known state). This should never happen outside of the automatic
-        call to parse() made during initialisation.
+        If the device handshake is still in progress (see the `lazy` constructor argument), we wait for it to complete
+        first, so that we're in a known state.
         
         When a status packet is received, self.device_status is updated to represent the new state. 
         
@@ -226,64 +553,344 @@ class VMU931Parser(object):
         :param callback: Method to call after processing each packet
         :return: processed packet
         """
-        # If we don't know the current device status, request it
-        if self.device_status is None:
-            self.request_status()
+        self._ensure_ready()
+
+        while not self._frames:
+            self._read_frames()
+
+        metrics = self.metrics
+        (arrival, _), = self._take_arrivals(1)
+        status = self._take_statuses(1)[0][1]
+
+        start = time.perf_counter()
+        data = decoders.decode(self._frames.popleft())
+        if self.calibration is not None and data is not None:
+            data = self.calibration.apply(data, status)
+        decoded = time.perf_counter()
+        metrics.decode_time += decoded - start
+
+        if data is None:
+            metrics.unknown_types += 1
+            return None
+
+        if callback is not None:
+            callback(data)
+            done = time.perf_counter()
+            metrics.callback_time += done - decoded
+        else:
+            done = decoded
+
+        metrics.latency.add(done - arrival)
+        return data
+
+    def parse_many(self, max_packets=None, timeout=None, callback=None):
+        """
+        Parses every packet currently available from the VMU931 device, returning a list of namedtuples.
+
+        Everything waiting on the serial port is read and decoded in one go. If nothing is available, we block until
+        at least one packet arrives or `timeout` expires, in which case an empty list is returned.
+
+        :param max_packets: Maximum number of packets to return. Any remaining packets are kept for the next call.
+        :param timeout: Maximum time (in seconds) to wait for data if none is available. None waits indefinitely,
+                        0 never blocks.
+        :param callback: Method to call after processing each packet
+        :return: list of processed packets
+        """
+        metrics = self.metrics
+        frames = self._collect_frames(max_packets, timeout)
+        arrivals = self._take_arrivals(len(frames))
+        statuses = self._take_statuses(len(frames))
+
+        start = time.perf_counter()
+        packets = [packet for packet in self._decode_frames(frames, statuses) if packet is not None]
+        decoded = time.perf_counter()
+        metrics.decode_time += decoded - start
+        metrics.unknown_types += len(frames) - len(packets)
+
+        if callback is not None:
+            for packet in packets:
+                callback(packet)
+            done = time.perf_counter()
+            metrics.callback_time += done - decoded
+        else:
+            done = decoded
+
+        # Latency is measured to the end of the batch, so is an upper bound for packets early in the batch.
+        for arrival, count in arrivals:
+            metrics.latency.add(done - arrival, count)
+
+        return packets
+
+    def parse_timed(self, max_packets=None, timeout=None):
+        """
+        Like parse_many(), but returns each packet as a messages.TimedPacket, with its timestamp unwrapped to a
+        monotonic value and an estimate of the host epoch time at which it was produced, from self.clock.
+
+        Packets read together share an arrival time, so only the newest of them is used to update the clock estimate.
+
+        :param max_packets: Maximum number of packets to return. Any remaining packets are kept for the next call.
+        :param timeout: Maximum time (in seconds) to wait for data if none is available. None waits indefinitely,
+                        0 never blocks.
+        :return: list of messages.TimedPacket
+        """
+        frames = self._collect_frames(max_packets, timeout)
+        arrivals = self._take_arrivals(len(frames))
+        decoded = self._decode_frames(frames, self._take_statuses(len(frames)))
+
+        clock = self.clock
+        # Arrival times are taken from perf_counter(), so are converted to epoch time here.
+        epoch_offset = time.time() - time.perf_counter()
+        timed = []
+        position = 0
+        for arrival, count in arrivals:
+            packets = [packet for packet in decoded[position:position + count] if packet is not None]
+            position += count
+
+            newest = None
+            for packet in packets:
+                if getattr(packet, 'timestamp', None) is not None:
+                    newest = packet
+            if newest is not None:
+                clock.observe(newest.timestamp, arrival + epoch_offset)
+
+            for packet in packets:
+                if getattr(packet, 'timestamp', None) is not None:
+                    timed.append(clock.stamp(packet))
+                else:
+                    timed.append(messages.TimedPacket(arrival + epoch_offset, None, packet))
+
+        return timed
+
+    def parse_arrays(self, max_packets=None, timeout=None):
+        """
+        Parses every packet currently available from the VMU931 device into NumPy structured arrays, one per message
+        type. Each array has big-endian fields named after the matching namedtuple in pyvmu.messages.
+
+        Requires NumPy. Status packets are not included in the result, but still update self.device_status.
+
+        :param max_packets: Maximum number of packets to decode. Any remaining packets are kept for the next call.
+        :param timeout: Maximum time (in seconds) to wait for data if none is available. None waits indefinitely,
+                        0 never blocks.
+        :return: dict mapping message type (e.g. messages.Euler) to a structured array
+        """
+        frames = self._collect_frames(max_packets, timeout)
+        self._take_arrivals(len(frames))
+        statuses = self._take_statuses(len(frames))
+
+        start = time.perf_counter()
+        if self.calibration is None:
+            arrays = columnar.decode_frames(frames)
+        else:
+            # Each run of frames received under the same status is decoded and corrected separately.
+            parts = {}
+            for first, last, status in self._status_runs(statuses, len(frames)):
+                for message_type, array in self.calibration.apply_arrays(columnar.decode_frames(frames[first:last]),
+                                                                         status).items():
+                    parts.setdefault(message_type, []).append(array)
+            arrays = {message_type: chunks[0] if len(chunks) == 1 else columnar.np.concatenate(chunks)
+                      for message_type, chunks in parts.items()}
+        self.metrics.decode_time += time.perf_counter() - start
+        return arrays
+
+    def parse_into(self, history, max_packets=None, timeout=None):
+        """
+        Stores every packet currently available from the VMU931 device in a pyvmu.history.PacketHistory, copying each
+        payload straight into the history's preallocated storage without creating any per-packet objects. Payloads are
+        stored as received, so self.calibration isn't applied.
+
+        :param history: PacketHistory to fill, or any object with a compatible append_frame() method (such as
+                        pyvmu.shm.SharedMemoryPublisher)
+        :param max_packets: Maximum number of packets to store. Any remaining packets are kept for the next call.
+        :param timeout: Maximum time (in seconds) to wait for data if none is available. None waits indefinitely,
+                        0 never blocks.
+        :return: number of packets stored
+        """
+        frames = self._collect_frames(max_packets, timeout)
+        self._take_arrivals(len(frames))
+        self._take_statuses(len(frames))
+
+        start = time.perf_counter()
+        stored = 0
+        for frame in frames:
+            if history.append_frame(frame):
+                stored += 1
+        self.metrics.decode_time += time.perf_counter() - start
+        self.metrics.unknown_types += len(frames) - stored
+        return stored
+
+    def iter_packets(self, batch_size=None, timeout=None):
+        """
+        Generator yielding packets from the VMU931 device, decoded in batches using parse_many().
+
+        :param batch_size: Maximum number of packets to decode per batch.
+        :param timeout: Stop iterating if no packet is received within this many seconds. None iterates forever.
+        """
+        while True:
+            packets = self.parse_many(max_packets=batch_size, timeout=timeout)
+            if not packets:
+                return
+            for packet in packets:
+                yield packet
+
+    def _collect_frames(self, max_packets=None, timeout=None):
+        """
+        Reads everything available from the serial port and returns the complete frames received, waiting up to
+        `timeout` seconds if there are none.
+
+        :param max_packets: Maximum number of frames to return. Any remaining frames are kept for the next call.
+        :param timeout: Maximum time (in seconds) to wait for data if none is available. None waits indefinitely.
+        :return: list of frames
+        """
+        self._ensure_ready()
+
+        deadline = None if timeout is None else time.time() + timeout
 
-        # Loop until we get a status packet. Will normally only loop once per call.
         while True:
-            # Find start of data message -- we might start processing data mid-stream so need to synchronise.
-            # We are looking for the magic byte 0x01. There's a chance that this will be randomly encountered, but
-            # we also check the footer value.
-            message_start = self.ser.read()[0]
-            while message_start != 0x01:
-                logging.debug("Skipping invalid message_start, got {} expected 0x01".format(hex(message_start)))
-                message_start = self.ser.read()[0]
-                continue
-
-            message_size = self.ser.read()[0] - 4  # Unsure why we have to subtract 4bytes from this... but we do.
-            logging.debug("Message size: {}".format(message_size))
-            message_type = chr(self.ser.read()[0])
-            logging.debug("Message type: {}".format(message_type))
-            message_text = self.ser.read(message_size)
-            message_end = self.ser.read()[0]
-
-            # If we have an invalid footer, skip this packet, otherwise continue.
-            if message_end != 0x04:
-                logging.warning(
-                    "Invalid Message footer (was {}, expected 0x04), skipping this packet".format(message_end))
+            # Pull in everything the OS has buffered for us before returning (but no more, in case data is arriving
+            # faster than we can read it).
+            waiting = self.ser.in_waiting
+            while waiting > 0 and (max_packets is None or len(self._frames) < max_packets):
+                waiting -= self._read_frames()
+
+            if self._frames:
+                count = len(self._frames) if max_packets is None else min(max_packets, len(self._frames))
+                return [self._frames.popleft() for _ in range(count)]
+
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return []
+            self._read_frames(timeout=remaining)
+
+    def _take_arrivals(self, count):
+        """
+        Removes the arrival times of the next `count` frames taken from self._frames.
+
+        :param count: Number of frames taken
+        :return: list of (perf_counter() time read, number of frames) pairs
+        """
+        taken = []
+        arrivals = self._arrivals
+        while count:
+            entry = arrivals[0]
+            if entry[0] <= count:
+                arrivals.popleft()
+                taken.append((entry[1], entry[0]))
+                count -= entry[0]
             else:
-                data = None
-
-                if message_type == 'e':
-                    logging.info("Parsing Euler")
-                    data = VMU931Parser._parse_euler(message_text)
-                elif message_type == 'q':
-                    logging.info("Parsing Quaternion")
-                    data = VMU931Parser._parse_quaternion(message_text)
-                elif message_type == 'h':
-                    logging.info("Parsing Heading")
-                    data = VMU931Parser._parse_heading(message_text)
-                elif message_type == 'a':
-                    logging.info("Parsing Accelerometer")
-                    data = VMU931Parser._parse_accelerometer(message_text)
-                elif message_type == 'g':
-                    logging.info("Parsing Gyroscope")
-                    data = VMU931Parser._parse_gyroscope(message_text)
-                elif message_type == 'c':
-                    logging.info("Parsing Magnetometer")
-                    data = VMU931Parser._parse_magnetometer(message_text)
-                elif message_type == 's':
-                    logging.info("Parsing status message")
-                    data = VMU931Parser._parse_status(message_text)
-                    self.device_status = data
-                else:
-                    logging.warning("No parser for {}".format(message_type))
+                entry[0] -= count
+                taken.append((entry[1], count))
+                count = 0
+        return taken
+
+    def _take_statuses(self, count):
+        """
+        Removes the status changes among the next `count` frames taken from self._frames.
+
+        :param count: Number of frames taken
+        :return: list of (index among the frames taken, status) pairs, starting with the status in effect for the first
+                 frame. A status frame takes effect from its own index.
+        """
+        taken = self._frames_taken
+        statuses = [(0, self._frame_status)]
+        marks = self._status_marks
+        while marks and marks[0][0] < taken + count:
+            position, status = marks.popleft()
+            statuses.append((position - taken, status))
+
+        self._frame_status = statuses[-1][1]
+        self._frames_taken = taken + count
+        return statuses
+
+    @staticmethod
+    def _status_runs(statuses, count):
+        """
+        Splits `count` frames into runs received under the same status.
+
+        :param statuses: Status changes, as returned by _take_statuses()
+        :param count: Number of frames
+        :return: list of (first index, index after the last, status) tuples
+        """
+        bounds = [index for index, _ in statuses[1:]] + [count]
+        return [(first, last, status) for (first, status), last in zip(statuses, bounds) if first < last]
 
-                if self.device_status is not None:
-                    if callback is not None and data is not None:
-                        callback(data)
-                    return data
+    def _decode_frames(self, frames, statuses):
+        """
+        Decodes frames, correcting packets with self.calibration according to the status each frame was received
+        under.
+
+        :param frames: Frames to decode
+        :param statuses: Status changes among `frames`, as returned by _take_statuses()
+        :return: list with the packet decoded from each frame, or None where the message type is unknown
+        """
+        decoded = list(map(decoders.decode, frames))
+        if self.calibration is not None:
+            for first, last, status in self._status_runs(statuses, len(frames)):
+                decoded[first:last] = self.calibration.apply_many(decoded[first:last], status)
+        return decoded
+
+    def _read_frames(self, timeout=None):
+        """
+        Reads a chunk of data from the serial port and queues any complete frames it contains.
+
+        Everything already waiting in the OS buffer (up to `block_size` bytes) is read in one call. If nothing is
+        waiting, we wait for at least one byte to arrive.
+
+        :param timeout: Maximum time (in seconds) to wait if no data is waiting. None waits indefinitely.
+        :return: number of bytes read
+        """
+        metrics = self.metrics
+        waiting = self.ser.in_waiting
+        if waiting:
+            start = time.perf_counter()
+            data = self.ser.read(min(waiting, self.block_size))
+            metrics.read_time += time.perf_counter() - start
+        elif timeout is None:
+            data = self.ser.read(1)
+        else:
+            previous_timeout = self.ser.timeout
+            self.ser.timeout = timeout
+            try:
+                data = self.ser.read(1)
+            finally:
+                self.ser.timeout = previous_timeout
+
+        arrival = time.perf_counter()
+        metrics.reads += 1
+        metrics.bytes_read += len(data)
+
+        self._frame_buffer.feed(data)
+        frames = self._frame_buffer.frames()
+        if frames:
+            self._arrivals.append([len(frames), arrival])
+
+        for index, frame in enumerate(frames):
+            if frame[2] == STATUS_TYPE:
+                self._status_marks.append((self._frames_queued + index, self._update_status(frame)))
+
+        self._frames.extend(frames)
+        self._frames_queued += len(frames)
+
+        # Recorded last, so that should the recorder fail, the frames are still queued for parsing.
+        if self.recorder is not None and frames:
+            host_time = time.time()
+            for frame in frames:
+                self.recorder.write(frame, host_time)
+        return len(data)
+
+    def _update_status(self, frame):
+        """
+        Updates self.device_status from a status frame as soon as it is received (rather than when parse() returns it),
+        and wakes anything waiting for it.
+
+        :param frame: Status frame
+        :return: the new status
+        """
+        status = decoders.decode(frame)
+        with self._status_changed:
+            self.device_status = status
+            self._status_count += 1
+            self._status_changed.notify_all()
+        return status
 
     @staticmethod
     def _parse_status(data):
@@ -294,57 +901,7 @@ class VMU931Parser(object):
         :param data: Bytes to process
         :return: Device Status
         """
-        status, res, low_output, data = struct.unpack(">BBBI", data[:7])
-
-        mag_status = status & 0b00000100 != 0
-        gyro_status = status & 0b00000010 != 0
-        acc_status = status & 0b00000001 != 0
-
-        gyro_res = None
-
-        if res & 0b10000000 != 0:
-            gyro_res = 2000
-        elif res & 0b01000000 != 0:
-            gyro_res = 1000
-        elif res & 0b00100000 != 0:
-            gyro_res = 500
-        elif res & 0b00010000 != 0:
-            gyro_res = 250
-
-        acc_res = None
-
-        if res & 0b00001000 != 0:
-            acc_res = 16
-        elif res & 0b000000100 != 0:
-            acc_res = 8
-        elif res & 0b00000010 != 0:
-            acc_res = 4
-        elif res & 0b00000001 != 0:
-            acc_res = 2
-
-        low_output_rate = low_output & 0b00000001 != 0
-
-        heading_streaming = data & 0b01000000 != 0
-        euler_streaming = data & 0b00010000 != 0
-        mag_streaming = data & 0b00001000 != 0
-        quat_streaming = data & 0b00000100 != 0
-        gyro_streaming = data & 0b00000010 != 0
-        acc_streaming = data & 0b00000001 != 0
-
-        return messages.Status(
-            magnetometer_enabled=mag_status,
-            gyroscope_enabled=gyro_status,
-            accelerometer_enabled=acc_status,
-            gyroscope_resolution=gyro_res,
-            accelerometer_resolution=acc_res,
-            low_output_rate=low_output_rate,
-            heading_streaming=heading_streaming,
-            euler_streaming=euler_streaming,
-            magnetometer_streaming=mag_streaming,
-            quaternions_streaming=quat_streaming,
-            gyroscope_streaming=gyro_streaming,
-            accelerometer_streaming=acc_streaming
-        )
+        return decoders.decode_payload('s', data)
 
     @staticmethod
     def _parse_quaternion(data):
@@ -354,8 +911,7 @@ class VMU931Parser(object):
         :param data: Bytes to parse
         :return: Parsed quaternion packet
         """
-        ts, w, x, y, z = struct.unpack(">Iffff", data[:20])
-        return messages.Quaternion(timestamp=ts, w=w, x=x, y=y, z=z)
+        return decoders.decode_payload('q', data)
 
     @staticmethod
     def _parse_euler(data):
@@ -365,8 +921,7 @@ class VMU931Parser(object):
         :param data: Bytes to parse
         :return: Parsed euler angle packet
         """
-        ts, x, y, z = struct.unpack(">Ifff", data[:16])
-        return messages.Euler(timestamp=ts, x=x, y=y, z=z)
+        return decoders.decode_payload('e', data)
 
     @staticmethod
     def _parse_accelerometer(data):
@@ -376,8 +931,7 @@ class VMU931Parser(object):
         :param data: Bytes to parse
         :return: Parsed euler angle packet
         """
-        ts, x, y, z = struct.unpack(">Ifff", data[:16])
-        return messages.Accelerometer(timestamp=ts, x=x, y=y, z=z)
+        return decoders.decode_payload('a', data)
 
     @staticmethod
     def _parse_magnetometer(data):
@@ -387,8 +941,7 @@ class VMU931Parser(object):
         :param data: Bytes to parse
         :return: Parsed magnetometer packet
         """
-        ts, x, y, z = struct.unpack(">Ifff", data[:16])
-        return messages.Magnetometer(timestamp=ts, x=x, y=y, z=z)
+        return decoders.decode_payload('c', data)
 
     @staticmethod
     def _parse_gyroscope(data):
@@ -398,8 +951,7 @@ class VMU931Parser(object):
         :param data: Bytes to parse
         :return: Parsed gyroscope packet
         """
-        ts, x, y, z = struct.unpack(">Ifff", data[:16])
-        return messages.Gyroscope(timestamp=ts, x=x, y=y, z=z)
+        return decoders.decode_payload('g', data)
 
     @staticmethod
     def _parse_heading(data):
@@ -409,5 +961,4 @@ class VMU931Parser(object):
         :param data: Bytes to parse
         :return: Parsed compass heading packet
         """
-        ts, h = struct.unpack(">If", data[:8])
-        return messages.Heading(timestamp=ts, h=h)
+        return decoders.decode_payload('h', data)
@@ -17,5 +17,10 @@ setup(
     install_requires=[
         'pyserial',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'parquet': ['numpy', 'pyarrow'],
+        'hdf5': ['numpy', 'h5py'],
+    },
     packages=['pyvmu'],
 )
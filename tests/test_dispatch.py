@@ -0,0 +1,40 @@
+import time
+
+from pyvmu.dispatch import Dispatcher
+from pyvmu.messages import Euler
+
+
+def test_threaded_subscribers_share_workers():
+    """
+    With more busy threaded subscribers than workers, every subscriber still receives packets while the others'
+    queues are full.
+    """
+    def slow(packet):
+        time.sleep(0.001)
+
+    dispatcher = Dispatcher(max_workers=2)
+    subscriptions = [dispatcher.subscribe(slow, threaded=True, queue_size=50) for _ in range(3)]
+
+    deadline = time.time() + 0.5
+    timestamp = 0
+    while time.time() < deadline:
+        dispatcher.dispatch(Euler(timestamp, 0.0, 0.0, 0.0))
+        timestamp += 1
+        time.sleep(0.0001)
+
+    delivered = [subscription.delivered for subscription in subscriptions]
+    dispatcher.close()
+
+    assert all(count > 0 for count in delivered), delivered
+    assert all(subscription.dropped > 0 for subscription in subscriptions)
+
+
+def test_close_delivers_queued_packets():
+    received = []
+    dispatcher = Dispatcher(max_workers=1)
+    dispatcher.subscribe(received.append, threaded=True)
+    packets = [Euler(timestamp, 0.0, 0.0, 0.0) for timestamp in range(1000)]
+    dispatcher.dispatch_many(packets)
+    dispatcher.close()
+
+    assert received == packets
@@ -0,0 +1,47 @@
+import struct
+
+import pyvmu.decoders as decoders
+from pyvmu.framing import FrameBuffer
+
+
+def _accelerometer(timestamp, extra=b''):
+    return decoders.encode_frame('a', struct.pack('>Ifff', timestamp, 0.0, 0.0, 1.0) + extra)
+
+
+def _timestamps(frames):
+    return [decoders.decode(frame).timestamp for frame in frames]
+
+
+def test_corrupted_size_while_synced():
+    """
+    A corrupted size byte landing on a later frame's footer mustn't swallow that frame.
+    """
+    stream = bytearray(b''.join(_accelerometer(timestamp) for timestamp in range(20)))
+    corrupted = 5 * len(_accelerometer(0))
+    stream[corrupted + 1] = 40
+
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(bytes(stream))
+    frames = frame_buffer.frames()
+
+    assert _timestamps(frames) == [timestamp for timestamp in range(20) if timestamp != 5]
+    assert frame_buffer.bad_sizes == 1
+    assert frame_buffer.resyncs == 1
+
+
+def test_longer_frames():
+    """
+    Frames longer than their type's payload are accepted, whether or not the buffer is in sync.
+    """
+    extended = [_accelerometer(timestamp, b'\x00\x00\x00\x09') for timestamp in range(5)]
+
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(b'\x07\x01' + b''.join(extended))
+    frames = frame_buffer.frames()
+
+    # The last frame is held back until the frame following it confirms it.
+    assert frames == extended[:4]
+    assert frame_buffer.bad_sizes == 0
+
+    frame_buffer.feed(_accelerometer(5))
+    assert _timestamps(frame_buffer.frames()) == [4, 5]